@@ -0,0 +1,104 @@
+## Microbenchmark of cleaner.py. It compares the original promotional phrases filter, that checks every phrase against
+# every sentence, with the precompiled PromoMatcher used by the Cleaner, and the row by row clean_text with the vectorized
+# clean_series. For each pair it checks that both give exactly the same output and reports the time spent by each one.
+#
+# Usage: python benchmark_cleaner.py [corpus_dir] [repetitions]
+#   [corpus_dir]: Directory with the article bodies, one '.txt' file per article. If not given, a synthetic corpus of long
+#                 article bodies is generated.
+#   [repetitions]: Number of times the corpus is filtered by each implementation (default 3).
+
+import os
+import re
+import sys
+import time
+import random
+import pandas as pd
+from cleaner import Cleaner, PromoMatcher, promo_phrases
+
+#Sentences are split with a simple regex for the comparison of the promotional phrases filters
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+def load_corpus(corpus_dir):
+    """
+    Loads the article bodies saved in the directory.
+    """
+    corpus = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith(".txt"):
+            with open(os.path.join(corpus_dir, name), encoding="utf-8") as text_file:
+                corpus.append(text_file.read())
+    return corpus
+
+def generate_corpus(n_articles=200, sentences_per_article=80, promo_rate=0.05, seed=0):
+    """
+    Generates long article bodies, with a small fraction of sentences containing a promotional phrase.
+    """
+    rng = random.Random(seed)
+    words = ("the government said on Tuesday that markets reacted to new data about inflation and growth while analysts "
+             "expect further rate decisions from the central bank later this year amid strong demand").split()
+    corpus = []
+    for _ in range(n_articles):
+        sentences = []
+        for _ in range(sentences_per_article):
+            sentence = " ".join(rng.choice(words) for _ in range(rng.randint(12, 30)))
+            if rng.random() < promo_rate:
+                sentence += " " + rng.choice(promo_phrases).upper()
+            sentences.append(sentence.capitalize() + ".")
+        corpus.append(" ".join(sentences))
+    return corpus
+
+def reference_filter(sentences):
+    return [sentence for sentence in sentences if not any(promo.lower() in sentence.lower() for promo in promo_phrases)]
+
+def matcher_filter(sentences, matcher):
+    return [sentence for sentence in sentences if not matcher.matches(sentence)]
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 3:
+        print("Usage: python benchmark_cleaner.py [corpus_dir] [repetitions]")
+        sys.exit(1)
+
+    corpus = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else generate_corpus()
+    repetitions = int(sys.argv[2]) if len(sys.argv) == 3 else 3
+    if not corpus:
+        print("The corpus directory has no '.txt' files.")
+        sys.exit(1)
+
+    articles = [SENTENCE_END.split(text) for text in corpus]
+    n_sentences = sum(len(sentences) for sentences in articles)
+    print(f"Corpus: {len(corpus)} articles, {n_sentences} sentences, {len(promo_phrases)} promotional phrases")
+
+    start = time.perf_counter()
+    matcher = PromoMatcher(promo_phrases)
+    print(f"PromoMatcher built in {1000 * (time.perf_counter() - start):.2f} ms")
+
+    #Equivalence against the original filter
+    different = sum(reference_filter(sentences) != matcher_filter(sentences, matcher) for sentences in articles)
+    print(f"{len(articles) - different}/{len(articles)} articles identical to the original filter")
+
+    #Throughput
+    timings = {}
+    for name, filter_sentences in (("any(...)", reference_filter), ("PromoMatcher", lambda s: matcher_filter(s, matcher))):
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            for sentences in articles:
+                filter_sentences(sentences)
+        timings[name] = time.perf_counter() - start
+        print(f"{name}: {repetitions * n_sentences / timings[name]:.0f} sentences/s")
+
+    print(f"Speedup: {timings['any(...)'] / timings['PromoMatcher']:.1f}x")
+
+    #Whole column cleaning
+    cleaner = Cleaner(n_workers=1)
+    series = pd.Series(corpus)
+    start = time.perf_counter()
+    row_by_row = [cleaner.clean_or_none(text) for text in corpus]
+    row_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    vectorized = cleaner.clean_series(series).tolist()
+    series_seconds = time.perf_counter() - start
+
+    different = sum(a != b for a, b in zip(row_by_row, vectorized))
+    print(f"clean_series: {len(corpus) - different}/{len(corpus)} articles identical to clean_text")
+    print(f"clean_text: {len(corpus) / row_seconds:.0f} articles/s, clean_series: {len(corpus) / series_seconds:.0f} articles/s")
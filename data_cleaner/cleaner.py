@@ -1,9 +1,9 @@
 #The cleaner script defines the cleaning function that should be applied to the bodies of the scrapped news to get the desired clean
 # bodies. Those clean bodies are more suitable to be used as inputs for a DeepLearning model.
+import os
 import re
-import nltk
-
-nltk.download('punkt')
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 #Define common promotional phrases
 promo_phrases = [
@@ -24,6 +24,191 @@ promo_phrases = [
     "Limited time only", "Get yours today"
 ]
 
+#Default list of phrases, the constructors take an optional list that shadows the 'promo_phrases' name
+default_promo_phrases = promo_phrases
+
+class PromoMatcher:
+    """
+    A class used to check if a sentence contains any of a list of promotional phrases, scanning the sentence once.
+    The phrases are lowercased once and compiled into a single regular expression factored as a trie, so phrases
+    sharing a prefix are tried together. It is equivalent to any(promo.lower() in sentence.lower() for promo in phrases).
+
+    Attributes
+    ----------
+    phrases : list of str
+        The lowercased promotional phrases.
+
+    Methods
+    -------
+    matches(sentence)
+        Returns True if the sentence contains any of the phrases (case insensitive).
+    """
+    def __init__(self, phrases):
+        """
+        Parameters
+        ----------
+        phrases : list of str
+            The promotional phrases.
+        """
+        self.phrases = [phrase.lower() for phrase in phrases]
+        self._pattern = re.compile(self._trie_pattern(self.phrases)) if self.phrases else None
+
+    @staticmethod
+    def _trie_pattern(phrases):
+        #Build the trie of the phrases, '' marks the end of a phrase
+        trie = {}
+        for phrase in phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[''] = True
+
+        def node_pattern(node):
+            children = [re.escape(char) + node_pattern(child) for char, child in sorted(node.items()) if char != '']
+            if not children:
+                return ''
+            pattern = children[0] if len(children) == 1 else '(?:' + '|'.join(children) + ')'
+            #A phrase ends here, so the rest is optional
+            if '' in node:
+                pattern = '(?:' + pattern + ')?'
+            return pattern
+
+        return node_pattern(trie)
+
+    def matches(self, sentence):
+        """
+        Returns True if the sentence contains any of the phrases (case insensitive).
+
+        Parameters
+        ----------
+        sentence : str
+            The sentence to check.
+
+        Returns
+        -------
+        bool
+            Whether the sentence contains any of the phrases.
+        """
+        return self._pattern is not None and self._pattern.search(sentence.lower()) is not None
+
+#Abbreviations that end with a period without ending the sentence. Single letters (initials) are also abbreviations
+abbreviations = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "gen", "gov", "sen", "rep", "rev", "lt", "col", "sgt",
+    "capt", "cmdr", "adm", "pres", "inc", "ltd", "co", "corp", "vs", "etc", "no", "jan", "feb", "mar", "apr", "jun",
+    "jul", "aug", "sep", "sept", "oct", "nov", "dec", "u.s", "u.k", "u.n", "e.g", "i.e", "a.m", "p.m"
+}
+
+#A candidate sentence end: '.', '!' or '?' (and closing quotes) followed by a space and an uppercase letter or digit.
+# The text has already been cleaned at character level, so it is ASCII with single spaces
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+[\'"]*(?= [\'"]?[A-Z0-9])')
+
+#The NLTK sentence tokenizer, loaded on first use by load_punkt
+_sent_tokenize = None
+_punkt_lock = threading.Lock()
+
+def load_punkt():
+    """
+    Imports NLTK and loads the Punkt tokenizer data from the local NLTK data paths (the NLTK_DATA environment variable,
+    or the data bundled in the Docker image). It is only downloaded if it is not found locally, nothing is done at
+    import time, so the cleaners that use the regex splitter never import NLTK.
+
+    Returns
+    -------
+    callable
+        The nltk.sent_tokenize function.
+    """
+    global _sent_tokenize
+    with _punkt_lock:
+        if _sent_tokenize is None:
+            import nltk
+            try:
+                nltk.sent_tokenize("Warm up.")
+            except LookupError:
+                #NLTK >= 3.9 uses 'punkt_tab', older versions the pickled 'punkt'
+                print("Punkt tokenizer data not found locally, downloading it.")
+                nltk.download('punkt_tab', quiet=True)
+                nltk.download('punkt', quiet=True)
+            _sent_tokenize = nltk.sent_tokenize
+    return _sent_tokenize
+
+def split_punkt(text):
+    """
+    Splits the text into sentences with the NLTK Punkt tokenizer (punctuation is preserved).
+    """
+    return (_sent_tokenize or load_punkt())(text)
+
+def split_regex(text):
+    """
+    Splits the text into sentences with a single compiled regular expression, much faster than Punkt but less exact.
+    A sentence ends at a '.', '!' or '?' followed by a space and an uppercase letter or a digit, unless the word
+    before the period is a known abbreviation or an initial. Sentences are always split at a space, so joining them
+    back with spaces gives the original text.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        if text[match.start()] == '.':
+            word = text[text.rfind(' ', start, match.start()) + 1:match.start()].strip('\'"').lower()
+            if len(word) == 1 or word in abbreviations:
+                continue
+        sentences.append(text[start:match.end()])
+        start = match.end() + 1
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+#Sentence splitters that can be selected for each cleaner
+SENTENCE_SPLITTERS = {
+    "punkt": split_punkt,
+    "regex": split_regex
+}
+
+#Character level steps of clean_text used by clean_series. The classes are written with explicit ASCII characters, so
+# the Arrow regex engine matches exactly the same characters as the re module ('\s' of re also matches '\x1c'-'\x1f').
+# The special symbols step runs after the whitespace collapse, so the only whitespace left to keep is ' '
+NON_ASCII_PATTERN = r'[^\x00-\x7F]+'
+WHITESPACE_PATTERN = r'[ \t\n\r\f\v\x1c-\x1f]+'
+SPECIAL_SYMBOLS_PATTERN = r'[^a-zA-Z0-9 \.\,\!\?\;\:\'\"]+'
+
+def clean_characters(text):
+    """
+    Character level steps of clean_text: removes the non-ASCII characters, the excessive whitespace and the special
+    symbols. The result is the text that is split into sentences.
+    """
+    #Remove non-printable characters
+    text = re.sub(r'[^\x00-\x7F]+', ' ', text)
+
+    #Remove excessive whitespace
+    text = re.sub(r'\s+', ' ', text).strip()
+
+    #Remove special symbols (keeping regular punctuation)
+    text = re.sub(r'[^a-zA-Z0-9\s\.\,\!\?\;\:\'\"]+', '', text)
+
+    #Remove double .. that may have been generated because of the way the lambda function is defined
+    text = text.replace("..", ".")
+
+    return text
+
+#Batches with fewer texts are cleaned in the calling process, the pool overhead is not worth it
+MIN_PARALLEL_TEXTS = 64
+
+#The cleaner of the current worker process, set once by the pool initializer
+_worker_cleaner = None
+
+def _init_clean_worker(cleaner):
+    global _worker_cleaner
+    _worker_cleaner = cleaner
+
+    #Load the sentence tokenizer once per worker, instead of inside the first task
+    try:
+        cleaner.split_sentences("Warm up.")
+    except LookupError:
+        pass
+
+def _clean_in_worker(text):
+    #The texts have already passed the prefilter in the parent process
+    return _worker_cleaner._clean_text(text)
+
 class Cleaner:
     """
     A class used to clean text raw data from promotional content and other unwanted characters.
@@ -35,13 +220,27 @@ class Cleaner:
         Maximum length of the text after cleaning.
     min_length : int
         Minimum length of the text after cleaning.
+    promo_matcher : PromoMatcher
+        The matcher of the promotional phrases, compiled once per instance.
+    n_workers : int
+        Number of worker processes used by clean_many.
+    sentence_splitter : str
+        Name of the sentence splitter, 'punkt' or 'regex'.
+    prefilter_checked : int
+        Number of texts checked by the length prefilter.
+    prefilter_rejected : int
+        Number of texts rejected by the length prefilter, without running the cleaning steps.
     
     Methods
     -------
     clean_text(text)
         Cleans the provided text according to the specified rules.
+    clean_many(texts)
+        Cleans a batch of texts on a pool of worker processes, keeping the input order.
+    clean_series(series)
+        Cleans a whole column of texts with vectorized string operations.
     """
-    def __init__(self, max_length=10000, min_length=500):
+    def __init__(self, max_length=10000, min_length=500, promo_phrases=None, n_workers=None, sentence_splitter="punkt"):
         """
         Parameters
         ----------
@@ -49,9 +248,25 @@ class Cleaner:
             Maximum length of the text after cleaning (default is 10000).
         min_length : int, optional
             Minimum length of the text after cleaning (default is 500).
+        promo_phrases : list of str, optional
+            Sentences containing any of these phrases are removed (default is the module promo_phrases list).
+        n_workers : int, optional
+            Number of worker processes used by clean_many (default is the number of CPUs).
+        sentence_splitter : str, optional
+            The sentence splitter, 'punkt' (NLTK Punkt, default) or 'regex' (faster, it may split some sentences
+            differently). See sentence_divergence.py to compare them on a corpus.
         """
         self.max_length = max_length
         self.min_length = min_length
+        self.promo_matcher = PromoMatcher(promo_phrases if promo_phrases is not None else default_promo_phrases)
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.sentence_splitter = sentence_splitter
+        self.split_sentences = SENTENCE_SPLITTERS[sentence_splitter]
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.prefilter_checked = 0
+        self.prefilter_rejected = 0
+        self._stats_lock = threading.Lock()
 
     def clean_text(self, text):
         """
@@ -75,27 +290,20 @@ class Cleaner:
         if not isinstance(text, str):
             raise TypeError("The input text must be a string.")
 
-        try:
-            #Remove non-printable characters
-            text = re.sub(r'[^\x00-\x7F]+', ' ', text)
-            
-            #Remove excessive whitespace
-            text = re.sub(r'\s+', ' ', text).strip()
-            
-            #Remove special symbols (keeping regular punctuation)
-            text = re.sub(r'[^a-zA-Z0-9\s\.\,\!\?\;\:\'\"]+', '', text)
-            
-            #Remove double .. that may have been generated because of the way the lambda function is defined
-            text = text.replace("..", ".")
+        #Reject the texts that can never reach the min length, before any of the expensive steps
+        if not self.passes_prefilter(text):
+            return None
 
-            #Split the text into sentences (punctuation is preserved)
-            sentences = nltk.sent_tokenize(text)
+        return self._clean_text(text)
 
-            #Remove sentences containing promotional phrases
-            cleaned_sentences = [sentence for sentence in sentences if not any(promo.lower() in sentence.lower() for promo in promo_phrases)]
+    def _clean_text(self, text):
+        #The cleaning steps, for a text that has already passed the prefilter
+        try:
+            #Character level steps
+            text = clean_characters(text)
 
-            #Join the cleaned sentences back into a single text
-            text = ' '.join(cleaned_sentences)
+            #Remove sentences containing promotional phrases
+            text = self.remove_promo_sentences(text)
             
             #Enforce min and max length
             if len(text) < self.min_length or len(text) > self.max_length:
@@ -104,4 +312,218 @@ class Cleaner:
             return text
         except Exception as e:
             print(f"An error occurred while cleaning the text: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def remove_promo_sentences(self, text):
+        """
+        Splits the text into sentences, removes the ones containing promotional phrases and joins the rest.
+
+        Parameters
+        ----------
+        text : str
+            The text, already cleaned at character level.
+
+        Returns
+        -------
+        str
+            The text without the promotional sentences.
+        """
+        #Split the text into sentences (punctuation is preserved)
+        sentences = self.split_sentences(text)
+
+        #Remove sentences containing promotional phrases
+        cleaned_sentences = [sentence for sentence in sentences if not self.promo_matcher.matches(sentence)]
+
+        #Join the cleaned sentences back into a single text
+        return ' '.join(cleaned_sentences)
+
+    def clean_series(self, series):
+        """
+        Cleans a whole column of texts, with the same output as clean_text for every row. The character level steps
+        and the length filter run as vectorized Arrow string operations over the column, only the sentence split and
+        the promotional phrases filter are done row by row.
+
+        Parameters
+        ----------
+        series : pd.Series
+            The texts to be cleaned.
+
+        Returns
+        -------
+        pd.Series
+            The cleaned texts with the same index, None for the texts that do not meet the length requirements or are
+            not strings.
+        """
+        #pandas and numpy are only needed by this path
+        import numpy as np
+        import pandas as pd
+
+        #Only the texts that pass the prefilter are cleaned
+        is_text = np.fromiter(
+            (isinstance(value, str) and self.passes_prefilter(value) for value in series), dtype=bool, count=len(series)
+        )
+        texts = series[is_text].astype(pd.StringDtype("pyarrow"))
+
+        #Character level steps, over the whole column
+        texts = texts.str.replace(NON_ASCII_PATTERN, ' ', regex=True)
+        texts = texts.str.replace(WHITESPACE_PATTERN, ' ', regex=True).str.strip(' ')
+        texts = texts.str.replace(SPECIAL_SYMBOLS_PATTERN, '', regex=True)
+        texts = texts.str.replace("..", ".", regex=False)
+
+        #Sentence level step, row by row
+        texts = pd.Series(
+            [self.remove_promo_sentences(text) for text in texts], index=texts.index, dtype=pd.StringDtype("pyarrow")
+        )
+
+        #Enforce min and max length
+        lengths = texts.str.len().to_numpy()
+        keep = (lengths >= self.min_length) & (lengths <= self.max_length)
+
+        cleaned = np.full(len(series), None, dtype=object)
+        cleaned[np.flatnonzero(is_text)[keep]] = texts.to_numpy(dtype=object)[keep]
+        return pd.Series(cleaned, index=series.index, dtype=object)
+
+    @staticmethod
+    def max_cleaned_length(text):
+        """
+        Returns an upper bound of the length of the text once cleaned, computed from the raw text with a few character
+        counts. The character level steps never make a word longer (a run of non-ASCII characters becomes a single
+        space) and leave at most one space between words. Joining the sentences back adds a space only where the
+        tokenizer split two sentences without whitespace between them, which only happens after a '.', '!' or '?'.
+
+        There is no useful lower bound, any sentence can be removed by the promotional phrases filter, so only the
+        min_length side of the length window can be checked in advance.
+
+        Parameters
+        ----------
+        text : str
+            The raw text.
+
+        Returns
+        -------
+        int
+            The maximum length the cleaned text can have.
+        """
+        words = text.split()
+        return sum(map(len, words)) + max(len(words) - 1, 0) + text.count('.') + text.count('!') + text.count('?')
+
+    def passes_prefilter(self, text):
+        """
+        Checks if the text can reach min_length once cleaned, updating the prefilter counters. A text rejected here
+        would also be rejected by the full cleaning, so the results are the same.
+
+        Parameters
+        ----------
+        text : str
+            The raw text.
+
+        Returns
+        -------
+        bool
+            False if the text can never reach min_length, True otherwise.
+        """
+        passes = self.max_cleaned_length(text) >= self.min_length
+        with self._stats_lock:
+            self.prefilter_checked += 1
+            if not passes:
+                self.prefilter_rejected += 1
+        return passes
+
+    def __getstate__(self):
+        #Sent to the worker processes without the pool
+        state = self.__dict__.copy()
+        state.pop('_pool', None)
+        state.pop('_pool_lock', None)
+        state.pop('_stats_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def clean_or_none(self, text):
+        """
+        Cleans the provided text, returning None instead of raising if the text cannot be cleaned (e.g. it is not a
+        string).
+
+        Parameters
+        ----------
+        text : str
+            The text to be cleaned.
+
+        Returns
+        -------
+        str or None
+            The cleaned text if it meets the length requirements, otherwise None.
+        """
+        try:
+            return self.clean_text(text)
+        except Exception:
+            return None
+
+    def start_workers(self):
+        """
+        Starts the pool of worker processes used by clean_many, if it is not running yet. Each worker receives a copy
+        of the cleaner and loads the sentence tokenizer once. It is started on the first call to clean_many, but it
+        can be started in advance, e.g. before other threads are started, since the workers are forked from the
+        current process.
+
+        Returns
+        -------
+        ProcessPoolExecutor
+            The pool of worker processes.
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.n_workers, initializer=_init_clean_worker, initargs=(self,)
+                )
+                #The workers are only forked when the first task is submitted, run an empty one to fork them now
+                self._pool.submit(int).result()
+            return self._pool
+
+    def clean_many(self, texts, chunk_size=None):
+        """
+        Cleans a batch of texts on the pool of worker processes, so the cleaning scales with the number of cores.
+        The texts are sent to the workers in chunks to reduce the inter-process communication.
+
+        Parameters
+        ----------
+        texts : iterable of str
+            The texts to be cleaned.
+        chunk_size : int, optional
+            Number of texts sent to a worker in each task (default is about four chunks per worker).
+
+        Returns
+        -------
+        list of str or None
+            The cleaned texts in the same order as the input, None for the texts discarded or that could not be
+            cleaned.
+        """
+        texts = list(texts)
+        cleaned = [None] * len(texts)
+
+        #Only the texts that pass the prefilter are cleaned (and sent to the workers)
+        candidates = [i for i, text in enumerate(texts) if isinstance(text, str) and self.passes_prefilter(text)]
+
+        if self.n_workers <= 1 or len(candidates) < MIN_PARALLEL_TEXTS:
+            results = [self._clean_text(texts[i]) for i in candidates]
+        else:
+            if chunk_size is None:
+                chunk_size = max(1, -(-len(candidates) // (4 * self.n_workers)))
+            results = self.start_workers().map(_clean_in_worker, [texts[i] for i in candidates], chunksize=chunk_size)
+
+        for i, result in zip(candidates, results):
+            cleaned[i] = result
+        return cleaned
+
+    def close(self):
+        """
+        Shuts down the pool of worker processes, if it was started.
+        """
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
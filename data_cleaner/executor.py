@@ -1,32 +1,67 @@
 import pandas as pd
 from cleaner import Cleaner
 from loader import Loader
+from parquet_sink import write_parquet
 import boto3
 import os
-from io import BytesIO
 from dotenv import load_dotenv
 import sys
+import queue
+import itertools
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 #Load environment variables from .env file
 load_dotenv()
 
 #Initialize Cleaner and Loader
-cleaner = Cleaner(max_length=10000, min_length=500)
-loader = Loader(
-    bucket_name=os.getenv('S3_COLLECTOR_BUCKET_NAME'),
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    aws_region=os.getenv('AWS_REGION')
+cleaner = Cleaner(
+    max_length=10000,
+    min_length=500,
+    n_workers=int(os.getenv('CLEANER_WORKERS', os.cpu_count() or 1)),
+    sentence_splitter=os.getenv('CLEANER_SENTENCE_SPLITTER', 'punkt')  # 'punkt' or 'regex'
 )
+cleaner_mode = os.getenv('CLEANER_MODE', 'processes')  # 'processes' (clean_many) or 'vectorized' (clean_series)
 
-def save_to_parquet(df, bucket_name, file_name, aws_access_key_id, aws_secret_access_key, aws_region):
+def create_loader(window_start=None, window_end=None):
     """
-    Saves the given DataFrame to an S3 bucket in parquet format.
+    Creates a Loader of the collector bucket that only loads the files of the [window_start, window_end) time window.
 
     Parameters
     ----------
-    df : pd.DataFrame
-        The DataFrame to save.
+    window_start : datetime, optional
+        Only the files with this timestamp or a later one are loaded (default is no start bound).
+    window_end : datetime, optional
+        Only the files with a timestamp before this one are loaded (default is no end bound).
+
+    Returns
+    -------
+    Loader
+        The loader of the window.
+    """
+    return Loader(
+        bucket_name=os.getenv('S3_COLLECTOR_BUCKET_NAME'),
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        aws_region=os.getenv('AWS_REGION'),
+        max_workers=int(os.getenv('LOADER_MAX_WORKERS', 16)),
+        csv_parser=os.getenv('LOADER_CSV_PARSER', 'pandas'),  # 'pandas' or 'pyarrow'
+        prefix=os.getenv('S3_COLLECTOR_PREFIX', ''),
+        window_start=window_start,
+        window_end=window_end
+    )
+
+def save_to_parquet(dataframes, bucket_name, file_name, aws_access_key_id, aws_secret_access_key, aws_region):
+    """
+    Saves the given DataFrames to an S3 bucket in a single parquet file, writing them one by one, row group by row
+    group, with a multipart upload (see parquet_sink.py). The codec is PARQUET_COMPRESSION (default 'zstd') and the
+    target size of the row groups PARQUET_ROW_GROUP_MB (default 32).
+
+    Parameters
+    ----------
+    dataframes : list of pd.DataFrame
+        The DataFrames to save, with the same columns.
     bucket_name : str
         The name of the S3 bucket.
     file_name : str
@@ -38,10 +73,10 @@ def save_to_parquet(df, bucket_name, file_name, aws_access_key_id, aws_secret_ac
     aws_region : str
         The AWS region.
 
-    Raises
-    ------
-    Exception
-        If an error occurs while saving the DataFrame to S3.
+    Returns
+    -------
+    bool
+        True once the file has been written to S3 (the upload has been completed), False if an error occurred.
     """
     try:
         s3_client = boto3.client(
@@ -50,33 +85,118 @@ def save_to_parquet(df, bucket_name, file_name, aws_access_key_id, aws_secret_ac
             aws_secret_access_key=aws_secret_access_key,
             region_name=aws_region
         )
-        parquet_buffer = BytesIO()
-        df.to_parquet(parquet_buffer, index=False)
-        s3_client.put_object(Bucket=bucket_name, Key=file_name, Body=parquet_buffer.getvalue())
+        write_parquet(
+            s3_client, bucket_name, file_name, dataframes,
+            compression=os.getenv('PARQUET_COMPRESSION', 'zstd'),
+            row_group_bytes=int(os.getenv('PARQUET_ROW_GROUP_MB', 32)) * 1024 * 1024
+        )
+        return True
     except Exception as e:
         print(f"An error occurred while saving the DataFrame to S3: {e}")
+        return False
 
-def get_remaining_files_count(bucket_name, s3_client):
+def get_remaining_files_count(manifest):
     """
-    Get the count of remaining CSV files in the bucket.
+    Get the count of remaining CSV files in the bucket, from the manifest of the loader. Only the keys written after
+    the last listed one are requested, and the whole bucket is listed again only when no files are left, to also find
+    the files written with older timestamps.
 
     Parameters
     ----------
-    bucket_name : str
-        The name of the S3 bucket.
-    s3_client : boto3.client
-        The S3 client used to interact with the bucket.
+    manifest : KeyManifest
+        The manifest of the pending keys of the loader.
 
     Returns
     -------
     int
         The number of remaining CSV files in the bucket.
     """
-    remaining_files = s3_client.list_objects_v2(Bucket=bucket_name).get('Contents', [])
-    return len([item for item in remaining_files if item['Key'].endswith('.csv')])
+    manifest.refresh()
+    if len(manifest) == 0:
+        manifest.refresh(full=True)
+    return len(manifest)
 
 
-def process_files(n_files, max_date_to_process):
+def clean_batch(dataframes):
+    """
+    Cleans the bodies of the DataFrames of a batch. The bodies of the whole batch are cleaned at once, but the
+    DataFrames are not combined, so they are written one by one into the parquet file without a combined copy.
+
+    Parameters
+    ----------
+    dataframes : list of pd.DataFrame
+        The loaded CSVs of the batch.
+
+    Returns
+    -------
+    list of pd.DataFrame or None
+        The cleaned DataFrames that have rows left, None if no body is left after cleaning.
+    """
+    #Clean data, the whole batch at once (on all the cores, or as vectorized column operations)
+    if cleaner_mode == "vectorized":
+        cleaned = [cleaner.clean_series(df['body']) for df in dataframes]
+    else:
+        bodies = cleaner.clean_many(itertools.chain.from_iterable(df['body'] for df in dataframes))
+        offsets = list(itertools.accumulate(len(df) for df in dataframes))
+        cleaned = [bodies[end - len(df):end] for df, end in zip(dataframes, offsets)]
+    print(f"Length prefilter rejected {cleaner.prefilter_rejected} of {cleaner.prefilter_checked} bodies before cleaning.")
+
+    cleaned_dataframes = []
+    for df, bodies in zip(dataframes, cleaned):
+        df = df.assign(body=list(bodies)).dropna(subset=['body'])
+        if not df.empty:
+            cleaned_dataframes.append(df)
+
+    if not cleaned_dataframes:
+        print("Every dataframe of the batch is empty after cleaning.")
+        return None
+    return cleaned_dataframes
+
+def save_batch(cleaned_dataframes, file_keys, loader):
+    """
+    Saves a cleaned batch to the destination bucket and, only once the parquet file has been written, deletes its
+    CSVs from the source bucket.
+
+    Parameters
+    ----------
+    cleaned_dataframes : list of pd.DataFrame
+        The cleaned DataFrames of the batch.
+    file_keys : list of str
+        The keys of the CSVs of the batch.
+    loader : Loader
+        The loader of the files, used to delete them.
+
+    Returns
+    -------
+    bool
+        Whether the batch has been saved (and its CSVs deleted).
+    """
+    #Create filename for parquet file
+    start_date = min(df['date'].min() for df in cleaned_dataframes).strftime('%Y%m%d%H%M%S')
+    end_date = max(df['date'].max() for df in cleaned_dataframes).strftime('%Y%m%d%H%M%S')
+    parquet_file_name = f"news_{start_date}_to_{end_date}.parquet"
+
+    #Save the cleaned DataFrames to destination bucket in a single parquet file
+    saved = save_to_parquet(
+        cleaned_dataframes,
+        bucket_name=os.getenv('S3_DESTINATION_BUCKET_NAME'),
+        file_name=parquet_file_name,
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        aws_region=os.getenv('AWS_REGION')
+    )
+    if not saved:
+        print(f"File {parquet_file_name} could not be saved, its CSVs are kept in the source bucket.")
+        return False
+
+    #Delete processed CSVs from source bucket
+    loader.delete_csvs(file_keys)
+
+    #Inform user
+    print(f"File {parquet_file_name} saved into {os.getenv('S3_DESTINATION_BUCKET_NAME')} bucket.")
+    return True
+
+def process_files(n_files, loader):
     """
     Process the specified number of files from the S3 bucket.
 
@@ -84,62 +204,165 @@ def process_files(n_files, max_date_to_process):
     ----------
     n_files : int
         The number of files to process.
+    loader : Loader
+        The loader of the files, only the files of its time window are loaded.
+
+    Returns
+    -------
+    bool or None
+        False if the files have been processed, None if there were no files to process or an error occurred.
     """
     try:
-        #Load CSVs from source bucket
+        #Load CSVs from source bucket (the files outside the time window are never listed)
         dataframes, file_keys = loader.load_csvs(n_files)
 
         if not dataframes:
             print("No dataframes loaded. Exiting.")
             return
-        
-        #Clean data
-        for df in dataframes:
-            df['body'] = df['body'].apply(cleaner.clean_text)
-            df.dropna(subset=['body'], inplace=True)
 
-        #Combine all DataFrames
-        combined_df = pd.concat(dataframes, ignore_index=True)
-
-        if combined_df.empty:
-            print("Combined dataframe is empty after cleaning. Exiting.")
+        cleaned_dataframes = clean_batch(dataframes)
+        if cleaned_dataframes is None or not save_batch(cleaned_dataframes, file_keys, loader):
             return
-
-        #Check what is the max date to process
-        if isinstance(max_date_to_process, str) and max_date_to_process.lower() != "max":
-            ##IF we have processed records older than the max_date_to_process
-            if combined_df['date'].max() > max_date_to_process:
-                #Print execution terminated and finish the execution
-                print(f"Bucket cleaned up to date {max_date_to_process.strftime('%Y-%m-%d %H:%M:%S')}")
-                return True
-
-        #Create filename for parquet file
-        start_date = combined_df['date'].min().strftime('%Y%m%d%H%M%S')
-        end_date = combined_df['date'].max().strftime('%Y%m%d%H%M%S')
-        parquet_file_name = f"news_{start_date}_to_{end_date}.parquet"
-
-        #Save combined DataFrame to destination bucket in parquet format
-        save_to_parquet(
-            combined_df,
-            bucket_name=os.getenv('S3_DESTINATION_BUCKET_NAME'),
-            file_name=parquet_file_name,
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            aws_region=os.getenv('AWS_REGION')
-        )
-
-        #Delete processed CSVs from source bucket
-        loader.delete_csvs(file_keys)
-
-        #Inform user
-        print(f"File {parquet_file_name} saved into {os.getenv('S3_DESTINATION_BUCKET_NAME')} bucket.")
         return False
 
     except Exception as e:
         print(f"An error occurred during processing: {e}")
 
 
-def main(n_files, execution_mode, max_date_to_process):
+def next_batch_keys(manifest, n_files, claimed):
+    """
+    Returns the oldest pending keys that are not claimed by a batch in flight, refreshing the manifest when none are
+    left (first incrementally, then with a full listing).
+    """
+    for full in (None, False, True):
+        if full is not None:
+            manifest.refresh(full=full)
+        keys = manifest.next_keys(n_files, exclude=claimed)
+        if keys:
+            return keys
+    return []
+
+def run_continuous(n_files, loader):
+    """
+    Processes the files of the loader as a pipeline until none is left: the next batch is downloaded while the current
+    one is cleaned, and the cleaned batches are uploaded and their CSVs deleted in the background, with at most
+    MAX_IN_FLIGHT_BATCHES (default 2) batches being uploaded at the same time. The CSVs of a batch are only deleted
+    after its parquet file has been written, in the same upload task.
+
+    Parameters
+    ----------
+    n_files : int
+        The number of files of each batch.
+    loader : Loader
+        The loader of the files.
+
+    Returns
+    -------
+    int
+        The number of batches saved.
+    """
+    max_in_flight = int(os.getenv('MAX_IN_FLIGHT_BATCHES', 2))
+
+    #Keys of the batches loaded in this run, so they are never loaded twice (also the ones whose upload failed)
+    claimed = set()
+    loaded_batches = queue.Queue(maxsize=1)
+    upload_slots = threading.BoundedSemaphore(max_in_flight)
+    saved_batches = []
+
+    def prefetch():
+        #Download the next batch while the current one is cleaned
+        try:
+            while True:
+                file_keys = next_batch_keys(loader.manifest, n_files, claimed)
+                if not file_keys:
+                    break
+                claimed.update(file_keys)
+                try:
+                    dataframes = [df for _, df in loader.iter_csvs(file_keys)]
+                except Exception as e:
+                    print(f"An error occurred while loading CSV files: {e}")
+                    continue
+                loaded_batches.put((dataframes, file_keys))
+        finally:
+            loaded_batches.put(None)
+
+    def upload(cleaned_dataframes, file_keys):
+        try:
+            saved_batches.append(save_batch(cleaned_dataframes, file_keys, loader))
+        except Exception as e:
+            print(f"An error occurred while saving the batch: {e}")
+        finally:
+            upload_slots.release()
+
+    #Fork the cleaning processes before any thread is started, a thread holding a lock at the time of the fork would
+    # leave it locked in the workers
+    if cleaner_mode != "vectorized":
+        cleaner.start_workers()
+
+    prefetch_thread = threading.Thread(target=prefetch, daemon=True)
+    prefetch_thread.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as uploader:
+            while True:
+                batch = loaded_batches.get()
+                if batch is None:
+                    break
+                dataframes, file_keys = batch
+
+                try:
+                    cleaned_dataframes = clean_batch(dataframes)
+                except Exception as e:
+                    print(f"An error occurred while cleaning the batch: {e}")
+                    continue
+                if cleaned_dataframes is None:
+                    continue
+
+                #Wait for a free upload slot, so the cleaned batches waiting in memory are bounded
+                upload_slots.acquire()
+                uploader.submit(upload, cleaned_dataframes, file_keys)
+        prefetch_thread.join()
+    finally:
+        cleaner.close()
+    return sum(saved_batches)
+
+def drain(n_files, loader):
+    """
+    Processes batches of n_files files until no file of the loader window is left.
+
+    Parameters
+    ----------
+    n_files : int
+        The number of files processed in each batch.
+    loader : Loader
+        The loader of the files.
+
+    Returns
+    -------
+    int
+        The number of batches processed.
+    """
+    batches = 0
+    while get_remaining_files_count(loader.manifest) > 0:
+        #Stop on errors and on batches that cannot be saved, so the same files are not retried forever
+        if process_files(n_files, loader) is None:
+            break
+        batches += 1
+    return batches
+
+def split_window(window_start, window_end, n_shards):
+    """
+    Splits the [window_start, window_end) time window into n_shards consecutive windows of the same duration.
+
+    Returns
+    -------
+    list of tuple of (datetime, datetime)
+        The start and end of each shard.
+    """
+    step = (window_end - window_start) / n_shards
+    bounds = [window_start + i * step for i in range(n_shards)] + [window_end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def main(n_files, execution_mode, max_date_to_process, min_date_to_process=None):
     """
     Main function to load, clean, and save CSV files from S3.
 
@@ -148,7 +371,11 @@ def main(n_files, execution_mode, max_date_to_process):
     n_files : int
         The number of files to process.
     execution_mode : str
-        The mode of execution ('continuous' or 'batch').
+        The mode of execution ('continuous', 'batch' or 'window').
+    max_date_to_process : datetime or str
+        The last date of the files to process ('max' for no limit). In 'window' mode, the end of the window (excluded).
+    min_date_to_process : datetime, optional
+        In 'window' mode, the start of the window (included).
 
     Raises
     ------
@@ -156,31 +383,41 @@ def main(n_files, execution_mode, max_date_to_process):
         If an error occurs during processing.
     """
     try:
-        #Continuous execution mode loops until the bucket is left with no CSVs files to process
-        if execution_mode == "continuous":
-            remaining_count = get_remaining_files_count(loader.bucket_name, loader.s3_client)
-            
-            while remaining_count > 0:
-
-                stop_processing = process_files(n_files, max_date_to_process)
-                if stop_processing:
-                    break
-
-                # Show remaining elements in the bucket
-                remaining_count = get_remaining_files_count(loader.bucket_name, loader.s3_client)
-                print(f"{remaining_count} elements remaining in the bucket.")
+        #The time window is applied when the keys are listed, so the files after max_date_to_process are never loaded
+        if execution_mode == "window":
+            window_end = max_date_to_process
+        elif isinstance(max_date_to_process, str):
+            window_end = None
+        else:
+            window_end = max_date_to_process + timedelta(seconds=1)
 
-                if remaining_count == 0:
-                    print("No more files to process. Exiting.")
-                    break
+        #Continuous execution mode loops until the bucket is left with no CSVs files to process, downloading,
+        # cleaning and uploading different batches at the same time
+        if execution_mode == "continuous":
+            loader = create_loader(window_end=window_end)
+            saved = run_continuous(n_files, loader)
+            print(f"No more files to process ({saved} batches saved, {loader.manifest.listings} list requests). Exiting.")
         
         #Batch execution mode just do one iteration
         elif execution_mode == "batch":
-            process_files(n_files)
+            process_files(n_files, create_loader(window_end=window_end))
             #Display completion of current batch
             print("Batch completed.")
+
+        #Window execution mode processes all the files of [min_date_to_process, max_date_to_process), split into
+        # EXECUTOR_SHARDS time shards processed in parallel
+        elif execution_mode == "window":
+            n_shards = int(os.getenv('EXECUTOR_SHARDS', 1))
+            shards = split_window(min_date_to_process, window_end, n_shards)
+            #Fork the cleaning processes before the shard threads are started
+            if cleaner_mode != "vectorized":
+                cleaner.start_workers()
+            with ThreadPoolExecutor(max_workers=n_shards) as executor:
+                batches = list(executor.map(lambda shard: drain(n_files, create_loader(*shard)), shards))
+            cleaner.close()
+            print(f"Window {min_date_to_process} to {window_end} completed: {sum(batches)} batches in {n_shards} shards.")
         else:
-            print("Invalid execution mode. Use 'continuous' or 'batch'.")
+            print("Invalid execution mode. Use 'continuous', 'batch' or 'window'.")
     except Exception as e:
         print(f"An error occurred during processing: {e}")
 
@@ -188,8 +425,9 @@ def main(n_files, execution_mode, max_date_to_process):
 #Program execution
 if __name__ == "__main__":
 
-    if len(sys.argv) != 4:
+    if len(sys.argv) not in (4, 5):
         print("Usage: python executor.py <number_of_files_to_process> <execution_mode> <max_date_to_process>")
+        print("       python executor.py <number_of_files_to_process> window <from_date> <to_date>")
         sys.exit(1)
 
     #Get number of files from the argument
@@ -201,15 +439,30 @@ if __name__ == "__main__":
 
     #Get the execution mode
     execution_mode = sys.argv[2]
-    if execution_mode not in ["continuous", "batch"]:
-        print("execution_mode should be 'continous' or 'batch'")
+    if execution_mode not in ["continuous", "batch", "window"]:
+        print("execution_mode should be 'continous', 'batch' or 'window'")
         sys.exit(1)
 
+    #Get the [from, to) window to process
+    if execution_mode == "window":
+        try:
+            min_date_to_process = pd.to_datetime(sys.argv[3], format='%Y-%m-%d %H:%M:%S').to_pydatetime()
+            max_date_to_process = pd.to_datetime(sys.argv[4], format='%Y-%m-%d %H:%M:%S').to_pydatetime()
+        except Exception:
+            print("<from_date> and <to_date> must be in the format YYYY-mm-dd HH:MM:SS")
+            sys.exit(1)
+        if min_date_to_process >= max_date_to_process:
+            print("<from_date> must be before <to_date>")
+            sys.exit(1)
+
+        main(n_files, execution_mode, max_date_to_process, min_date_to_process)
+        sys.exit(0)
+
     #Get max date to process
     try:
         max_date_to_process = sys.argv[3]
         if max_date_to_process.lower() != "max":
-            max_date_to_process = pd.to_datetime(max_date_to_process, format='%Y-%m-%d %H:%M:%S')
+            max_date_to_process = pd.to_datetime(max_date_to_process, format='%Y-%m-%d %H:%M:%S').to_pydatetime()
     except Exception:
         print("<max_date_to_process must be in the format YYYY-mm-dd HH:MM:SS or 'max' to indicate processing the whole bucket")
 
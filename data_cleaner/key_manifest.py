@@ -0,0 +1,255 @@
+## The key_manifest script defines the listing of the CSVs pending to be cleaned in the collector bucket. The bucket is
+# listed once with pagination (list_objects_v2 returns at most 1000 keys per call), and the pending keys are kept in an
+# in-process manifest sorted by the timestamp encoded in their names. Later refreshes only list the keys after the last
+# one seen (StartAfter), and the processed keys are removed from the manifest as they are deleted from the bucket.
+# Since the keys sort by their timestamp, a [from, to) time window is also applied at listing time: the listing starts
+# at the first key of the window and stops at the first key after it, so the files outside are never listed nor loaded.
+
+import bisect
+import threading
+from datetime import datetime
+
+KEY_DATE_FORMAT = '%Y_%m_%d__%H_%M_%S'
+
+def key_timestamp(key, prefix=""):
+    """
+    Returns the datetime encoded in a key with the format '<prefix>news_YYYY_MM_DD__HH_MM_SS.csv', or None if the key
+    does not follow it.
+
+    Parameters
+    ----------
+    key : str
+        The S3 key.
+    prefix : str, optional
+        The prefix of the key (default is no prefix).
+
+    Returns
+    -------
+    datetime or None
+        The datetime of the file.
+    """
+    if not key.startswith(prefix):
+        return None
+    name = key[len(prefix):].split(".")[0]
+    if not name.startswith("news_"):
+        return None
+    try:
+        return datetime.strptime(name[len("news_"):], KEY_DATE_FORMAT)
+    except ValueError:
+        return None
+
+def key_marker(prefix, timestamp):
+    """
+    Returns the string that sorts right before the key of the given timestamp ('<prefix>news_YYYY_MM_DD__HH_MM_SS'),
+    used as StartAfter to list the keys from that timestamp on, or as end of the listing.
+    """
+    return f"{prefix}news_{timestamp.strftime(KEY_DATE_FORMAT)}"
+
+def list_keys(s3_client, bucket_name, prefix="", start_after=None, suffix=".csv", end_before=None):
+    """
+    Lists all the keys of the bucket with the given prefix and suffix, following the continuation tokens.
+
+    Parameters
+    ----------
+    s3_client : boto3.client
+        The S3 client used to interact with the bucket.
+    bucket_name : str
+        The name of the S3 bucket.
+    prefix : str, optional
+        Only the keys starting with this prefix are listed (default is all the keys).
+    start_after : str, optional
+        Only the keys after this one (in lexicographical order) are listed.
+    suffix : str, optional
+        Only the keys ending with this suffix are returned (default is '.csv').
+    end_before : str, optional
+        The listing stops at the first key that is not before this one (no more pages are requested).
+
+    Yields
+    ------
+    str
+        The keys, in lexicographical order.
+    """
+    params = {"Bucket": bucket_name, "Prefix": prefix}
+    if start_after:
+        params["StartAfter"] = start_after
+    for page in s3_client.get_paginator('list_objects_v2').paginate(**params):
+        for item in page.get('Contents', []):
+            if end_before is not None and item['Key'] >= end_before:
+                return
+            if item['Key'].endswith(suffix):
+                yield item['Key']
+
+class KeyManifest:
+    """
+    A class used to keep the keys of the CSVs pending to be cleaned, oldest first, listing the bucket incrementally.
+
+    Attributes
+    ----------
+    bucket_name : str
+        The name of the S3 bucket.
+    prefix : str
+        The prefix of the listed keys.
+    window_start : datetime or None
+        Only the keys with this timestamp or a later one are listed.
+    window_end : datetime or None
+        Only the keys with a timestamp before this one are listed.
+    listings : int
+        Number of list_objects_v2 pages requested since the manifest was created.
+
+    Methods
+    -------
+    refresh(full=False)
+        Adds the new keys of the bucket to the manifest.
+    next_keys(n_keys, exclude=())
+        Returns the oldest pending keys.
+    discard(key)
+        Removes a processed key from the manifest.
+    """
+    def __init__(self, s3_client, bucket_name, prefix="", window_start=None, window_end=None):
+        """
+        Parameters
+        ----------
+        s3_client : boto3.client
+            The S3 client used to interact with the bucket.
+        bucket_name : str
+            The name of the S3 bucket.
+        prefix : str, optional
+            Only the keys starting with this prefix are listed (default is all the keys).
+        window_start : datetime, optional
+            Only the keys with this timestamp or a later one are listed (default is no start bound).
+        window_end : datetime, optional
+            Only the keys with a timestamp before this one are listed (default is no end bound).
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.window_start = window_start
+        self.window_end = window_end
+        self.listings = 0
+
+        #Pending keys sorted by (timestamp, key). The processed keys at the front are skipped with _start instead of
+        # being deleted one by one, and the list is compacted once they are many
+        self._entries = []
+        self._start = 0
+        self._pending = set()
+        self._skipped = set()
+        self._deleted = set()
+        self._last_listed = None
+        self._listed = False
+
+        #The manifest is shared by the thread loading the batches and the threads deleting them
+        self._lock = threading.RLock()
+
+        #Count the pages requested through the paginator
+        self.s3_client.meta.events.register('before-call.s3.ListObjectsV2', self._count_listing)
+
+    def _count_listing(self, **kwargs):
+        self.listings += 1
+
+    def refresh(self, full=False):
+        """
+        Adds the new keys of the bucket to the manifest. Only the keys after the last one listed are requested, unless
+        full is True (e.g. to find files written with older timestamps after the first listing).
+
+        Parameters
+        ----------
+        full : bool, optional
+            Whether to list the whole prefix again (default is False).
+
+        Returns
+        -------
+        int
+            The number of new keys added.
+        """
+        with self._lock:
+            return self._refresh(full)
+
+    def _refresh(self, full):
+        start_after = None if full or not self._listed else self._last_listed
+        if self.window_start is not None:
+            start_after = max(start_after or "", key_marker(self.prefix, self.window_start))
+        end_before = key_marker(self.prefix, self.window_end) if self.window_end is not None else None
+
+        added = 0
+        for key in list_keys(self.s3_client, self.bucket_name, self.prefix, start_after, end_before=end_before):
+            #A key deleted while the listing was running may still be listed
+            if key in self._pending or key in self._deleted:
+                continue
+            timestamp = key_timestamp(key, self.prefix)
+            if timestamp is not None and not self._in_window(timestamp):
+                continue
+            if timestamp is None:
+                if key not in self._skipped:
+                    print(f"Skipping {key}, its name does not follow news_YYYY_MM_DD__HH_MM_SS.csv")
+                    self._skipped.add(key)
+                continue
+            self._last_listed = key if self._last_listed is None else max(self._last_listed, key)
+            bisect.insort(self._entries, (timestamp, key), lo=self._start)
+            self._pending.add(key)
+            added += 1
+        self._listed = True
+
+        #The keys are discarded once deleted from the bucket, so a listing started later does not return them. The
+        # incremental listings start after the cursor, keep only the deleted keys that they may still reach
+        if self._last_listed is not None:
+            self._deleted = {key for key in self._deleted if key > self._last_listed}
+        return added
+
+    def _in_window(self, timestamp):
+        #Keys of other formats or prefixes may sort inside the window
+        return (self.window_start is None or timestamp >= self.window_start) and (self.window_end is None or timestamp < self.window_end)
+
+    def next_keys(self, n_keys, exclude=()):
+        """
+        Returns the oldest pending keys. The bucket is listed on the first call.
+
+        Parameters
+        ----------
+        n_keys : int
+            The maximum number of keys returned.
+        exclude : set of str, optional
+            Keys that are not returned (e.g. the ones of the batches in flight).
+
+        Returns
+        -------
+        list of str
+            The keys, sorted by the timestamp in their names.
+        """
+        with self._lock:
+            if not self._listed:
+                self.refresh()
+
+            keys = []
+            index = self._start
+            while len(keys) < n_keys and index < len(self._entries):
+                key = self._entries[index][1]
+                if key in self._pending and key not in exclude:
+                    keys.append(key)
+                index += 1
+            return keys
+
+    def discard(self, key):
+        """
+        Removes a processed key from the manifest.
+
+        Parameters
+        ----------
+        key : str
+            The key deleted from the bucket.
+        """
+        with self._lock:
+            self._pending.discard(key)
+            self._deleted.add(key)
+
+            #Advance over the processed keys at the front, and compact the list when they are the majority
+            while self._start < len(self._entries) and self._entries[self._start][1] not in self._pending:
+                self._start += 1
+            if self._start > len(self._entries) // 2:
+                self._entries = self._entries[self._start:]
+                self._start = 0
+
+    def __len__(self):
+        with self._lock:
+            if not self._listed:
+                self.refresh()
+            return len(self._pending)
@@ -1,9 +1,48 @@
 ## The loader script creates a loader class that is used to connect to an S3 bucket. 
 
+import gzip
 import boto3
 import pandas as pd
-from io import StringIO
-from datetime import datetime
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from key_manifest import KeyManifest, key_timestamp
+
+#First bytes of a gzip stream
+GZIP_MAGIC = b"\x1f\x8b"
+
+#Strings read as missing values, the defaults of pandas.read_csv (also used by the pyarrow parser, so both drop the same rows)
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA",
+    "NULL", "NaN", "None", "n/a", "nan", "null"
+]
+
+def parse_csv_pandas(content):
+    """
+    Parses the raw bytes of a CSV file with the C parser of pandas, without decoding them to a str first.
+    """
+    return pd.read_csv(BytesIO(content), lineterminator='\n')
+
+def parse_csv_pyarrow(content):
+    """
+    Parses the raw bytes of a CSV file with the multithreaded pyarrow CSV reader, zero copy from the bytes. It is faster
+    than pandas, but a carriage return outside quotes also ends a line (pandas only splits lines at '\n').
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+    table = csv.read_csv(
+        pa.BufferReader(content),
+        parse_options=csv.ParseOptions(newlines_in_values=True),
+        convert_options=csv.ConvertOptions(null_values=NA_VALUES, strings_can_be_null=True)
+    )
+    return table.to_pandas()
+
+#CSV parsers that can be selected for the loader
+CSV_PARSERS = {
+    "pandas": parse_csv_pandas,
+    "pyarrow": parse_csv_pyarrow
+}
 
 class Loader:
     """
@@ -15,15 +54,23 @@ class Loader:
         The name of the S3 bucket.
     s3_client : boto3.client
         The S3 client used to interact with the bucket.
+    max_workers : int
+        Maximum number of files downloaded at the same time.
+    csv_parser : str
+        Name of the CSV parser, 'pandas' or 'pyarrow'.
+    manifest : KeyManifest
+        The keys of the CSVs pending to be cleaned, oldest first.
     
     Methods
     -------
     load_csvs(n_files)
         Loads the last n_files CSV files from the S3 bucket and adds a date column.
+    iter_csvs(file_keys)
+        Downloads and parses the files concurrently, yielding them in key order.
     delete_csvs(files_to_delete)
         Deletes the specified files from the S3 bucket.
     """
-    def __init__(self, bucket_name, aws_access_key_id, aws_secret_access_key, aws_region):
+    def __init__(self, bucket_name, aws_access_key_id, aws_secret_access_key, aws_region, max_workers=16, csv_parser="pandas", prefix="", window_start=None, window_end=None):
         """
         Parameters
         ----------
@@ -35,14 +82,29 @@ class Loader:
             The AWS secret access key.
         aws_region : str
             The AWS region.
+        max_workers : int, optional
+            Maximum number of files downloaded at the same time (default is 16).
+        csv_parser : str, optional
+            The CSV parser, 'pandas' (default) or 'pyarrow'.
+        prefix : str, optional
+            Only the keys starting with this prefix are loaded (default is all the keys of the bucket).
+        window_start : datetime, optional
+            Only the files with this timestamp or a later one are loaded (default is no start bound).
+        window_end : datetime, optional
+            Only the files with a timestamp before this one are loaded (default is no end bound).
         """
+        #The connection pool is sized to the download threads, the client is shared by all of them
         self.s3_client = boto3.client(
             's3',
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
-            region_name=aws_region
+            region_name=aws_region,
+            config=Config(max_pool_connections=max_workers)
         )
         self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.csv_parser = csv_parser
+        self.manifest = KeyManifest(self.s3_client, bucket_name, prefix, window_start, window_end)
 
     def load_csvs(self, n_files):
         """
@@ -66,44 +128,14 @@ class Loader:
             If no files are found in the bucket.
         """
         try:
-            #List files in the bucket
-            response = self.s3_client.list_objects_v2(Bucket=self.bucket_name)
-            files = [item['Key'] for item in response.get('Contents', []) if item['Key'].endswith('.csv')]
+            #Take the oldest pending files from the manifest (the bucket is only listed the first time)
+            loaded_files = self.manifest.next_keys(n_files)
             
-            if not files:
+            if not loaded_files:
                 raise ValueError("No CSV files found in the bucket.")
             
-            #Sort files by name to get the oldest first
-            files.sort()
-
-            #Adjust n_files if there are fewer files than n_files
-            if len(files) < n_files:
-                n_files = len(files)
-            
-            #Load the specified number of files
-            dataframes = []
-            loaded_files = files[:n_files]
-            for file_key in loaded_files:
-                csv_obj = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_key)
-                body = csv_obj['Body'].read().decode('utf-8')
-                df = pd.read_csv(StringIO(body), lineterminator='\n')
-                
-                #Extract date from filename and add as a column
-
-                #First get the name without the extension
-                filename_wo_extension = file_key.split(".")[0]
-                #And then, remove the "news_" part
-                date_str = filename_wo_extension.replace("news_","")
-                #Now convert to date, and add as a column
-                file_date = datetime.strptime(date_str, '%Y_%m_%d__%H_%M_%S')
-                df['date'] = file_date
-
-                #And finally, drop NaN values and duplicated bodies
-                df = df.dropna()
-                df = df.drop_duplicates(subset="body")
-                
-                #Now, append to the list of dataframes
-                dataframes.append(df)
+            #Load the specified number of files, downloading them concurrently
+            dataframes = [df for _, df in self.iter_csvs(loaded_files)]
             
             return dataframes, loaded_files
         
@@ -112,6 +144,63 @@ class Loader:
             #Return empty lists
             return [], []
 
+    def _load_csv(self, file_key):
+        #Download the file and parse it directly from the bytes
+        csv_obj = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_key)
+        content = csv_obj['Body'].read()
+
+        #The collectors may upload the CSVs gzip compressed (UPLOAD_GZIP)
+        if content[:2] == GZIP_MAGIC:
+            content = gzip.decompress(content)
+        df = CSV_PARSERS[self.csv_parser](content)
+
+        #Extract date from filename (news_YYYY_MM_DD__HH_MM_SS.csv) and add as a column
+        df['date'] = key_timestamp(file_key, self.manifest.prefix)
+
+        #And finally, drop NaN values and duplicated bodies
+        df = df.dropna()
+        df = df.drop_duplicates(subset="body")
+        return df
+
+    def iter_csvs(self, file_keys):
+        """
+        Downloads and parses the files on a pool of max_workers threads, yielding each one as soon as it and all the
+        previous ones are ready, so the results keep the order of the keys. At most 2 * max_workers files are held in
+        memory at the same time.
+
+        Parameters
+        ----------
+        file_keys : list of str
+            The keys of the files to load.
+
+        Yields
+        ------
+        tuple of (str, pd.DataFrame)
+            The key of each file and its data, with the date column added.
+
+        Raises
+        ------
+        Exception
+            If a file cannot be downloaded or parsed.
+        """
+        keys = iter(file_keys)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = deque()
+            for file_key in keys:
+                in_flight.append((file_key, executor.submit(self._load_csv, file_key)))
+                if len(in_flight) >= 2 * self.max_workers:
+                    break
+
+            while in_flight:
+                file_key, future = in_flight.popleft()
+                df = future.result()
+
+                #Keep the window full, a new download starts for every file yielded
+                next_key = next(keys, None)
+                if next_key is not None:
+                    in_flight.append((next_key, executor.submit(self._load_csv, next_key)))
+                yield file_key, df
+
     def delete_csvs(self, files_to_delete):
         """
         Deletes the specified files from the S3 bucket.
@@ -130,5 +219,6 @@ class Loader:
             #Delete the specified files from the bucket
             for file_key in files_to_delete:
                 self.s3_client.delete_object(Bucket=self.bucket_name, Key=file_key)
+                self.manifest.discard(file_key)
         except Exception as e:
             print(f"An error occurred while deleting CSV files: {e}")
\ No newline at end of file
@@ -0,0 +1,81 @@
+## Compares the sentence splitters defined in cleaner.py over a sample of article bodies. Every body is cleaned at
+# character level (as clean_text does before splitting it) and split with the NLTK Punkt splitter and with the regex
+# splitter. It reports how often both split differently, how often that changes the cleaned body (the split only
+# matters when a sentence with a promotional phrase is removed) and the throughput of each splitter.
+#
+# Usage: python sentence_divergence.py <corpus_dir> [max_articles] [examples]
+#   <corpus_dir>: Directory with the raw article bodies, one '.txt' file per article.
+#   [max_articles]: Maximum number of articles of the sample (default 1000).
+#   [examples]: Number of differing splits printed (default 5).
+
+import sys
+import time
+from cleaner import Cleaner, clean_characters, split_punkt, split_regex
+from benchmark_cleaner import load_corpus
+
+def boundaries(sentences):
+    """
+    Returns the positions of the sentence ends, counted in non-space characters so they do not depend on the spaces
+    between sentences.
+    """
+    positions = set()
+    position = 0
+    for sentence in sentences:
+        position += len(sentence.replace(" ", ""))
+        positions.add(position)
+    return positions
+
+def timed_split(splitter, texts):
+    start = time.perf_counter()
+    splits = [splitter(text) for text in texts]
+    return splits, time.perf_counter() - start
+
+if __name__ == "__main__":
+
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: python sentence_divergence.py <corpus_dir> [max_articles] [examples]")
+        sys.exit(1)
+
+    max_articles = int(sys.argv[2]) if len(sys.argv) >= 3 else 1000
+    n_examples = int(sys.argv[3]) if len(sys.argv) == 4 else 5
+    texts = [clean_characters(text) for text in load_corpus(sys.argv[1])[:max_articles]]
+    if not texts:
+        print("The corpus directory has no '.txt' files.")
+        sys.exit(1)
+
+    punkt_splits, punkt_seconds = timed_split(split_punkt, texts)
+    regex_splits, regex_seconds = timed_split(split_regex, texts)
+
+    #Divergence of the splits
+    different_articles = 0
+    boundary_union = 0
+    boundary_mismatches = 0
+    examples = []
+    for text, punkt_sentences, regex_sentences in zip(texts, punkt_splits, regex_splits):
+        punkt_boundaries = boundaries(punkt_sentences)
+        regex_boundaries = boundaries(regex_sentences)
+        boundary_union += len(punkt_boundaries | regex_boundaries)
+        boundary_mismatches += len(punkt_boundaries ^ regex_boundaries)
+        if punkt_boundaries != regex_boundaries:
+            different_articles += 1
+            if len(examples) < n_examples:
+                examples.append((punkt_sentences, regex_sentences))
+
+    #Divergence of the cleaned bodies
+    punkt_cleaner = Cleaner(n_workers=1, sentence_splitter="punkt")
+    regex_cleaner = Cleaner(n_workers=1, sentence_splitter="regex")
+    different_outputs = sum(
+        punkt_cleaner.remove_promo_sentences(text) != regex_cleaner.remove_promo_sentences(text) for text in texts
+    )
+
+    n_sentences = sum(len(sentences) for sentences in punkt_splits)
+    print(f"Sample: {len(texts)} articles, {n_sentences} Punkt sentences")
+    print(f"Articles split differently: {different_articles} ({100 * different_articles / len(texts):.2f}%)")
+    print(f"Sentence ends not shared: {boundary_mismatches} of {boundary_union} ({100 * boundary_mismatches / max(boundary_union, 1):.2f}%)")
+    print(f"Cleaned bodies that differ: {different_outputs} ({100 * different_outputs / len(texts):.2f}%)")
+    print(f"punkt: {len(texts) / punkt_seconds:.0f} articles/s, regex: {len(texts) / regex_seconds:.0f} articles/s")
+
+    for punkt_sentences, regex_sentences in examples:
+        print("-" * 80)
+        print("punkt:", [sentence for sentence in punkt_sentences if sentence not in regex_sentences][:3])
+        print("regex:", [sentence for sentence in regex_sentences if sentence not in punkt_sentences][:3])
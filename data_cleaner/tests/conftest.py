@@ -0,0 +1,19 @@
+import os
+import sys
+import boto3
+import pytest
+from moto import mock_aws
+
+#The modules of the package are run as scripts from its directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    """
+    An S3 client of a moto mocked S3, with no credentials of the environment.
+    """
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        yield boto3.client("s3", region_name="us-east-1")
@@ -0,0 +1,142 @@
+import os
+import json
+import re
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from cleaner import Cleaner, PromoMatcher, clean_characters, split_regex, default_promo_phrases
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "cleaner_texts.json")
+
+def punkt_available():
+    import nltk
+    for resource in ("tokenizers/punkt_tab", "tokenizers/punkt"):
+        try:
+            nltk.data.find(resource)
+            return True
+        except LookupError:
+            pass
+    return False
+
+def load_texts():
+    with open(FIXTURE) as f:
+        return json.load(f) + [np.nan]
+
+@pytest.fixture(params=["regex", "punkt"])
+def cleaner(request):
+    if request.param == "punkt" and not punkt_available():
+        pytest.skip("The NLTK Punkt data is not installed.")
+    #Small length window, so both limits are exercised by the fixtures
+    return Cleaner(max_length=400, min_length=40, sentence_splitter=request.param, n_workers=1)
+
+def test_clean_series_same_as_clean_text(cleaner):
+    series = pd.Series(load_texts(), dtype=object)
+    expected = [cleaner.clean_text(text) if isinstance(text, str) else None for text in series]
+
+    assert cleaner.clean_series(series).tolist() == expected
+    #The fixtures cover cleaned, filtered and non string texts
+    assert any(text is not None for text in expected) and any(text is None for text in expected)
+
+def test_clean_series_keeps_the_index(cleaner):
+    series = pd.Series(load_texts(), dtype=object, index=range(100, 100 + len(load_texts())))
+    assert cleaner.clean_series(series).index.equals(series.index)
+
+def test_clean_text_rejects_non_strings(cleaner):
+    with pytest.raises(TypeError):
+        cleaner.clean_text(42)
+    assert cleaner.clean_or_none(42) is None
+
+def fuzz_texts(n, seed=0):
+    """
+    Random texts made of ordinary words, promotional phrases (in any case and cut at any point), abbreviations,
+    punctuation, quotes, non-ASCII characters and odd whitespace.
+    """
+    rng = random.Random(seed)
+    pieces = (
+        ["the", "minister", "said", "budget", "grow", "Officials", "expect", "spending", "health", "42", "2024",
+         "Mr.", "Dr.", "U.S.", "e.g.", "J.", "No.", "etc.", "Inc.", "a.m.", "café", "naïve", "—", "“quoted”",
+         "\U0001F600", "..", "...", "!", "?", ";", ":", ",", "'", '"', "#", "$", "%", "(", ")", "\t", "\n", "\x1c", " "]
+        + default_promo_phrases
+    )
+    texts = []
+    for _ in range(n):
+        words = []
+        for _ in range(rng.randint(1, 120)):
+            piece = rng.choice(pieces)
+            if piece in default_promo_phrases:
+                piece = rng.choice([piece, piece.upper(), piece.lower(), piece[:rng.randint(1, len(piece))]])
+            words.append(piece)
+            if rng.random() < 0.15:
+                words.append(rng.choice([".", ". ", "! ", "? ", ".\"", "."]))
+        texts.append(rng.choice([" ", "", "  ", " \n"]).join(words) if rng.random() < 0.2 else " ".join(words))
+    return texts
+
+def test_promo_matcher_same_as_any_in():
+    phrases_lists = [default_promo_phrases, ["ab", "abc", "b", "Buy now", "buy now pay later", "A.B"], []]
+    sentences = [sentence for text in fuzz_texts(300) for sentence in split_regex(clean_characters(text))]
+    sentences += fuzz_texts(300, seed=1) + ["", "BUY NOW", "buy no", "Click to learn mor", "xGO AD FREEx"]
+
+    for phrases in phrases_lists:
+        matcher = PromoMatcher(phrases)
+        for sentence in sentences:
+            assert matcher.matches(sentence) == any(promo.lower() in sentence.lower() for promo in phrases), (phrases, sentence)
+
+def baseline_clean_text(text, min_length, max_length, split_sentences, phrases=default_promo_phrases):
+    #The cleaning before the prefilter and the promo matcher: every text is cleaned and only then length checked
+    text = re.sub(r'[^\x00-\x7F]+', ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = re.sub(r'[^a-zA-Z0-9\s\.\,\!\?\;\:\'\"]+', '', text)
+    text = text.replace("..", ".")
+    sentences = split_sentences(text)
+    cleaned_sentences = [s for s in sentences if not any(promo.lower() in s.lower() for promo in phrases)]
+    text = ' '.join(cleaned_sentences)
+    if len(text) < min_length or len(text) > max_length:
+        return None
+    return text
+
+@pytest.mark.parametrize("min_length", [0, 20, 60, 150, 400])
+def test_prefilter_same_as_cleaning_first(min_length):
+    texts = fuzz_texts(400, seed=2) + [text for text in load_texts() if isinstance(text, str)]
+    cleaner = Cleaner(max_length=600, min_length=min_length, sentence_splitter="regex", n_workers=1)
+
+    expected = [baseline_clean_text(text, min_length, 600, split_regex) for text in texts]
+    for text, result in zip(texts, expected):
+        assert cleaner.clean_text(text) == result
+        #The bound of the prefilter is never below the length of the cleaned text
+        assert Cleaner.max_cleaned_length(text) >= len(clean_characters(text))
+    assert cleaner.clean_many(texts) == expected
+    #The length window rejects some texts before the cleaning for the larger minimums
+    if min_length >= 150:
+        assert cleaner.prefilter_rejected > 0
+
+def test_split_regex_joins_back_to_the_text():
+    for text in fuzz_texts(400, seed=3):
+        text = clean_characters(text)
+        sentences = split_regex(text)
+        assert ' '.join(sentences) == text
+        assert all(sentences)
+
+def test_split_regex_same_as_sent_tokenize_on_plain_sentences():
+    if not punkt_available():
+        pytest.skip("The NLTK Punkt data is not installed.")
+    import nltk
+    rng = random.Random(4)
+    words = ["the", "minister", "said", "budget", "would", "grow", "officials", "expect", "spending", "health", "42"]
+    for _ in range(200):
+        sentences = [
+            " ".join([rng.choice(words[:-1]).capitalize()] + rng.choices(words, k=rng.randint(2, 12))) + rng.choice(".!?")
+            for _ in range(rng.randint(1, 8))
+        ]
+        text = " ".join(sentences)
+        assert split_regex(text) == nltk.sent_tokenize(text) == sentences
+
+def test_punkt_cleaner_same_as_sent_tokenize():
+    if not punkt_available():
+        pytest.skip("The NLTK Punkt data is not installed.")
+    import nltk
+    texts = fuzz_texts(200, seed=5) + [text for text in load_texts() if isinstance(text, str)]
+    cleaner = Cleaner(max_length=600, min_length=60, sentence_splitter="punkt", n_workers=1)
+
+    for text in texts:
+        assert cleaner.clean_text(text) == baseline_clean_text(text, 60, 600, nltk.sent_tokenize)
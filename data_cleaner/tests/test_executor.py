@@ -0,0 +1,141 @@
+import io
+from datetime import datetime, timedelta
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import executor
+from cleaner import Cleaner
+
+SOURCE = "collector-bucket"
+DESTINATION = "clean-bucket"
+START = datetime(2024, 1, 1)
+
+def key(i):
+    return f"news_{(START + timedelta(minutes=15 * i)).strftime('%Y_%m_%d__%H_%M_%S')}.csv"
+
+def put_csvs(s3_client, n_files, rows=3):
+    for i in range(n_files):
+        df = pd.DataFrame({
+            "url": [f"https://news.com/{i}/{j}" for j in range(rows)],
+            "title": [f"Title {i} {j}" for j in range(rows)],
+            "body": [f"The story {j} of the file {i} was reported today. It is long enough to be kept." for j in range(rows)],
+        })
+        s3_client.put_object(Bucket=SOURCE, Key=key(i), Body=df.to_csv(index=False, escapechar="\\").encode("utf-8"))
+
+def source_keys(s3_client):
+    return sorted(item["Key"] for item in s3_client.list_objects_v2(Bucket=SOURCE).get("Contents", []))
+
+def saved_urls(s3_client):
+    urls = []
+    for item in s3_client.list_objects_v2(Bucket=DESTINATION).get("Contents", []):
+        body = s3_client.get_object(Bucket=DESTINATION, Key=item["Key"])["Body"].read()
+        urls += pq.read_table(io.BytesIO(body)).column("url").to_pylist()
+    return sorted(urls)
+
+def urls_of(files, rows=3):
+    return sorted(f"https://news.com/{i}/{j}" for i in files for j in range(rows))
+
+@pytest.fixture
+def buckets(s3_client, monkeypatch):
+    s3_client.create_bucket(Bucket=SOURCE)
+    s3_client.create_bucket(Bucket=DESTINATION)
+    for name, value in {
+        "S3_COLLECTOR_BUCKET_NAME": SOURCE, "S3_DESTINATION_BUCKET_NAME": DESTINATION, "AWS_REGION": "us-east-1",
+        "S3_COLLECTOR_PREFIX": "", "LOADER_MAX_WORKERS": "2", "EXECUTOR_SHARDS": "2", "MAX_IN_FLIGHT_BATCHES": "2",
+    }.items():
+        monkeypatch.setenv(name, value)
+    #A cleaner that keeps the short test bodies, in the calling process
+    monkeypatch.setattr(executor, "cleaner", Cleaner(max_length=10000, min_length=20, sentence_splitter="regex", n_workers=1))
+    return s3_client
+
+def fail_saves(monkeypatch):
+    def write_parquet(*args, **kwargs):
+        raise RuntimeError("Simulated upload failure")
+    monkeypatch.setattr(executor, "write_parquet", write_parquet)
+
+def test_batch_mode(buckets):
+    put_csvs(buckets, 10)
+
+    executor.main(4, "batch", "max")
+
+    assert saved_urls(buckets) == urls_of(range(4))
+    assert source_keys(buckets) == [key(i) for i in range(4, 10)]
+
+def test_batch_mode_max_date(buckets):
+    put_csvs(buckets, 10)
+
+    #Only the files up to the max date are loaded, even if the batch is bigger
+    executor.main(8, "batch", START + timedelta(minutes=30))
+
+    assert saved_urls(buckets) == urls_of(range(3))
+    assert source_keys(buckets) == [key(i) for i in range(3, 10)]
+
+def test_window_mode(buckets):
+    put_csvs(buckets, 12)
+
+    executor.main(2, "window", START + timedelta(hours=2, minutes=30), START + timedelta(minutes=30))
+
+    #Files 2 to 9, in batches of 2 drained by 2 shards
+    assert saved_urls(buckets) == urls_of(range(2, 10))
+    assert source_keys(buckets) == [key(i) for i in (0, 1, 10, 11)]
+    assert len(buckets.list_objects_v2(Bucket=DESTINATION)["Contents"]) == 4
+
+@pytest.mark.parametrize("mode", ["batch", "window"])
+def test_csvs_are_kept_when_the_save_fails(buckets, monkeypatch, mode):
+    put_csvs(buckets, 6)
+    fail_saves(monkeypatch)
+
+    executor.main(2, mode, START + timedelta(hours=2), START)
+
+    assert saved_urls(buckets) == []
+    assert source_keys(buckets) == [key(i) for i in range(6)]
+
+def test_continuous_mode(buckets):
+    put_csvs(buckets, 11)
+
+    executor.main(3, "continuous", "max")
+
+    #Batches of 3, 3, 3 and 2 files, every file deleted once saved
+    assert saved_urls(buckets) == urls_of(range(11))
+    assert source_keys(buckets) == []
+    assert len(buckets.list_objects_v2(Bucket=DESTINATION)["Contents"]) == 4
+
+def test_continuous_mode_deletes_only_saved_batches(buckets, monkeypatch):
+    put_csvs(buckets, 9)
+    #The upload of the second batch fails, the others are saved
+    write_parquet = executor.write_parquet
+    def flaky_write_parquet(s3_client, bucket_name, file_name, dataframes, **options):
+        if file_name.startswith(f"news_{(START + timedelta(minutes=45)).strftime('%Y%m%d%H%M%S')}"):
+            raise RuntimeError("Simulated upload failure")
+        return write_parquet(s3_client, bucket_name, file_name, dataframes, **options)
+    monkeypatch.setattr(executor, "write_parquet", flaky_write_parquet)
+
+    executor.main(3, "continuous", "max")
+
+    #The CSVs of the failed batch are kept (and not loaded again in the same run)
+    assert saved_urls(buckets) == urls_of([0, 1, 2, 6, 7, 8])
+    assert source_keys(buckets) == [key(i) for i in (3, 4, 5)]
+
+def test_continuous_mode_max_date(buckets):
+    put_csvs(buckets, 8)
+
+    executor.main(4, "continuous", START + timedelta(hours=1))
+
+    assert saved_urls(buckets) == urls_of(range(5))
+    assert source_keys(buckets) == [key(i) for i in (5, 6, 7)]
+
+def test_batch_is_written_frame_by_frame(buckets, monkeypatch):
+    put_csvs(buckets, 4)
+    written = []
+    write_parquet = executor.write_parquet
+    def recording_write_parquet(s3_client, bucket_name, file_name, dataframes, **options):
+        written.extend(len(df) for df in dataframes)
+        return write_parquet(s3_client, bucket_name, file_name, dataframes, **options)
+    monkeypatch.setattr(executor, "write_parquet", recording_write_parquet)
+
+    executor.main(4, "batch", "max")
+
+    #One cleaned DataFrame per CSV, never combined into a single one
+    assert written == [3, 3, 3, 3]
+    assert saved_urls(buckets) == urls_of(range(4))
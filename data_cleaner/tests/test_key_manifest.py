@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+import pytest
+
+from key_manifest import KeyManifest, key_timestamp
+
+BUCKET = "collector-bucket"
+START = datetime(2024, 1, 1)
+
+def key(i, prefix=""):
+    #One file every 15 minutes from START
+    return f"{prefix}news_{(START + timedelta(minutes=15 * i)).strftime('%Y_%m_%d__%H_%M_%S')}.csv"
+
+def put_keys(s3_client, keys):
+    for k in keys:
+        s3_client.put_object(Bucket=BUCKET, Key=k, Body=b"url,title,body\n")
+
+@pytest.fixture
+def bucket(s3_client):
+    s3_client.create_bucket(Bucket=BUCKET)
+    calls = []
+    s3_client.meta.events.register('provide-client-params.s3.ListObjectsV2', lambda params, **kwargs: calls.append(dict(params)))
+    return s3_client, calls
+
+def test_key_timestamp():
+    assert key_timestamp("news_2024_01_01__00_15_00.csv") == datetime(2024, 1, 1, 0, 15)
+    assert key_timestamp("raw/news_2024_01_01__00_15_00.csv.gz", "raw/") == datetime(2024, 1, 1, 0, 15)
+    #The files of the URLs recovered at the end of a run belong to the same slot
+    assert key_timestamp("news_2024_01_01__00_15_00.recovered_1704068100.csv") == datetime(2024, 1, 1, 0, 15)
+    assert key_timestamp("news_2024_01_01.csv") is None
+    assert key_timestamp("other/news_2024_01_01__00_15_00.csv", "raw/") is None
+
+def test_pagination(bucket):
+    s3_client, calls = bucket
+    #More keys than a page of list_objects_v2, written out of order, plus keys that are skipped
+    keys = [key(i) for i in range(1500)]
+    put_keys(s3_client, keys[::-1] + ["news_latest.csv", "news_2024_01_01__00_00_00.json"])
+
+    manifest = KeyManifest(s3_client, BUCKET)
+
+    assert len(manifest) == 1500
+    assert manifest.listings == len(calls) == 2
+    assert [call.get("ContinuationToken") is None for call in calls] == [True, False]
+    assert manifest.next_keys(5) == keys[:5]
+    assert manifest.next_keys(3, exclude=set(keys[:2])) == keys[2:5]
+
+def test_refresh_resumes_after_the_last_key(bucket):
+    s3_client, calls = bucket
+    put_keys(s3_client, [key(i) for i in range(10)])
+    manifest = KeyManifest(s3_client, BUCKET)
+    assert len(manifest) == 10
+    assert "StartAfter" not in calls[0]
+
+    #The processed keys are deleted, new ones are written
+    for k in [key(i) for i in range(4)]:
+        s3_client.delete_object(Bucket=BUCKET, Key=k)
+        manifest.discard(k)
+    put_keys(s3_client, [key(i) for i in range(10, 13)])
+
+    assert manifest.refresh() == 3
+    assert calls[-1]["StartAfter"] == key(9)
+    assert manifest.next_keys(100) == [key(i) for i in range(4, 13)]
+
+    #A file written with an older timestamp is only found by a full listing
+    put_keys(s3_client, [key(-1)])
+    assert manifest.refresh() == 0
+    assert manifest.refresh(full=True) == 1
+    assert "StartAfter" not in calls[-1]
+    assert manifest.next_keys(2) == [key(-1), key(4)]
+    assert len(manifest) == 10
+
+def test_discarded_keys_are_not_listed_again(bucket):
+    s3_client, calls = bucket
+    put_keys(s3_client, [key(i) for i in range(6)])
+    manifest = KeyManifest(s3_client, BUCKET)
+
+    #Discarded while still in the bucket, as if the listing had run before the delete
+    manifest.discard(key(0))
+    manifest.refresh(full=True)
+
+    assert key(0) not in manifest.next_keys(100)
+    assert len(manifest) == 5
+
+def test_window_is_applied_at_listing(bucket):
+    s3_client, calls = bucket
+    #Two pages of keys, and a key of another format that sorts inside the window
+    put_keys(s3_client, [key(i, "raw/") for i in range(1100)] + ["raw/news_2024_01_01__01_00_00_old.csv"])
+
+    manifest = KeyManifest(s3_client, BUCKET, "raw/", window_start=START + timedelta(hours=1), window_end=START + timedelta(hours=3))
+
+    assert manifest.next_keys(100) == [key(i, "raw/") for i in range(4, 12)]
+    #The listing starts at the window and stops at its end, the second page is never requested
+    assert calls[0]["StartAfter"] == "raw/news_2024_01_01__01_00_00"
+    assert calls[0]["Prefix"] == "raw/"
+    assert manifest.listings == 1
+
+    #Incremental refreshes stay inside the window
+    put_keys(s3_client, [key(-4, "raw/"), key(12, "raw/")])
+    assert manifest.refresh() == 0
+    assert manifest.refresh(full=True) == 0
+    assert calls[-1]["StartAfter"] == "raw/news_2024_01_01__01_00_00"
+
+def test_deleted_keys_are_pruned(bucket):
+    s3_client, calls = bucket
+    put_keys(s3_client, [key(i) for i in range(10)])
+    manifest = KeyManifest(s3_client, BUCKET)
+    manifest.next_keys(10)
+
+    for k in [key(i) for i in range(6)]:
+        s3_client.delete_object(Bucket=BUCKET, Key=k)
+        manifest.discard(k)
+    assert len(manifest._deleted) == 6
+
+    #Once listed past them, the deleted keys are forgotten and the manifest stays bounded
+    put_keys(s3_client, [key(10)])
+    manifest.refresh()
+    assert manifest._deleted == set()
+    manifest.refresh(full=True)
+    assert manifest.next_keys(100) == [key(i) for i in range(6, 11)]
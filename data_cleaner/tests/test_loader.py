@@ -0,0 +1,56 @@
+import gzip
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from loader import Loader, CSV_PARSERS
+
+BUCKET = "collector-bucket"
+
+def news_frame(n, offset=0):
+    #Texts with the characters that make the CSV hard to parse: quotes, commas, newlines, escapes and unicode
+    return pd.DataFrame({
+        "url": [f"https://news.com/{offset + i}" for i in range(n)],
+        "title": [f'Title "{offset + i}", quoted' for i in range(n)],
+        "body": [f"Body of {offset + i}.\nSecond line, with a backslash \\ and ünïcödé — {offset + i}" for i in range(n)],
+    })
+
+def csv_bytes(df):
+    #Written as the collectors do
+    return df.to_csv(index=False, escapechar="\\").encode("utf-8")
+
+def put_csvs(s3_client, keys):
+    s3_client.create_bucket(Bucket=BUCKET)
+    for i, key in enumerate(keys):
+        content = csv_bytes(news_frame(5, offset=10 * i))
+        #Every other file gzip compressed, as with UPLOAD_GZIP
+        s3_client.put_object(Bucket=BUCKET, Key=key, Body=gzip.compress(content) if i % 2 else content)
+
+def loader(csv_parser="pandas", max_workers=2):
+    return Loader(BUCKET, "testing", "testing", "us-east-1", max_workers=max_workers, csv_parser=csv_parser)
+
+def test_iter_csvs_yields_in_key_order(s3_client):
+    keys = [f"news_2024_01_01__{hour:02d}_{minute:02d}_00.csv" for hour in range(3) for minute in (0, 15, 30, 45)]
+    put_csvs(s3_client, keys)
+
+    #More files than the window of 2 * max_workers downloads, and in an order that is not the listing order
+    requested = keys[::-1]
+    loaded = list(loader(max_workers=2).iter_csvs(requested))
+
+    assert [key for key, _ in loaded] == requested
+    for key, df in loaded:
+        offset = 10 * keys.index(key)
+        assert df["url"].tolist() == news_frame(5, offset)["url"].tolist()
+        assert (df["date"] == datetime.strptime(key, "news_%Y_%m_%d__%H_%M_%S.csv")).all()
+
+@pytest.mark.parametrize("df", [
+    news_frame(50),
+    pd.DataFrame({"url": ["https://a.com/1", "https://a.com/2", "NA"], "title": ["", "null", "Title"], "body": ["Body", "N/A", "Body 3"]}),
+])
+def test_parsers_return_equal_frames(df):
+    content = csv_bytes(df)
+
+    pandas_df = CSV_PARSERS["pandas"](content)
+    pyarrow_df = CSV_PARSERS["pyarrow"](content)
+
+    pd.testing.assert_frame_equal(pyarrow_df, pandas_df)
@@ -0,0 +1,54 @@
+import io
+import pandas as pd
+import pyarrow.parquet as pq
+from parquet_sink import ParquetSink, write_parquet
+
+def read_parquet(s3_client, bucket_name, key):
+    return pq.read_table(io.BytesIO(s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()))
+
+def test_column_all_none_in_the_first_rows(s3_client):
+    s3_client.create_bucket(Bucket="clean-bkt")
+    first = pd.DataFrame({"url": ["u0", "u1"], "title": [None, None], "body": ["b0", "b1"], "date": ["2024-01-01 00:00:00"] * 2})
+    second = pd.DataFrame({"url": ["u2"], "title": ["a title"], "body": ["b2"], "date": ["2024-01-01 00:15:00"]})
+
+    rows = write_parquet(s3_client, "clean-bkt", "news.parquet", [first, second])
+
+    table = read_parquet(s3_client, "clean-bkt", "news.parquet")
+    assert rows == 3
+    assert table.column("title").to_pylist() == [None, None, "a title"]
+    assert table.column("url").to_pylist() == ["u0", "u1", "u2"]
+
+def test_row_groups(s3_client):
+    s3_client.create_bucket(Bucket="clean-bkt")
+    df = pd.DataFrame({"url": [f"u{i}" for i in range(1000)], "body": ["x" * 100] * 1000, "date": ["2024-01-01 00:00:00"] * 1000})
+
+    with ParquetSink(s3_client, "clean-bkt", "news.parquet", row_group_bytes=20000) as sink:
+        sink.write(df.iloc[:500])
+        sink.write(df.iloc[500:])
+
+    metadata = pq.ParquetFile(io.BytesIO(s3_client.get_object(Bucket="clean-bkt", Key="news.parquet")["Body"].read())).metadata
+    assert metadata.num_rows == 1000
+    assert metadata.num_row_groups > 1
+    assert read_parquet(s3_client, "clean-bkt", "news.parquet").to_pandas().equals(df)
+
+def column_encodings(metadata, name):
+    row_group = metadata.row_group(0)
+    return next(row_group.column(i).encodings for i in range(row_group.num_columns) if row_group.column(i).path_in_schema == name)
+
+def test_low_cardinality_columns_are_dictionary_encoded(s3_client):
+    s3_client.create_bucket(Bucket="clean-bkt")
+    df = pd.DataFrame({
+        "url": [f"u{i}" for i in range(100)],
+        "title": [f"Site {i % 3}" for i in range(100)],
+        "body": [f"body {i}" for i in range(100)],
+        "date": pd.to_datetime(["2024-01-01 00:00:00", "2024-01-01 00:15:00"] * 50),
+    })
+
+    with ParquetSink(s3_client, "clean-bkt", "news.parquet") as sink:
+        sink.write(df)
+
+    metadata = pq.ParquetFile(io.BytesIO(s3_client.get_object(Bucket="clean-bkt", Key="news.parquet")["Body"].read())).metadata
+    assert sink.dictionary_columns == ("title", "date")
+    assert "RLE_DICTIONARY" in column_encodings(metadata, "title")
+    assert "RLE_DICTIONARY" in column_encodings(metadata, "date")
+    assert "RLE_DICTIONARY" not in column_encodings(metadata, "url")
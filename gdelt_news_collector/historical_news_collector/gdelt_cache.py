@@ -0,0 +1,196 @@
+## The gdelt_cache script defines a local on-disk cache for the GDELT export files. Reruns of overlapping date ranges and
+# retries of skipped dates read the zip files from local disk instead of downloading them again from GDELT.
+
+import os
+import time
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+import requests
+
+logger = logging.getLogger(__name__)
+
+class GdeltCache:
+    """
+    A class used to keep a local copy of the GDELT export files, keyed by the timestamp of their 15 minutes slot.
+    Files are written atomically and the cache is capped by size and age, evicting the least recently used files first.
+
+    Attributes
+    ----------
+    cache_dir : str
+        The directory where the export files are stored.
+    max_bytes : int
+        Maximum total size of the cached files, in bytes.
+    max_age : int
+        Maximum time, in seconds, a file can stay in the cache without being used.
+
+    Methods
+    -------
+    fetch(url, slot_datetime)
+        Returns the local path of the export file of the slot, downloading it only if it is not cached.
+    discard(slot_datetime)
+        Removes the cached file of the slot (e.g. because it could not be parsed).
+    evict()
+        Removes the expired files and then the least recently used ones until the cache fits in max_bytes.
+    """
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, max_age=7 * 24 * 3600, download_timeout=60):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            The directory where the export files are stored. It is created if it does not exist.
+        max_bytes : int, optional
+            Maximum total size of the cached files, in bytes (default is 2GB).
+        max_age : int, optional
+            Maximum time, in seconds, a file can stay in the cache without being used (default is 7 days).
+        download_timeout : int, optional
+            Timeout, in seconds, for the download of a single export file (default is 60).
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.download_timeout = download_timeout
+
+        #Lock for the eviction and one lock per slot being fetched, so the same file is never downloaded twice at the
+        # same time. The lock of a slot is removed once no thread is fetching it, so they do not pile up
+        self._lock = threading.Lock()
+        self._slot_locks = {}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        #Remove partial downloads left behind by a previous run that died, and apply the limits
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".part"):
+                self._remove(os.path.join(self.cache_dir, name))
+        self.evict()
+
+    def _path(self, slot_datetime):
+        return os.path.join(self.cache_dir, f"{slot_datetime.strftime('%Y%m%d%H%M%S')}.export.CSV.zip")
+
+    @contextmanager
+    def _slot_lock(self, key):
+        #Each entry is [lock, number of threads using it]
+        with self._lock:
+            entry = self._slot_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._slot_locks[key]
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def fetch(self, url, slot_datetime):
+        """
+        Returns the local path of the export file of the slot, downloading it only if it is not cached.
+
+        Parameters
+        ----------
+        url : str
+            The GDELT URL of the export file.
+        slot_datetime : datetime
+            The 15 minutes slot the export file belongs to.
+
+        Returns
+        -------
+        str
+            The path of the cached export file.
+
+        Raises
+        ------
+        requests.RequestException
+            If the file is not cached and the download fails.
+        """
+        path = self._path(slot_datetime)
+
+        with self._slot_lock(path):
+            #Cache hit: refresh the modification time, which is the one used to sort files for the LRU eviction
+            if os.path.exists(path):
+                os.utime(path)
+                return path
+
+            #Cache miss: download into a temporary file in the same directory and move it into place atomically
+            response = requests.get(url, stream=True, timeout=self.download_timeout)
+            response.raise_for_status()
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as tmp_file:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        tmp_file.write(chunk)
+                os.replace(tmp_path, path)
+            except Exception:
+                self._remove(tmp_path)
+                raise
+
+        self.evict()
+        return path
+
+    def discard(self, slot_datetime):
+        """
+        Removes the cached file of the slot, if any.
+
+        Parameters
+        ----------
+        slot_datetime : datetime
+            The 15 minutes slot whose file should be removed.
+        """
+        self._remove(self._path(slot_datetime))
+
+    def evict(self):
+        """
+        Removes the files not used for more than max_age seconds and then the least recently used ones until the
+        total size of the cache is below max_bytes.
+        """
+        with self._lock:
+            now = time.time()
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".zip"):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    self._remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            #Oldest used first
+            entries.sort()
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total_size <= self.max_bytes:
+                    break
+                self._remove(path)
+                total_size -= size
+                logger.debug(f"Evicted {path} from the GDELT cache")
+
+
+def cache_from_env():
+    """
+    Creates a GdeltCache configured with the GDELT_CACHE_DIR, GDELT_CACHE_MAX_MB and GDELT_CACHE_MAX_AGE_DAYS
+    environment variables.
+
+    Returns
+    -------
+    GdeltCache
+        The configured cache.
+    """
+    return GdeltCache(
+        cache_dir=os.getenv('GDELT_CACHE_DIR', 'gdelt_cache'),
+        max_bytes=int(os.getenv('GDELT_CACHE_MAX_MB', 2048)) * 1024 ** 2,
+        max_age=int(float(os.getenv('GDELT_CACHE_MAX_AGE_DAYS', 7)) * 24 * 3600)
+    )
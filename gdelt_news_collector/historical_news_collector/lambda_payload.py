@@ -0,0 +1,90 @@
+## The lambda_payload script defines the request and the decoding of the responses of the scraper Lambda function. The
+# function returns the scraped records in the format requested with the "response_format" event field: 'json' (the
+# original one, a JSON string with the list of records, encoded as JSON again by Lambda) or 'columnar-gzip-v1' (gzip
+# compressed JSON columns, base64 encoded inline or stored in S3 when they do not fit in the 6 MB response limit).
+# Versions of the function that do not know the field keep returning 'json', and both are decoded here. When the
+# function could not scrape some URLs before its deadline, a 'json' response is a dict with the "records" and the
+# "unfinished" URLs instead of the plain JSON string.
+
+import os
+import json
+import gzip
+import base64
+import pandas as pd
+
+RESPONSE_FORMAT_JSON = "json"
+RESPONSE_FORMAT_COLUMNAR = "columnar-gzip-v1"
+
+#Columns of the scraped records
+COLUMNS = ["url", "title", "body"]
+
+def build_event(urls, **options):
+    """
+    Builds the event of the scraper function. The response format is set with the LAMBDA_RESPONSE_FORMAT environment
+    variable (default 'columnar-gzip-v1'), and the results that do not fit in the response are stored in the
+    LAMBDA_RESULT_BUCKET bucket, if it is set.
+
+    Parameters
+    ----------
+    urls : list of str
+        The URLs to scrape.
+    **options
+        The rest of fields of the event (backend, extractor, max_workers, ...).
+
+    Returns
+    -------
+    str
+        The JSON event.
+    """
+    event = {"urls": urls, **options, "response_format": os.getenv('LAMBDA_RESPONSE_FORMAT', RESPONSE_FORMAT_COLUMNAR)}
+    if os.getenv('LAMBDA_RESULT_BUCKET'):
+        event["result_bucket"] = os.getenv('LAMBDA_RESULT_BUCKET')
+    return json.dumps(event)
+
+def decode_response(payload, s3_client=None):
+    """
+    Decodes the payload returned by the scraper function into a DataFrame, whatever the format of the response, and
+    returns it with the URLs left unfinished by the function. The results stored in S3 are downloaded and deleted.
+
+    Parameters
+    ----------
+    payload : file object or bytes
+        The Payload of the invoke response.
+    s3_client : boto3.client, optional
+        The S3 client used to read the results stored in S3.
+
+    Returns
+    -------
+    pd.DataFrame
+        The scraped records, with the url, title and body columns.
+    list of str
+        The URLs not scraped before the deadline of the function.
+
+    Raises
+    ------
+    ValueError
+        If the response format is not supported, or the results are in S3 and no client was given.
+    """
+    response = json.loads(payload if isinstance(payload, (bytes, str)) else payload.read())
+
+    #Original format, a JSON string with the list of records
+    if isinstance(response, str):
+        return pd.DataFrame(json.loads(response), columns=COLUMNS), []
+
+    #Original format with some URLs left unfinished
+    if isinstance(response, dict) and response.get("format") == RESPONSE_FORMAT_JSON:
+        return pd.DataFrame(response["records"], columns=COLUMNS), response.get("unfinished", [])
+
+    if not isinstance(response, dict) or response.get("format") != RESPONSE_FORMAT_COLUMNAR:
+        raise ValueError(f"Unsupported scraper response: {str(response)[:200]}")
+
+    if "s3" in response:
+        if s3_client is None:
+            raise ValueError("The scraper results are stored in S3, but no S3 client was given.")
+        location = response["s3"]
+        data = s3_client.get_object(Bucket=location["bucket"], Key=location["key"])["Body"].read()
+        s3_client.delete_object(Bucket=location["bucket"], Key=location["key"])
+    else:
+        data = base64.b64decode(response["data"])
+
+    return pd.DataFrame(json.loads(gzip.decompress(data)), columns=COLUMNS), response.get("unfinished", [])
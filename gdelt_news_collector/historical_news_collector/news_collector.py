@@ -3,11 +3,17 @@ import os
 import sys
 from datetime import datetime, timedelta
 import boto3
-import json
 from tqdm import tqdm
 from dotenv import load_dotenv
 import concurrent.futures
 import time
+import zipfile
+from gdelt_cache import cache_from_env
+from gdelt_reader import read_source_urls
+from url_index import index_from_env
+from upload_sink import save_csv, sink_from_env
+from lambda_dispatcher import dispatcher_from_env, lambda_invoker
+from run_journal import journal_from_env, slot_key, SLOT_PENDING, SLOT_SCRAPED, SLOT_UPLOADED, SLOT_FAILED
 
 #Load the environment
 load_dotenv()
@@ -21,6 +27,15 @@ aws_region = os.getenv('AWS_REGION')
 s3_bucket_name = os.getenv('S3_COLLECTOR_BUCKET_NAME')
 #And the lambda function name
 lambda_function_name = os.getenv('LAMBDA_SCRAPER_FUNCTION_NAME')
+#And the scraping engine the lambda function should use ('threads', 'asyncio' or 'pipeline'), the HTML extractor
+# ('bs4' or 'lxml') and, if set, the number of workers of the engine (otherwise the function uses the default of the
+# engine)
+scraper_options = {
+    "backend": os.getenv('SCRAPER_BACKEND', 'threads'),
+    "extractor": os.getenv('SCRAPER_EXTRACTOR', 'bs4')
+}
+if os.getenv('SCRAPER_MAX_WORKERS'):
+    scraper_options["max_workers"] = int(os.getenv('SCRAPER_MAX_WORKERS'))
 
 
 s3_client = boto3.client(
@@ -37,6 +52,20 @@ lambda_client = boto3.client(
     region_name=aws_region
 )
 
+#Local cache of the GDELT export files, so reruns and retries do not download them again
+gdelt_cache = cache_from_env()
+
+#Index of the article urls already scraped, GDELT reports the same article in many consecutive files
+seen_urls = index_from_env()
+
+#Sends the urls of each slot to the lambda function in concurrent shards, adapting the concurrency to its throttling
+lambda_dispatcher = dispatcher_from_env(
+    lambda_invoker(lambda_client, lambda_function_name, s3_client, **scraper_options)
+)
+
+#Journal of the state of every slot, so a restarted run skips the slots already uploaded
+run_journal = journal_from_env()
+
 #Take count of the dates skipped, either by error or by max_retries in the lambda fucntion call
 skipped_dates = []
 url_col_idx = 60
@@ -52,43 +81,23 @@ def scrape_and_save_s3(url_list, date_of_file):
     Returns:
     None
     """
-    #If we reach the maximum lambda request, wait and try after sleeping, with exponential backoff (max 5 times)
-    max_retries = 5
-    retries = 0
-    while retries < max_retries:
-        try:
-            #Call created lambda function with the list of urls "url_list"
-            response = lambda_client.invoke(
-                FunctionName=lambda_function_name,
-                InvocationType='RequestResponse',
-                Payload=json.dumps({"urls": url_list})
-            )
-            break
-        #If the exception is because we have reached the maximum concurrecy allowed by lambda, wait,  up to 5 retries
-        except lambda_client.exceptions.TooManyRequestsException:
-            print(f"Too many requests. Retrying in {2 ** retries} seconds...")
-            time.sleep(2 ** retries)
-            retries += 1
-        #Otherwise, consider a failed operation and avoid retrying
-        except Exception as e:
-            print(f"Error inside scrape_and_save_s3 function for date {date_of_file}: {e}")
-            #Add date to the skipped ones
-            skipped_dates.append(date_of_file)
-            return
-    #If we have reached the maximum retries, skip this file an exit the function
-    if retries == max_retries:
-        print(f"Failed to invoke Lambda function after {max_retries} retries. Skipping date {date_of_file}.")
+    #Scrape the urls in concurrent shards of the lambda function. The throttled and failed shards are retried by the
+    # dispatcher, without invoking again the shards already scraped
+    df_for_s3, failed_urls = lambda_dispatcher.dispatch(url_list)
+
+    #If nothing could be scraped after all the retries, skip this file. Otherwise the scraped part is uploaded and only
+    # the urls of the shards that failed are recorded as missing, they are dispatched again by recover_missing_urls
+    # at the end of the run
+    if failed_urls and df_for_s3.empty:
+        print(f"None of the {len(url_list)} urls could be scraped. Skipping date {date_of_file}.")
         #Add date to the skipped ones
         skipped_dates.append(date_of_file)
+        run_journal.mark(date_of_file, SLOT_FAILED, reason=f"{len(failed_urls)} of {len(url_list)} urls could not be scraped")
         return
-    
-    #Get the response payload
-    response_payload = json.load(response['Payload'])
-
-    #Convert the response payload from string to a list of dictionaries
-    response_list = json.loads(response_payload)
-    #Create the DF to store into S3
-    df_for_s3 = pd.DataFrame(response_list)
+    if failed_urls:
+        print(f"{len(failed_urls)} of {len(url_list)} urls could not be scraped. Uploading the rest of date {date_of_file}.")
+    run_journal.record_missing(date_of_file, failed_urls)
+    run_journal.mark(date_of_file, SLOT_SCRAPED)
 
     #Drop the rows with NaN values
     df_for_s3 = df_for_s3.dropna()
@@ -96,14 +105,47 @@ def scrape_and_save_s3(url_list, date_of_file):
     #Save the response from the lambda function into a csv in S3
     result_filename = f"news_{date_of_file.strftime('%Y_%m_%d__%H_%M_%S')}.csv"
 
-    df_for_s3.to_csv(result_filename, index=False, escapechar="\\")
+    #Our time to write to S3, serializing the csv straight into the upload (no local file is written, so the
+    # threads never write the same file)
+    save_csv(sink_from_env(s3_client, s3_bucket_name), result_filename, df_for_s3, escapechar="\\")
+
+    #Register the scraped urls, so they are not scraped again in the following files
+    seen_urls.mark_seen(df_for_s3['url'])
+    run_journal.mark(date_of_file, SLOT_UPLOADED, reason=f"{len(failed_urls)} urls could not be scraped" if failed_urls else None)
+
 
-    #Our time to write to S3
-    s3_client.upload_file(result_filename, s3_bucket_name, result_filename)
+def recover_missing_urls():
+    """
+    Dispatches again the urls recorded as missing in the run journal (also the ones of previous runs). The recovered
+    news of each slot are saved in a new file of the slot ('news_<slot>.recovered_<unix time>.csv', read by the
+    data_cleaner as a file of the same slot), so the file already uploaded is not overwritten. The urls that fail again
+    stay recorded for the next run.
 
-    #Delete the local result file
-    os.remove(result_filename)
+    Returns:
+    None
+    """
+    missing = run_journal.missing()
+    if not missing:
+        return
 
+    print(f"Recovering {sum(len(urls) for urls in missing.values())} missing urls of {len(missing)} slots...")
+    for key, urls in tqdm(missing.items(), desc="Recovering missing urls"):
+        date_of_file = datetime.strptime(key, "%Y%m%d%H%M%S")
+        try:
+            #Some of them may have been scraped from a later file meanwhile
+            urls = seen_urls.filter_unseen(urls)
+            df_recovered, failed_urls = lambda_dispatcher.dispatch(urls) if urls else (None, [])
+
+            if df_recovered is not None and not df_recovered.empty:
+                df_recovered = df_recovered.dropna()
+                result_filename = f"news_{date_of_file.strftime('%Y_%m_%d__%H_%M_%S')}.recovered_{int(time.time())}.csv"
+                save_csv(sink_from_env(s3_client, s3_bucket_name), result_filename, df_recovered, escapechar="\\")
+                seen_urls.mark_seen(df_recovered['url'])
+
+            run_journal.record_missing(date_of_file, failed_urls)
+            run_journal.mark(date_of_file, SLOT_UPLOADED, reason=f"{len(failed_urls)} urls could not be scraped" if failed_urls else None)
+        except Exception as e:
+            print(f"Failed to recover the missing urls of {date_of_file}: {e}")
 
 def fetch_and_scrape(url, formatted_datetime):
     """
@@ -117,26 +159,33 @@ def fetch_and_scrape(url, formatted_datetime):
     None
     """
     try:
-        #Get the current CSV column for the urls of that timestamp
-        curr_url_list = pd.read_csv(
-            url, 
-            delimiter='\t', 
-            header=None, 
-            quotechar='"',
-            escapechar='\\',
-            on_bad_lines='skip'
-        )[url_col_idx].unique().tolist()
+        #Get the export file from the local cache (it is only downloaded if it was not cached yet)
+        local_path = gdelt_cache.fetch(url, formatted_datetime)
+
+        #Stream the export file and get the unique urls of its url column, without loading the rest of columns
+        curr_url_list = read_source_urls(local_path, col_idx=url_col_idx)
+
+        #Skip the urls already scraped from previous files
+        curr_url_list = seen_urls.filter_unseen(curr_url_list)
+        if not curr_url_list:
+            #Nothing left to do for this slot
+            run_journal.mark(formatted_datetime, SLOT_UPLOADED, reason="no new urls")
+            return
         
         #Call the function to scrape the urls and save them to the S3 bucket
         scrape_and_save_s3(curr_url_list, formatted_datetime)
-    except pd.errors.ParserError as e:
+    except zipfile.BadZipFile as e:
         print(f"Error parsing CSV at {formatted_datetime}: {e}")
+        #Do not keep a file that cannot be parsed in the cache
+        gdelt_cache.discard(formatted_datetime)
         #Add date to the skipped ones
         skipped_dates.append(formatted_datetime)
+        run_journal.mark(formatted_datetime, SLOT_FAILED, reason=f"bad zip file: {e}")
     except Exception as e:
         print(f"Error inside scrape_and_save_s3 function: {e}")
         #Add date to the skipped ones
         skipped_dates.append(formatted_datetime) 
+        run_journal.mark(formatted_datetime, SLOT_FAILED, reason=str(e))
 
 
 def news_to_scrape_to_s3(start_date_str, end_date_str, concurrent_threads=5):
@@ -183,11 +232,18 @@ def news_to_scrape_to_s3(start_date_str, end_date_str, concurrent_threads=5):
         url = base_url.format(datetime=formatted_datetime)
         urls_to_scrape.append((url, current_date))
         current_date += timedelta(minutes=15)
+
+    #Skip the slots uploaded by a previous run, and start a new attempt for the rest
+    completed = run_journal.completed(date for _, date in urls_to_scrape)
+    if completed:
+        print(f"Skipping {len(completed)} slots already uploaded according to the run journal.")
+        urls_to_scrape = [(url, date) for url, date in urls_to_scrape if slot_key(date) not in completed]
+    run_journal.mark([date for _, date in urls_to_scrape], SLOT_PENDING)
     
     #Use ThreadPoolExecutor to process URLs in parallel with progress bar
     with concurrent.futures.ThreadPoolExecutor(max_workers=concurrent_threads) as executor:
         futures = [executor.submit(fetch_and_scrape, url, date) for url, date in urls_to_scrape]
-        for future in tqdm(concurrent.futures.as_completed(futures), total=total_iterations, desc="Processing URLs"):
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(urls_to_scrape), desc="Processing URLs"):
             try:
                 future.result()
             except Exception as e:
@@ -204,10 +260,11 @@ def retry_skipped_dates():
         print("No skipped dates to retry.")
         return
 
-    print(f"Retrying skipped dates...")
+    print("Retrying skipped dates...")
 
     #Convert datetime objects to strings for retry
     skipped_urls_to_scrape = [(f"http://data.gdeltproject.org/gdeltv2/{date.strftime('%Y%m%d%H%M%S')}.export.CSV.zip", date) for date in skipped_dates]
+    run_journal.mark(skipped_dates, SLOT_PENDING)
 
     for url, date in tqdm(skipped_urls_to_scrape, desc="Retrying skipped dates"):
         try:
@@ -244,14 +301,22 @@ if __name__ == "__main__":
 
         #Print the final message and the dates that have been skipped
         print(f"All news collected! Skipped dates: {skipped_dates}")
+        print(f"Seen urls index: {seen_urls.stats()}")
+        print(f"Lambda dispatcher: {lambda_dispatcher.stats()}")
+        print(f"Run journal: {run_journal.stats()}")
+
+        #Dispatch again the urls of the slots uploaded without them, of this run and of the previous ones
+        recover_missing_urls()
+        print(f"Urls that could not be scraped: {sum(len(urls) for urls in run_journal.missing().values())}")
 
         #If inidcated, try and collect those skipped dates
         if retry_skipped_dates_arg == "yes":
 
-            print(f"Sleeping before retrying...")
+            print("Sleeping before retrying...")
             time.sleep(10)
 
             retry_skipped_dates()
+            print(f"Run journal: {run_journal.stats()}")
 
             print("Finished!")
 
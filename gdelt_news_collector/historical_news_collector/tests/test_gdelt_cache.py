@@ -0,0 +1,129 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import gdelt_cache
+from gdelt_cache import GdeltCache
+
+SLOT = datetime(2024, 1, 1, 0, 15)
+
+class FakeResponse:
+    def __init__(self, chunks, fail_after=None):
+        self.chunks = chunks
+        self.fail_after = fail_after
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=None):
+        for i, chunk in enumerate(self.chunks):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise ConnectionError("Connection reset")
+            yield chunk
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """
+    Replaces the download of the export files, recording the requested URLs. The response of the next downloads can
+    be changed with downloads.response.
+    """
+    class Downloads(list):
+        response = None
+        def get(self, url, stream=False, timeout=None):
+            self.append(url)
+            return self.response or FakeResponse([b"PK", b"zip bytes of ", url.encode()])
+    fake = Downloads()
+    monkeypatch.setattr(gdelt_cache.requests, "get", fake.get)
+    return fake
+
+def slot(i):
+    return SLOT + timedelta(minutes=15 * i)
+
+def test_fetch_downloads_once(tmp_path, downloads):
+    cache = GdeltCache(str(tmp_path))
+
+    path = cache.fetch("http://gdelt/1.zip", SLOT)
+    assert cache.fetch("http://gdelt/1.zip", SLOT) == path
+    assert downloads == ["http://gdelt/1.zip"]
+    with open(path, "rb") as cached:
+        assert cached.read() == b"PKzip bytes of http://gdelt/1.zip"
+
+    #No lock is kept for the slots not being fetched
+    assert cache._slot_locks == {}
+
+def test_failed_download_leaves_no_file(tmp_path, downloads):
+    cache = GdeltCache(str(tmp_path))
+    downloads.response = FakeResponse([b"PK", b"partial", b"rest"], fail_after=2)
+
+    with pytest.raises(ConnectionError):
+        cache.fetch("http://gdelt/1.zip", SLOT)
+    assert os.listdir(tmp_path) == []
+
+    #The next fetch downloads it again
+    downloads.response = None
+    assert os.path.exists(cache.fetch("http://gdelt/1.zip", SLOT))
+    assert len(downloads) == 2
+
+def test_partial_downloads_removed_on_start(tmp_path):
+    (tmp_path / "tmpabc.part").write_bytes(b"partial")
+    (tmp_path / "20240101001500.export.CSV.zip").write_bytes(b"PK")
+
+    GdeltCache(str(tmp_path))
+
+    assert os.listdir(tmp_path) == ["20240101001500.export.CSV.zip"]
+
+def test_eviction_by_age_and_size(tmp_path, downloads):
+    cache = GdeltCache(str(tmp_path), max_bytes=10 ** 9, max_age=3600)
+    paths = [cache.fetch(f"http://gdelt/{i}.zip", slot(i)) for i in range(5)]
+    size = os.path.getsize(paths[0])
+
+    #Last used: 0 two hours ago (expired), then 3, 1, 4, 2 (most recent)
+    now = time.time()
+    for i, age in [(0, 7200), (3, 500), (1, 400), (4, 300), (2, 200)]:
+        os.utime(paths[i], (now - age, now - age))
+
+    #Room for two files: the expired one and then the least recently used ones are removed
+    cache.max_bytes = 2 * size + 1
+    cache.evict()
+
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(paths[i]) for i in (2, 4))
+
+def test_cache_hit_refreshes_lru(tmp_path, downloads):
+    cache = GdeltCache(str(tmp_path))
+    first = cache.fetch("http://gdelt/0.zip", slot(0))
+    second = cache.fetch("http://gdelt/1.zip", slot(1))
+    old = time.time() - 100
+    os.utime(first, (old, old))
+    os.utime(second, (old + 10, old + 10))
+
+    #Using the first one makes the second the least recently used
+    cache.fetch("http://gdelt/0.zip", slot(0))
+    cache.max_bytes = os.path.getsize(first)
+    cache.evict()
+
+    assert os.listdir(tmp_path) == [os.path.basename(first)]
+
+def test_discard(tmp_path, downloads):
+    cache = GdeltCache(str(tmp_path))
+    path = cache.fetch("http://gdelt/1.zip", SLOT)
+
+    cache.discard(SLOT)
+    cache.discard(SLOT)
+
+    assert not os.path.exists(path)
+    cache.fetch("http://gdelt/1.zip", SLOT)
+    assert len(downloads) == 2
+
+def test_concurrent_fetches_of_a_slot(tmp_path, downloads):
+    cache = GdeltCache(str(tmp_path))
+    threads = [threading.Thread(target=cache.fetch, args=("http://gdelt/1.zip", SLOT)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert downloads == ["http://gdelt/1.zip"]
+    assert cache._slot_locks == {}
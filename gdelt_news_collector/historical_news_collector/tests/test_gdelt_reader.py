@@ -0,0 +1,42 @@
+import os
+import zipfile
+
+import pandas as pd
+
+import gdelt_reader
+from gdelt_reader import read_source_urls
+
+#A GDELT export file with valid rows and short rows, rows with too many fields, empty URLs, blank lines, quoted and
+# escaped fields, and both '\r\n' and '\n' line endings
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "20240101001500.export.CSV.zip")
+
+def pandas_source_urls(path):
+    #The original reading of the collectors, without the missing values
+    urls = pd.read_csv(path, delimiter='\t', header=None, quotechar='"', escapechar='\\', on_bad_lines='skip')[60].unique().tolist()
+    return [url for url in urls if isinstance(url, str)]
+
+def test_same_urls_as_pandas():
+    urls = read_source_urls(FIXTURE)
+
+    assert urls == pandas_source_urls(FIXTURE)
+    assert "https://quoted.com/a" in urls and "https://escaped.com/a" in urls
+    assert not any(host in url for url in urls for host in ("short.com", "long.com", "trailing.com"))
+
+def test_extracted_csv(tmp_path):
+    with zipfile.ZipFile(FIXTURE) as zip_file:
+        path = zip_file.extract(zip_file.namelist()[0], tmp_path)
+
+    assert read_source_urls(path) == read_source_urls(FIXTURE)
+
+def test_zip_file_is_closed(monkeypatch):
+    opened = []
+    class TrackedZipFile(zipfile.ZipFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            opened.append(self)
+    monkeypatch.setattr(gdelt_reader.zipfile, "ZipFile", TrackedZipFile)
+
+    read_source_urls(FIXTURE)
+
+    assert len(opened) == 1
+    assert opened[0].fp is None
@@ -0,0 +1,78 @@
+import time
+import random
+import threading
+import pandas as pd
+import pytest
+
+from lambda_dispatcher import LambdaDispatcher, AimdLimiter, ThrottledError
+
+class SimulatedLambda:
+    """
+    A local stand-in of the scraper function with the interface of the invoke function of a LambdaDispatcher. It
+    throttles the invocations above its concurrency limit, takes some time per invocation, fails at random, and returns
+    a fake record for every URL, or only for the first max_urls ones (as if the function ran out of time), returning
+    the rest as unfinished.
+    """
+    def __init__(self, concurrency_limit=10, latency=0.01, failure_rate=0.0, max_urls=None, seed=0):
+        self.concurrency_limit = concurrency_limit
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.max_urls = max_urls
+        self.running = 0
+        self.peak = 0
+        self.throttled = 0
+        self.failed = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, urls):
+        with self._lock:
+            if self.running >= self.concurrency_limit:
+                self.throttled += 1
+                raise ThrottledError("Rate Exceeded.")
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            fails = self._random.random() < self.failure_rate
+            self.failed += fails
+        try:
+            scraped, unfinished = urls[:self.max_urls], urls[len(urls[:self.max_urls]):]
+            time.sleep(self.latency)
+            if fails:
+                raise RuntimeError("Simulated failure")
+            return pd.DataFrame({"url": scraped, "title": [f"Title of {url}" for url in scraped], "body": [f"Body of {url}" for url in scraped]}), unfinished
+        finally:
+            with self._lock:
+                self.running -= 1
+
+def dispatch(simulated, n_urls=600, max_attempts=4):
+    dispatcher = LambdaDispatcher(
+        simulated, shard_size=20, limiter=AimdLimiter(initial=4, maximum=32), max_attempts=max_attempts, backoff=0.01
+    )
+    urls = [f"https://example.com/{i}" for i in range(n_urls)]
+    df, failed = dispatcher.dispatch(urls)
+    return urls, df, failed
+
+@pytest.mark.parametrize("failure_rate, max_urls", [(0.0, None), (0.2, None), (0.0, 7), (0.2, 7)])
+def test_every_url_comes_back_once(failure_rate, max_urls):
+    simulated = SimulatedLambda(concurrency_limit=6, failure_rate=failure_rate, max_urls=max_urls)
+    urls, df, failed = dispatch(simulated, max_attempts=20)
+
+    assert simulated.throttled > 0
+    assert simulated.peak <= simulated.concurrency_limit
+    assert not failed
+    assert sorted(df["url"]) == sorted(urls)
+    assert df["url"].is_unique
+
+def test_failed_shards_are_returned_once():
+    #Every invocation fails, so every URL ends up in the failed shards and none in the records
+    simulated = SimulatedLambda(concurrency_limit=6, failure_rate=1.0)
+    urls, df, failed = dispatch(simulated, n_urls=100, max_attempts=2)
+
+    assert df.empty
+    assert sorted(failed) == sorted(urls)
+
+def test_results_keep_the_order_of_the_shards():
+    simulated = SimulatedLambda(concurrency_limit=100)
+    urls, df, failed = dispatch(simulated)
+
+    assert df["url"].tolist() == urls
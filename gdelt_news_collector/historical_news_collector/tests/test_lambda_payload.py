@@ -0,0 +1,36 @@
+import json
+import gzip
+import base64
+
+from lambda_payload import decode_response, COLUMNS
+
+RECORDS = [
+    {"url": "https://a.com/1", "title": "First", "body": "First body."},
+    {"url": "https://b.com/2", "title": "Second", "body": "Second body."},
+]
+
+def payload(response):
+    #Lambda encodes the value returned by the handler as JSON
+    return json.dumps(response).encode("utf-8")
+
+def test_plain_json_response():
+    df, unfinished = decode_response(payload(json.dumps(RECORDS)))
+
+    assert df.to_dict("records") == RECORDS
+    assert unfinished == []
+
+def test_json_response_with_unfinished_urls():
+    response = {"format": "json", "records": RECORDS, "unfinished": ["https://c.com/3"]}
+    df, unfinished = decode_response(payload(response))
+
+    assert df.to_dict("records") == RECORDS
+    assert unfinished == ["https://c.com/3"]
+
+def test_columnar_response():
+    columns = {column: [record[column] for record in RECORDS] for column in COLUMNS}
+    data = base64.b64encode(gzip.compress(json.dumps(columns).encode("utf-8"))).decode("ascii")
+    response = {"format": "columnar-gzip-v1", "count": 2, "unfinished": ["https://c.com/3"], "data": data}
+    df, unfinished = decode_response(payload(response))
+
+    assert df.to_dict("records") == RECORDS
+    assert unfinished == ["https://c.com/3"]
@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from run_journal import RunJournal, SLOT_PENDING, SLOT_UPLOADED
+
+def test_missing_urls_are_recorded_by_slot(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.sqlite3"))
+    first, second = datetime(2024, 1, 1, 0, 0), datetime(2024, 1, 1, 0, 15)
+    journal.mark([first, second], SLOT_PENDING)
+
+    journal.record_missing(first, ["https://a.com/2", "https://a.com/1"])
+    journal.record_missing(second, [])
+    journal.mark([first, second], SLOT_UPLOADED)
+
+    assert journal.completed([first, second]) == {"20240101000000", "20240101001500"}
+    assert journal.missing() == {"20240101000000": ["https://a.com/1", "https://a.com/2"]}
+    assert journal.missing([second]) == {}
+
+    #A new attempt of the slot replaces its missing urls
+    journal.record_missing(first, ["https://a.com/2"])
+    assert journal.missing([first]) == {"20240101000000": ["https://a.com/2"]}
+    journal.record_missing(first, [])
+    assert journal.missing() == {}
+    journal.close()
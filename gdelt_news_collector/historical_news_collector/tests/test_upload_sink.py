@@ -0,0 +1,39 @@
+import gzip
+import boto3
+import pandas as pd
+import pytest
+from moto import mock_aws
+from upload_sink import UploadSink, S3Sink, LocalSink, save_csv
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="collector-bkt")
+        yield client
+
+def test_upload_sink_is_abstract():
+    with pytest.raises(TypeError):
+        UploadSink()
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_multipart_upload(s3_client, compress):
+    #About 12 MB of CSV, uploaded in parts of 5 MiB
+    df = pd.DataFrame({"url": [f"https://example.com/{i}" for i in range(20000)], "body": ["x" * 600] * 20000})
+
+    save_csv(S3Sink(s3_client, "collector-bkt", compress=compress, part_size=0), "news.csv", df)
+
+    obj = s3_client.get_object(Bucket="collector-bkt", Key="news.csv")
+    content = obj["Body"].read()
+    assert obj["ContentType"] == "text/csv"
+    assert (gzip.decompress(content) if compress else content) == df.to_csv(index=False).encode("utf-8")
+
+def test_failed_write_is_discarded(tmp_path):
+    sink = LocalSink(str(tmp_path))
+    with pytest.raises(RuntimeError):
+        with sink.open("news.csv") as stream:
+            stream.write(b"partial")
+            raise RuntimeError("serialization failed")
+    assert list(tmp_path.iterdir()) == []
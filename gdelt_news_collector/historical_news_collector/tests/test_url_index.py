@@ -0,0 +1,54 @@
+import time
+import sqlite3
+from url_index import SeenUrlIndex, canonicalize_url
+
+def test_filter_unseen(tmp_path):
+    index = SeenUrlIndex(str(tmp_path / "seen.sqlite3"), expected_items=1000)
+    index.mark_seen(["https://Example.com/a/?utm_source=x#top"])
+
+    assert index.filter_unseen(["https://example.com/a", "https://example.com/b", "https://example.com/b/"]) == ["https://example.com/b"]
+    assert index.stats()["hits"] == 1
+
+def test_retention(tmp_path):
+    path = str(tmp_path / "seen.sqlite3")
+    index = SeenUrlIndex(path, expected_items=1000, retention_days=1)
+    index.mark_seen(["https://example.com/old", "https://example.com/new"])
+    #Age one of the urls past the retention
+    index._conn.execute("UPDATE seen_urls SET first_seen = ? WHERE url = ?", (time.time() - 2 * 24 * 3600, canonicalize_url("https://example.com/old")))
+    index._conn.commit()
+    index.close()
+
+    reopened = SeenUrlIndex(path, expected_items=1000, retention_days=1)
+    assert reopened.pruned == 1
+    assert reopened.stats()["size"] == 1
+    assert reopened.filter_unseen(["https://example.com/old", "https://example.com/new"]) == ["https://example.com/old"]
+
+def test_index_without_first_seen(tmp_path):
+    #Indexes written before the retention existed only have the url column
+    path = str(tmp_path / "seen.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE seen_urls (url TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("INSERT INTO seen_urls (url) VALUES (?)", (canonicalize_url("https://example.com/a"),))
+    conn.commit()
+    conn.close()
+
+    index = SeenUrlIndex(path, expected_items=1000, retention_days=1)
+    assert index.pruned == 0
+    assert index.filter_unseen(["https://example.com/a", "https://example.com/b"]) == ["https://example.com/b"]
+
+def test_claimed_urls(tmp_path):
+    index = SeenUrlIndex(str(tmp_path / "seen.sqlite3"), expected_items=1000)
+
+    #The urls of a slot in flight are skipped by the next slots, before being saved
+    assert index.filter_unseen(["https://example.com/a", "https://example.com/b"], claim=True) == ["https://example.com/a", "https://example.com/b"]
+    assert index.filter_unseen(["https://example.com/a/", "https://example.com/c"], claim=True) == ["https://example.com/c"]
+    assert index.stats()["claimed"] == 3
+
+    #Saved urls become seen, released ones (their slot failed) can be claimed again
+    index.mark_seen(["https://example.com/a"])
+    index.release(["https://example.com/b"])
+    assert index.stats()["claimed"] == 1
+    assert index.filter_unseen(["https://example.com/a", "https://example.com/b", "https://example.com/c"], claim=True) == ["https://example.com/b"]
+
+    #Without claim, only the index is checked
+    assert index.filter_unseen(["https://example.com/c"]) == ["https://example.com/c"]
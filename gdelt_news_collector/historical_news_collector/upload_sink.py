@@ -0,0 +1,208 @@
+## The upload_sink script defines where the collectors write their result files. Instead of writing each CSV to the
+# working directory, uploading it and removing it, the CSV is serialized straight into the upload: small files are sent
+# with a single put_object and large ones with an S3 multipart upload as the parts fill, optionally gzip compressed. No
+# temporary file is written, so several threads can save files at the same time and the container filesystem can be
+# read-only. The LocalSink has the same interface and writes the files into a local directory (for tests and local runs).
+
+import os
+import gzip
+import tempfile
+from abc import ABC, abstractmethod
+from io import TextIOWrapper
+from contextlib import contextmanager
+from s3_multipart import S3MultipartWriter
+
+class LocalFileWriter:
+    """
+    A write-only file object that writes into a temporary file next to the destination and moves it into place
+    atomically on close, so a half written file is never visible.
+    """
+    def __init__(self, path):
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        os.remove(self._tmp_path)
+
+class UploadSink(ABC):
+    """
+    Base class of the sinks. A sink opens a binary stream for a key, and the file is only written (committed) once
+    the stream is closed without errors.
+
+    Attributes
+    ----------
+    compress : bool
+        Whether the files are gzip compressed.
+
+    Methods
+    -------
+    open(key)
+        Context manager that returns a binary stream writing to the file of the key.
+    """
+    def __init__(self, compress=False):
+        self.compress = compress
+
+    @abstractmethod
+    def _writer(self, key):
+        """
+        Returns the writer of the file of the key, a binary file object with write, close (commits the file) and
+        abort (discards it) methods.
+        """
+
+    @contextmanager
+    def open(self, key):
+        """
+        Opens a binary stream that writes to the file of the key. The file is committed when the with block ends, or
+        discarded if it raises.
+
+        Parameters
+        ----------
+        key : str
+            The key (or relative path) of the file.
+
+        Yields
+        ------
+        file object
+            The writable binary stream, gzip compressed if compress is True.
+        """
+        writer = self._writer(key)
+        #mtime=0 so the same content always gives the same bytes
+        stream = gzip.GzipFile(fileobj=writer, mode="wb", mtime=0) if self.compress else writer
+        try:
+            yield stream
+            if self.compress:
+                #Writes the gzip trailer, the writer is not closed by the GzipFile
+                stream.close()
+            writer.close()
+        except BaseException:
+            writer.abort()
+            if self.compress:
+                stream.fileobj = None
+            raise
+
+class S3Sink(UploadSink):
+    """
+    A sink that uploads the files to an S3 bucket. Compressed files keep their key and are uploaded with
+    ContentEncoding 'gzip'.
+    """
+    def __init__(self, s3_client, bucket_name, compress=False, part_size=8 * 1024 * 1024):
+        """
+        Parameters
+        ----------
+        s3_client : boto3.client
+            The S3 client used to upload the files.
+        bucket_name : str
+            The name of the S3 bucket.
+        compress : bool, optional
+            Whether the files are gzip compressed (default is False).
+        part_size : int, optional
+            Size of the parts of the multipart uploads, in bytes (default is 8 MiB).
+        """
+        super().__init__(compress)
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.part_size = part_size
+
+    def _writer(self, key):
+        extra_args = {"ContentType": "text/csv"}
+        if self.compress:
+            extra_args["ContentEncoding"] = "gzip"
+        return S3MultipartWriter(self.s3_client, self.bucket_name, key, self.part_size, extra_args)
+
+class LocalSink(UploadSink):
+    """
+    A sink that writes the files into a local directory, with the same interface as the S3Sink.
+    """
+    def __init__(self, directory, compress=False):
+        """
+        Parameters
+        ----------
+        directory : str
+            The directory where the files are written.
+        compress : bool, optional
+            Whether the files are gzip compressed (default is False).
+        """
+        super().__init__(compress)
+        self.directory = directory
+
+    def _writer(self, key):
+        return LocalFileWriter(os.path.join(self.directory, key))
+
+def save_csv(sink, key, df, **to_csv_options):
+    """
+    Serializes the DataFrame as CSV straight into the sink, without writing a local file.
+
+    Parameters
+    ----------
+    sink : UploadSink
+        The sink where the file is written.
+    key : str
+        The key of the file.
+    df : pd.DataFrame
+        The DataFrame to save.
+    **to_csv_options
+        Options of DataFrame.to_csv (the index is never written).
+    """
+    with sink.open(key) as stream:
+        text = TextIOWrapper(stream, encoding="utf-8", newline="")
+        df.to_csv(text, index=False, **to_csv_options)
+        text.flush()
+        #Leave the stream open, it is closed by the sink
+        text.detach()
+
+def sink_from_env(s3_client, bucket_name):
+    """
+    Creates the sink of a bucket configured with the UPLOAD_SINK_DIR and UPLOAD_GZIP environment variables. When
+    UPLOAD_SINK_DIR is set, the files are written into '<UPLOAD_SINK_DIR>/<bucket_name>' instead of S3.
+
+    Parameters
+    ----------
+    s3_client : boto3.client
+        The S3 client used to upload the files.
+    bucket_name : str
+        The name of the S3 bucket.
+
+    Returns
+    -------
+    UploadSink
+        The configured sink.
+    """
+    compress = os.getenv('UPLOAD_GZIP', 'false').lower() in ("1", "true", "yes")
+    local_dir = os.getenv('UPLOAD_SINK_DIR')
+    if local_dir:
+        return LocalSink(os.path.join(local_dir, bucket_name), compress=compress)
+    return S3Sink(s3_client, bucket_name, compress=compress)
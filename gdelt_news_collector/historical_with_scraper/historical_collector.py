@@ -1,14 +1,19 @@
 import pandas as pd
 import os
-from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from tqdm import tqdm
 from dotenv import load_dotenv
-import concurrent.futures
 import time
+import queue
+import threading
+import zipfile
 import logging
-from lambda_scraper import parallel_scraping
+from lambda_scraper import SCRAPING_BACKENDS, start_parse_pool
 from cleaner_saver import CleanerSaver
+from gdelt_cache import cache_from_env
+from gdelt_reader import read_source_urls
+from url_index import index_from_env
+from run_journal import journal_from_env, slot_key, SLOT_PENDING, SLOT_SCRAPED, SLOT_CLEANED, SLOT_UPLOADED, SLOT_FAILED
 
 #Load the environment
 load_dotenv()
@@ -37,77 +42,70 @@ concurrent_threads = int(os.getenv('CONCURRENT_THREADS', 5))
 retry_skipped_dates_arg = os.getenv('RETRY_SKIPPED_DATES', 'no').lower()
 timeout = int(os.getenv("SCRAPER_TIMEOUT", 5))
 scraper_max_workers = int(os.getenv('SCRAPER_MAX_WORKERS', 5))
+scraper_backend = os.getenv('SCRAPER_BACKEND', 'threads')  # 'threads', 'asyncio' or 'pipeline'
+scraper_max_per_host = int(os.getenv('SCRAPER_MAX_PER_HOST', 4))
+scraper_extractor = os.getenv('SCRAPER_EXTRACTOR', 'bs4')  # 'bs4' or 'lxml'
+
+#Local cache of the GDELT export files, so reruns and retries do not download them again
+gdelt_cache = cache_from_env()
+
+#Index of the article urls already scraped, GDELT reports the same article in many consecutive files
+seen_urls = index_from_env()
+
+#Journal of the state of every slot, so a restarted run skips the slots already uploaded
+run_journal = journal_from_env()
 
 #Take count of the dates skipped, either by error or by max_retries in the lambda fucntion call
 skipped_dates = []
 url_col_idx = 60
 
-def parallel_apply(df, func, max_workers=4):
+def clean_scraped_df(df_to_clean, cleaner_saver):
     """
-    Applies a function to all rows of the 'body' column in the DataFrame in parallel.
+    Cleans the bodies of the news scraped from a single slot.
 
     Parameters:
-    - df: pandas DataFrame, The DataFrame to apply the function to.
-    - func: callable, The function to apply to each element of the 'body' column.
-    - max_workers: int, The maximum number of threads to use.
+    df_to_clean (pd.DataFrame): The scraped news of the slot.
+    cleaner_saver (CleanerSaver): The cleaner used for the bodies.
 
     Returns:
-    - df: pandas DataFrame, The DataFrame with the applied function.
+    tuple: The cleaned DataFrame and the list of every scraped url (also the ones discarded by the cleaner).
     """
-    # The resulting column after applying the function
-    result_series = pd.Series(index=df.index, dtype=object)
+    scraped_urls = df_to_clean["url"].tolist()
 
-    def apply_function(row_index, row_value):
-        try:
-            return func(row_value)
-        except Exception as e:
-            logger.error(f"Error applying function to row {row_index}: {e}")
-            return None
+    #First filter very ver large text and very small text. This is done to avoid processing text very long or short that we will
+    # then later discard anyways
+    df_to_clean["len_body"] = df_to_clean["body"].apply(len)
+    df_to_clean = df_to_clean[(df_to_clean["len_body"] > 500) & (df_to_clean["len_body"] < 15000)]
+    df_to_clean = df_to_clean.copy()
+    df_to_clean = df_to_clean.drop(columns=["len_body"])
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Map each row index and value to the executor
-        futures = {
-            executor.submit(apply_function, idx, val): idx
-            for idx, val in df['body'].items()
-        }
+    #Now, proceed to clean the df on the worker processes of the cleaner
+    df_to_clean["body"] = cleaner_saver.clean_many(df_to_clean["body"])
+    df_to_clean.dropna(subset=["body"], inplace=True)
+    return df_to_clean, scraped_urls
 
-        for future in concurrent.futures.as_completed(futures):
-            row_index = futures[future]
-            try:
-                result = future.result()
-                result_series.at[row_index] = result
-            except Exception as e:
-                logger.error(f"Error in future for row {row_index}: {e}")
-                result_series.at[row_index] = None
-
-    df['body'] = result_series
-    df.dropna(subset=['body'], inplace=True)
-    return df
-
-def join_dfs_clean_and_save(accumulated_results, cleaner_saver):
-    #Clean data
-    '''
-    for df in accumulated_results:
-        df['body'] = df['body'].apply(cleaner_saver.clean_text)
-        df.dropna(subset=['body'], inplace=True)
-    '''
-    max_workers = 20  # You can adjust this based on your CPU cores
-    cleaned_dataframes = []
-    for df_to_clean in accumulated_results:
-        #First filter very ver large text and very small text. This is done to avoid processing text very long or short that we will
-        # then later discard anyways
-        df_to_clean["len_body"] = df_to_clean["body"].apply(len)
-        df_to_clean = df_to_clean[(df_to_clean["len_body"] > 500) & (df_to_clean["len_body"] < 15000)]
-        df_to_clean = df_to_clean.copy()
-        df_to_clean = df_to_clean.drop(columns=["len_body"])
-
-        #Now, proceed to clean the df
-        cleaned_df = parallel_apply(df_to_clean, cleaner_saver.clean_text, max_workers=max_workers)
-        cleaned_dataframes.append(cleaned_df)
-                    
+def join_dfs_and_save(cleaned_dataframes, scraped_urls, cleaner_saver, slots):
+    """
+    Joins the cleaned DataFrames of a batch, removes the duplicated news and saves them to S3 in parquet format.
+
+    Parameters:
+    cleaned_dataframes (list of pd.DataFrame): The cleaned news of each slot of the batch.
+    scraped_urls (list of str): Every url scraped in the batch, registered in the seen urls index once saved.
+    cleaner_saver (CleanerSaver): The object used to save the parquet file.
+    slots (list of datetime): The slots of the batch, marked as uploaded in the run journal once saved.
+
+    Returns:
+    None
+    """
     #Create a df appending every DF in the accumulated results list
     combined_df = pd.concat([d.transpose() for d in cleaned_dataframes], axis=1, ignore_index=True).T
 
+    if combined_df.empty:
+        logger.info("No news left in the batch after cleaning.")
+        seen_urls.mark_seen(scraped_urls)
+        run_journal.mark(slots, SLOT_UPLOADED, reason="no news left after cleaning")
+        return
+
     #Drop duplicates
     combined_df = combined_df.drop_duplicates(subset="body")
     #combined_df.drop_duplicates(subset="title", inplace=True)
@@ -118,8 +116,17 @@ def join_dfs_clean_and_save(accumulated_results, cleaner_saver):
     end_date = pd.to_datetime(combined_df['date']).max().strftime('%Y%m%d%H%M%S')
     parquet_file_name = f"news_{start_date}_to_{end_date}.parquet"
 
-    #Call the CS to save to parquet
-    cleaner_saver.save_to_parquet(combined_df, s3_bucket_name, file_name=parquet_file_name)
+    #Call the CS to save to parquet. If the upload failed, the slots are processed again on the next run and their
+    # urls can be scraped again from other slots
+    if not cleaner_saver.save_to_parquet(combined_df, s3_bucket_name, file_name=parquet_file_name):
+        seen_urls.release(scraped_urls)
+        run_journal.mark(slots, SLOT_FAILED, reason=f"upload of {parquet_file_name} failed")
+        skipped_dates.extend(slots)
+        return
+
+    #Register every scraped url (also the ones discarded by the cleaner), so they are not scraped again
+    seen_urls.mark_seen(scraped_urls)
+    run_journal.mark(slots, SLOT_UPLOADED)
 
     ckpt_date = pd.to_datetime(combined_df['date']).max().strftime('%Y-%m-%d %H:%M:%S')
 
@@ -140,7 +147,7 @@ def scrape_into_df(url_list, date_of_file):
     """
     try:
         # Scrape the URLs
-        results = parallel_scraping(url_list, max_workers=scraper_max_workers, timeout=timeout)
+        results = SCRAPING_BACKENDS[scraper_backend](url_list, max_workers=scraper_max_workers, timeout=timeout, max_per_host=scraper_max_per_host, extractor=scraper_extractor)
             
         # Process results
         results_df = pd.DataFrame([{"url": k, "title": v[0], "body": v[1]} for d in results for k, v in d.items() if v is not None])
@@ -151,52 +158,230 @@ def scrape_into_df(url_list, date_of_file):
         #Drop the rows with NaN values
         df_for_s3 = results_df.dropna()
 
+        #The urls that could not be scraped can be scraped again from another slot
+        seen_urls.release(set(url_list).difference(df_for_s3["url"]) if not df_for_s3.empty else url_list)
+
+        if df_for_s3.empty:
+            run_journal.mark(date_of_file, SLOT_FAILED, reason=f"none of the {len(url_list)} urls could be scraped")
+        else:
+            run_journal.mark(date_of_file, SLOT_SCRAPED)
+
         #Return the DF
         return df_for_s3
     
     except Exception as e:
-        #If something goes wrong, return none
+        #If something goes wrong, record it and return none
+        seen_urls.release(url_list)
+        run_journal.mark(date_of_file, SLOT_FAILED, reason=f"scrape: {e}")
         return None
 
 
-def fetch_and_scrape(url, formatted_datetime):
+def fetch_slot_urls(url, formatted_datetime):
     """
-    Fetches URLs from GDELT and calls scrape_and_save_s3 function.
+    Fetches the URLs of a GDELT slot that have not been scraped yet.
 
     Parameters:
     url (str): The URL to fetch data from.
-    formatted_datetime (str): The formatted datetime string.
+    formatted_datetime (datetime): The datetime of the slot.
 
     Returns:
-    None
+    tuple or None: The list of urls to scrape and the datetime of the slot, or None if there is nothing to scrape.
     """
     try:
-        #Get the current CSV column for the urls of that timestamp
-        curr_url_list = pd.read_csv(
-            url, 
-            delimiter='\t', 
-            header=None, 
-            quotechar='"',
-            escapechar='\\',
-            on_bad_lines='skip'
-        )[url_col_idx].unique().tolist()
+        #Get the export file from the local cache (it is only downloaded if it was not cached yet)
+        local_path = gdelt_cache.fetch(url, formatted_datetime)
+
+        #Stream the export file and get the unique urls of its url column, without loading the rest of columns
+        curr_url_list = read_source_urls(local_path, col_idx=url_col_idx)
+
+        #Skip the urls already scraped from previous files, and the ones of the slots in flight. The urls are claimed
+        # here and only marked as seen once their batch is uploaded, so the consecutive slots in the pipeline (where
+        # GDELT repeats the same articles) do not scrape them again
+        curr_url_list = seen_urls.filter_unseen(curr_url_list, claim=True)
+        if not curr_url_list:
+            #Nothing left to do for this slot
+            run_journal.mark(formatted_datetime, SLOT_UPLOADED, reason="no new urls")
+            return None
         
-        #Call the function to scrape the urls and save them to the S3 bucket
-        return scrape_into_df(curr_url_list, formatted_datetime)
-    except pd.errors.ParserError as e:
+        return curr_url_list, formatted_datetime
+    except zipfile.BadZipFile as e:
         logger.error(f"Error parsing CSV at {formatted_datetime}: {e}")
+        #Do not keep a file that cannot be parsed in the cache
+        gdelt_cache.discard(formatted_datetime)
         #Add date to the skipped ones
         skipped_dates.append(formatted_datetime)
+        run_journal.mark(formatted_datetime, SLOT_FAILED, reason=f"bad zip file: {e}")
         #And return a None value 
         return None
     except Exception as e:
-        logger.error(f"Error inside scrape_and_save_s3 function: {e}")
+        logger.error(f"Error inside fetch_slot_urls function: {e}")
         #Add date to the skipped ones
         skipped_dates.append(formatted_datetime)
+        run_journal.mark(formatted_datetime, SLOT_FAILED, reason=f"fetch: {e}")
         #And return a None value 
         return None
 
 
+#Marks the end of the items sent to a stage
+_STOP = object()
+
+def start_stage(func, in_queue, out_queue, workers, name):
+    """
+    Starts the worker threads of a pipeline stage. Each worker takes items from in_queue, applies func to them and puts
+    the results that are not None into out_queue, until it receives the _STOP marker.
+
+    Parameters:
+    func (callable): The function applied to each item.
+    in_queue (queue.Queue): The queue the items are taken from.
+    out_queue (queue.Queue or None): The bounded queue the results are put into, None for the last stage.
+    workers (int): The number of worker threads.
+    name (str): The name of the stage, used in the logs.
+
+    Returns:
+    list of threading.Thread: The worker threads.
+    """
+    def worker():
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                break
+            try:
+                result = func(item)
+            except Exception as e:
+                logger.error(f"Error in the {name} stage: {e}")
+                continue
+            #Blocks while the next stage is full, so a fast stage never runs far ahead of a slow one
+            if result is not None and out_queue is not None:
+                out_queue.put(result)
+
+    threads = [threading.Thread(target=worker, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def stop_stage(threads, in_queue):
+    """
+    Sends the _STOP marker to every worker of a stage, after the items already queued, and waits for them to finish.
+    """
+    for _ in threads:
+        in_queue.put(_STOP)
+    for thread in threads:
+        thread.join()
+
+def batch_stage(in_queue, out_queue, batch_size):
+    """
+    Groups the cleaned DataFrames in batches of batch_size slots. When the _STOP marker is received, the partial
+    batch is flushed before finishing.
+    """
+    batch, batch_urls, batch_slots = [], [], []
+    while True:
+        item = in_queue.get()
+        if item is _STOP:
+            break
+        cleaned_df, scraped_urls, slot = item
+        batch.append(cleaned_df)
+        batch_urls.extend(scraped_urls)
+        batch_slots.append(slot)
+        if len(batch) >= batch_size:
+            out_queue.put((batch, batch_urls, batch_slots))
+            batch, batch_urls, batch_slots = [], [], []
+
+    #Flush the partial batch
+    if batch:
+        out_queue.put((batch, batch_urls, batch_slots))
+
+def run_pipeline(urls_to_scrape, cleaner_saver, batch_size, concurrent_threads=5):
+    """
+    Processes the slots as a staged pipeline: slot fetch -> scrape -> clean -> batch -> dedup and upload. The stages
+    are connected by bounded queues and run concurrently, so the network keeps scraping while the previous slots are
+    cleaned and uploaded, and the throughput is the one of the slowest stage. The slots already uploaded according to
+    the run journal are skipped, and the state of the others is recorded at every stage.
+
+    Stage workers are configured with the FETCH_WORKERS, CLEAN_WORKERS and UPLOAD_WORKERS environment variables
+    (concurrent_threads for the scrape stage), and the size of the queues with PIPELINE_QUEUE_SIZE.
+
+    Parameters:
+    urls_to_scrape (list of tuple): The (url, datetime) pairs of the slots to process.
+    cleaner_saver (CleanerSaver): The cleaner used for the bodies and to save the parquet files.
+    batch_size (int): The number of slots saved in each parquet file.
+    concurrent_threads (int): The number of slots scraped at the same time.
+
+    Returns:
+    None
+    """
+    queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', 10))
+    slots_queue = queue.Queue(maxsize=queue_size)
+    url_lists_queue = queue.Queue(maxsize=queue_size)
+    scraped_queue = queue.Queue(maxsize=queue_size)
+    cleaned_queue = queue.Queue(maxsize=queue_size)
+    batches_queue = queue.Queue(maxsize=2)
+
+    #Skip the slots uploaded by a previous run, and start a new attempt for the rest
+    completed = run_journal.completed(date for _, date in urls_to_scrape)
+    if completed:
+        logger.info(f"Skipping {len(completed)} slots already uploaded according to the run journal.")
+        urls_to_scrape = [(url, date) for url, date in urls_to_scrape if slot_key(date) not in completed]
+    run_journal.mark([date for _, date in urls_to_scrape], SLOT_PENDING)
+
+    #Fork the cleaning processes (and the parse processes of the pipeline scraper, shared by every slot) before any
+    # stage thread is started
+    cleaner_saver.start_workers()
+    if scraper_backend == "pipeline":
+        start_parse_pool(int(os.getenv('SCRAPER_PARSE_WORKERS', os.cpu_count() or 1)))
+
+    progress = tqdm(total=len(urls_to_scrape), desc="Processing URLs")
+
+    def fetch(slot):
+        try:
+            return fetch_slot_urls(*slot)
+        finally:
+            progress.update(1)
+
+    def upload(batch):
+        try:
+            return join_dfs_and_save(batch[0], batch[1], cleaner_saver, batch[2])
+        except Exception as e:
+            seen_urls.release(batch[1])
+            run_journal.mark(batch[2], SLOT_FAILED, reason=f"upload: {e}")
+            raise
+
+    def clean(item):
+        df, date = item
+        try:
+            cleaned_df, scraped_urls = clean_scraped_df(df, cleaner_saver)
+        except Exception as e:
+            seen_urls.release(df["url"])
+            run_journal.mark(date, SLOT_FAILED, reason=f"clean: {e}")
+            raise
+        run_journal.mark(date, SLOT_CLEANED)
+        return cleaned_df, scraped_urls, date
+
+    #Start the stages, from the last one to the first one
+    upload_threads = start_stage(upload, batches_queue, None, int(os.getenv('UPLOAD_WORKERS', 1)), "upload")
+    batch_thread = threading.Thread(target=batch_stage, args=(cleaned_queue, batches_queue, batch_size), daemon=True)
+    batch_thread.start()
+    clean_threads = start_stage(clean, scraped_queue, cleaned_queue, int(os.getenv('CLEAN_WORKERS', 1)), "clean")
+
+    def scrape(item):
+        result = scrape_into_df(*item)
+        return (result, item[1]) if result is not None and not result.empty else None
+
+    scrape_threads = start_stage(scrape, url_lists_queue, scraped_queue, concurrent_threads, "scrape")
+    fetch_threads = start_stage(fetch, slots_queue, url_lists_queue, int(os.getenv('FETCH_WORKERS', 2)), "fetch")
+
+    #Feed the slots, blocking while the first stage is full
+    for slot in urls_to_scrape:
+        slots_queue.put(slot)
+
+    #Clean shutdown: each stage is stopped once the previous one has finished, so every item is flushed
+    stop_stage(fetch_threads, slots_queue)
+    stop_stage(scrape_threads, url_lists_queue)
+    stop_stage(clean_threads, scraped_queue)
+    stop_stage([batch_thread], cleaned_queue)
+    stop_stage(upload_threads, batches_queue)
+    progress.close()
+
+
 def news_to_scrape_to_s3(start_date_str, end_date_str, concurrent_threads=5):
     """
     Collects news URLs from GDELT between two dates and saves the scraped content to an S3 bucket.
@@ -235,8 +420,7 @@ def news_to_scrape_to_s3(start_date_str, end_date_str, concurrent_threads=5):
     
     urls_to_scrape = []
     
-    batch_size = start_date = int(os.getenv('BATCH_SIZE_SILVER', 20))  # Number of dfs per batch
-    accumulated_results = []
+    batch_size = int(os.getenv('BATCH_SIZE_SILVER', 20))  # Number of dfs per batch
     
     for _ in range(total_iterations): 
         # Generate the url for the current iteration
@@ -251,36 +435,17 @@ def news_to_scrape_to_s3(start_date_str, end_date_str, concurrent_threads=5):
         aws_secret_access_key=aws_secret_access_key,
         aws_region=aws_region,
         max_length=10000, 
-        min_length=500
+        min_length=500,
+        n_workers=int(os.getenv('CLEANER_WORKERS', os.cpu_count() or 1)),
+        sentence_splitter=os.getenv('CLEANER_SENTENCE_SPLITTER', 'punkt'),
+        parquet_compression=os.getenv('PARQUET_COMPRESSION', 'zstd'),
+        row_group_bytes=int(os.getenv('PARQUET_ROW_GROUP_MB', 32)) * 1024 * 1024
     )
     
-    # Process URLs in batches
-    for i in range(0, len(urls_to_scrape), batch_size):
-        batch_urls = urls_to_scrape[i:i + batch_size]
-        
-        # Use ThreadPoolExecutor to process URLs in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrent_threads) as executor:
-            futures = [executor.submit(fetch_and_scrape, url, date) for url, date in batch_urls]
-            
-            # Process the futures as they complete
-            for future in tqdm(concurrent.futures.as_completed(futures), total=len(batch_urls), desc="Processing URLs batchs"):
-                try:
-                    result = future.result()
-                    if result is not None and not result.empty:
-                        accumulated_results.append(result)
-                except Exception as e:
-                    logger.error(f"Error in fetch_and_scrape function: {e}")
-        
-        # Join the data, clean it, and save to S3 in parquet format after each batch
-        if accumulated_results:
-            join_dfs_clean_and_save(accumulated_results=accumulated_results, cleaner_saver=cleaner_saver)
-            accumulated_results = []  # Reset the accumulated results
-
-    # Handle any remaining accumulated results
-    if accumulated_results:
-        
-        #Join the data, clean it and save to S3 in parquet format
-        join_dfs_clean_and_save(accumulated_results=accumulated_results, cleaner_saver=cleaner_saver)
+    #Run the staged pipeline over all the slots
+    run_pipeline(urls_to_scrape, cleaner_saver, batch_size, concurrent_threads=concurrent_threads)
+    logger.info(f"Length prefilter rejected {cleaner_saver.prefilter_rejected} of {cleaner_saver.prefilter_checked} bodies before cleaning.")
+    cleaner_saver.close()
 
 def retry_skipped_dates():
     """
@@ -293,16 +458,31 @@ def retry_skipped_dates():
         logger.info("No skipped dates to retry.")
         return
 
-    print(f"Retrying skipped dates...")
+    print("Retrying skipped dates...")
 
-    #Convert datetime objects to strings for retry
+    #Convert datetime objects to strings for retry, and clear the list for the dates failing again
     skipped_urls_to_scrape = [(f"http://data.gdeltproject.org/gdeltv2/{date.strftime('%Y%m%d%H%M%S')}.export.CSV.zip", date) for date in skipped_dates]
+    skipped_dates.clear()
 
-    for url, date in tqdm(skipped_urls_to_scrape, desc="Retrying skipped dates"):
-        try:
-            fetch_and_scrape(url, date)
-        except Exception as e:
-            logger.error(f"Failed to process URL for {date}: {e}")
+    #Initialize Cleaner
+    cleaner_saver = CleanerSaver(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        aws_region=aws_region,
+        max_length=10000, 
+        min_length=500,
+        n_workers=int(os.getenv('CLEANER_WORKERS', os.cpu_count() or 1)),
+        sentence_splitter=os.getenv('CLEANER_SENTENCE_SPLITTER', 'punkt'),
+        parquet_compression=os.getenv('PARQUET_COMPRESSION', 'zstd'),
+        row_group_bytes=int(os.getenv('PARQUET_ROW_GROUP_MB', 32)) * 1024 * 1024
+    )
+
+    #Process them with the same pipeline, so the recovered news are also cleaned and saved
+    run_pipeline(
+        skipped_urls_to_scrape, cleaner_saver, int(os.getenv('BATCH_SIZE_SILVER', 20)), concurrent_threads=concurrent_threads
+    )
+    logger.info(f"Length prefilter rejected {cleaner_saver.prefilter_rejected} of {cleaner_saver.prefilter_checked} bodies before cleaning.")
+    cleaner_saver.close()
 
 if __name__ == "__main__":
 
@@ -316,14 +496,17 @@ if __name__ == "__main__":
 
         #Print the final message and the dates that have been skipped
         logger.info(f"All news collected! Skipped dates: {skipped_dates}")
+        logger.info(f"Seen urls index: {seen_urls.stats()}")
+        logger.info(f"Run journal: {run_journal.stats()}")
 
         #If inidcated, try and collect those skipped dates
         if retry_skipped_dates_arg == "yes":
 
-            logger.info(f"Sleeping before retrying...")
+            logger.info("Sleeping before retrying...")
             time.sleep(10)
 
             retry_skipped_dates()
+            logger.info(f"Run journal: {run_journal.stats()}")
 
         #Display finish message
         logger.info("Finished!")
@@ -1,7 +1,17 @@
-import pandas as pd
-from bs4 import BeautifulSoup
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import re
+import json
+import gzip
+import uuid
+import base64
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import os
+import time
+import queue
+import threading
+from collections import OrderedDict, defaultdict, deque
+from urllib.parse import urlsplit
+import asyncio
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from tqdm import tqdm
@@ -24,7 +34,17 @@ logging.basicConfig(
 )
 
 # Function to configure session with retry strategy
-def create_session():
+def create_session(max_per_host=4, max_hosts=256):
+    """
+    Creates a requests session with a retry strategy and a keep-alive connection pool per host.
+
+    Args:
+        max_per_host (int, optional): Size of the connection pool of each host, it should match the per host concurrency cap. Default is 4.
+        max_hosts (int, optional): Number of host pools kept alive at the same time. Default is 256.
+
+    Returns:
+        requests.Session: The configured session.
+    """
     session = requests.Session()
     retry = Retry(
         total=1,  # Total number of retries
@@ -32,13 +52,190 @@ def create_session():
         status_forcelist=[500, 502, 503, 504],  # Retry on these status codes
         allowed_methods=["HEAD", "GET", "OPTIONS"]  # Retry only these methods
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=max_hosts, pool_maxsize=max_per_host)
     session.mount("https://", adapter)
     session.mount("http://", adapter)
+    session.max_per_host = max_per_host
     return session
 
+#Session kept warm across calls (and across invocations of the same Lambda container)
+_session = None
+
+def get_session(max_per_host=4):
+    """
+    Returns the shared session, creating it the first time or when the per host pool size changes.
+    """
+    global _session
+    if _session is None or _session.max_per_host != max_per_host:
+        _session = create_session(max_per_host=max_per_host)
+    return _session
+
+# Class to schedule the URLs of a batch by host
+class HostScheduler:
+    """
+    Groups the URLs by host and hands them out round robin between hosts, never exceeding max_per_host requests in
+    flight to the same host. A slow domain can only take max_per_host workers, the rest keep serving other hosts.
+
+    Args:
+        urls (list of str): The URLs to schedule.
+        max_per_host (int, optional): Maximum number of requests in flight to the same host. Default is 4.
+    """
+    def __init__(self, urls, max_per_host=4):
+        self.max_per_host = max_per_host
+        self._queues = OrderedDict()
+        for url in urls:
+            self._queues.setdefault(self.host(url), deque()).append(url)
+        self._hosts = deque(self._queues)
+        self._in_flight = defaultdict(int)
+
+    @staticmethod
+    def host(url):
+        try:
+            return urlsplit(url).netloc.lower()
+        except Exception:
+            return ""
+
+    def has_pending(self):
+        """Returns True if there are URLs left to hand out."""
+        return bool(self._hosts)
+
+    def next_url(self):
+        """Returns the next URL of the first host below its cap (rotating the hosts), or None if all hosts are at their cap."""
+        for _ in range(len(self._hosts)):
+            host = self._hosts[0]
+            self._hosts.rotate(-1)
+            if self._in_flight[host] < self.max_per_host:
+                url = self._queues[host].popleft()
+                #The host has just been rotated to the end, remove it if it has no URLs left
+                if not self._queues[host]:
+                    self._hosts.pop()
+                    del self._queues[host]
+                self._in_flight[host] += 1
+                return url
+        return None
+
+    def drain(self):
+        """Returns the URLs not handed out yet, and leaves the scheduler without pending URLs."""
+        urls = [url for host in self._hosts for url in self._queues[host]]
+        self._hosts.clear()
+        self._queues.clear()
+        return urls
+
+    def release(self, url):
+        """Marks a request to the host of the URL as finished."""
+        self._in_flight[self.host(url)] -= 1
+
+# Extractors: functions receiving the raw HTML of a page and returning [title, text of the paragraphs joined by ". "]
+def extract_bs4(content):
+    """
+    Extracts the title and the text of the paragraphs of a web page with BeautifulSoup and the html.parser.
+    It is the reference extractor, the rest of extractors must return the same output.
+
+    Args:
+        content (bytes): The raw HTML of the page.
+
+    Returns:
+        list: A list containing the title (None if the page has no title) and the concatenated text of all paragraphs.
+    """
+    #Parse the text with BeautifulSoup (imported here, so it is not loaded when the lxml extractor is used)
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+
+    #Get the paragraphs
+    paragraphs = soup.find_all('p')
+
+    #Get the raw text of the paragraph
+    res_list = [elem.get_text(strip=True) for elem in paragraphs]
+
+    #Get the title
+    title_tag = soup.find('title')
+    if title_tag:
+        title = title_tag.get_text()
+    else:
+        title = None
+
+    return [title, ". ".join(res_list)]
+
+def _decode_html(content):
+    """
+    Decodes the raw HTML with the charset declared in the page, or as UTF-8 (windows-1252 if it is not valid UTF-8),
+    following the same preference as BeautifulSoup.
+    """
+    declared = re.search(rb'<meta[^>]+charset=["\']?([\w-]+)', content[:4096], re.IGNORECASE)
+    if declared:
+        try:
+            return content.decode(declared.group(1).decode("ascii"), errors="replace")
+        except LookupError:
+            pass
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content.decode("windows-1252", errors="replace")
+
+#Start and end tags of the paragraphs, renamed for lxml (see extract_lxml)
+_P_TAG = re.compile(r'<(/?)p(?=[\s/>])', re.IGNORECASE)
+
+def extract_lxml(content):
+    """
+    Extracts the title and the text of the paragraphs of a web page with lxml. The parsing is done in C (releasing
+    the GIL), so it is several times faster than extract_bs4.
+
+    The html.parser of extract_bs4 only closes a <p> at its end tag, while lxml closes it implicitly before any block
+    element (<div>, <table>, <ul>, <h1>, another <p>...), dropping the rest of the paragraph. The <p> tags are renamed
+    before parsing, so lxml nests them as written, and the output is the same as extract_bs4 (see the fixtures of
+    tests/test_extractors.py). The only known differences are markup inside <title> and <textarea>, which lxml keeps as
+    text (html.parser parses it as tags up to python 3.12), and the text of CDATA sections, which lxml drops.
+
+    Args:
+        content (bytes): The raw HTML of the page.
+
+    Returns:
+        list: A list containing the title (None if the page has no title) and the concatenated text of all paragraphs.
+    """
+    import lxml.html
+    from lxml.etree import ParserError
+
+    try:
+        root = lxml.html.document_fromstring(_P_TAG.sub(r'<\1x-p', _decode_html(content)))
+    except ParserError:
+        #Empty documents
+        return [None, ""]
+
+    #get_text of BeautifulSoup ignores the content of scripts and styles, drop them (keeping the text after them)
+    for element in list(root.iter("script", "style", "template")):
+        element.drop_tree()
+
+    #Text of each paragraph: every text node stripped and joined, as get_text(strip=True)
+    res_list = ["".join(text.strip() for text in elem.itertext()) for elem in root.iter("x-p")]
+
+    #Get the title
+    title_tag = root.find(".//title")
+    title = title_tag.text_content() if title_tag is not None else None
+
+    return [title, ". ".join(res_list)]
+
+#Extractors that can be selected by configuration
+EXTRACTORS = {
+    "bs4": extract_bs4,
+    "lxml": extract_lxml
+}
+
+# Function to extract the title and text of a downloaded page
+def parse_page(content, extractor="bs4"):
+    """
+    Extracts the title and the text of the paragraphs of a web page.
+
+    Args:
+        content (bytes): The raw HTML of the page.
+        extractor (str, optional): The name of the extractor to use, 'bs4' or 'lxml'. Default is 'bs4'.
+
+    Returns:
+        list: A list containing the title (None if the page has no title) and the concatenated text of all paragraphs.
+    """
+    return EXTRACTORS[extractor](content)
+
 # Function to scrape a single page
-def scrape_page(url, session, timeout=5):
+def scrape_page(url, session, timeout=5, extractor="bs4"):
     """
     Scrapes the content of a single web page and returns its title and text.
 
@@ -46,6 +243,7 @@ def scrape_page(url, session, timeout=5):
         url (str): The URL of the web page to scrape.
         session (requests.Session): The requests session object to use for making the HTTP request.
         timeout (int, optional): The timeout value for the HTTP request in seconds. Default is 5.
+        extractor (str, optional): The name of the extractor used to parse the page, 'bs4' or 'lxml'. Default is 'bs4'.
 
     Returns:
         dict: A dictionary with the URL as the key and a list containing the title and the concatenated text of all paragraphs as the value. If an error occurs during the request, the value will be None.
@@ -66,24 +264,8 @@ def scrape_page(url, session, timeout=5):
         response = session.get(url, timeout=timeout)
         response.raise_for_status()  # Raise HTTPError for bad responses
         #logging.info("Collected")
-        #Parse the text with BeautifulSoup
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        #Get the paragraphs
-        paragraphs = soup.find_all('p')
-
-        #Get the raw text of the paragraph
-        res_list = [elem.get_text(strip=True) for elem in paragraphs]
-
-        #Get the title
-        title_tag = soup.find('title')
-        if title_tag:
-            title = title_tag.get_text()
-        else:
-            title = None
-        
-        #Return the joined text
-        return {url: [title, ". ".join(res_list)]}
+        #Parse the title and the paragraphs of the page
+        return {url: parse_page(response.content, extractor)}
     except requests.RequestException as e:
         #print(f"Error scraping {url}: {e}")
         return {url: None}
@@ -92,8 +274,69 @@ def scrape_page(url, session, timeout=5):
 
 
 
+# Function to download a single page, without parsing it
+def fetch_page(url, session, timeout=5):
+    """
+    Downloads the raw content of a single web page.
+
+    Args:
+        url (str): The URL of the web page to download.
+        session (requests.Session): The requests session object to use for making the HTTP request.
+        timeout (int, optional): The timeout value for the HTTP request in seconds. Default is 5.
+
+    Returns:
+        bytes: The raw content of the page, or None if an error occurs during the request.
+    """
+    try:
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+    except requests.RequestException:
+        return None
+
+# Generator to run a task for every URL in a thread pool, dispatching them by host
+def run_by_host(executor, urls, max_workers, max_per_host, task, *args, deadline=None, unfinished=None):
+    """
+    Submits task(url, *args) to the executor for every URL, through a HostScheduler and with at most max_workers
+    tasks in flight, and yields the (url, future) pairs as they complete.
+
+    If a deadline (a time.monotonic() value) is given, no task is submitted after it, the tasks still in flight are
+    cancelled or abandoned, and the URLs not completed are appended to the unfinished list.
+    """
+    scheduler = HostScheduler(urls, max_per_host)
+    future_to_url = {}
+
+    while scheduler.has_pending() or future_to_url:
+
+        #Out of time, give up on the URLs left
+        if deadline is not None and time.monotonic() >= deadline:
+            for future, url in future_to_url.items():
+                future.cancel()
+                if unfinished is not None:
+                    unfinished.append(url)
+            remaining = scheduler.drain()
+            if unfinished is not None:
+                unfinished.extend(remaining)
+            return
+
+        #Submit tasks while there are free workers and hosts below their concurrency cap
+        while len(future_to_url) < max_workers:
+            url = scheduler.next_url()
+            if url is None:
+                break
+            future_to_url[executor.submit(task, url, *args)] = url
+
+        #Yield the futures as they complete (or when the deadline is reached)
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        done, _ = wait(future_to_url, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            url = future_to_url.pop(future)
+            scheduler.release(url)
+            yield url, future
+
+
 # Function to handle parallel scraping
-def parallel_scraping(urls, max_workers=5, timeout=5):
+def parallel_scraping(urls, max_workers=5, timeout=5, max_per_host=4, session=None, extractor="bs4", time_budget=None, unfinished=None):
     """
     Handles the parallel scraping of multiple web pages using a thread pool.
 
@@ -101,7 +344,12 @@ def parallel_scraping(urls, max_workers=5, timeout=5):
         urls (list of str): A list of URLs to be scraped.
         max_workers (int, optional): The maximum number of threads to use for parallel scraping. Default is 5.
         timeout (int, optional): The timeout value for each HTTP request in seconds. Default is 5.
-        max_duration (int, optional): The maximum total time allowed for the function to run in minutes. Default is 5.
+        max_per_host (int, optional): The maximum number of requests in flight to the same host. Default is 4.
+        extractor (str, optional): The name of the extractor used to parse the pages, 'bs4' or 'lxml'. Default is 'bs4'.
+        session (requests.Session, optional): The session to use. By default the shared session returned by get_session is used.
+        time_budget (float, optional): The maximum time, in seconds, for the whole call. When it runs out, no more URLs are
+            requested, the requests in flight are abandoned and the results scraped so far are returned. Default is no limit.
+        unfinished (list, optional): If given, the URLs not scraped before the time budget ran out are appended to it.
 
     Returns:
         list of dict: A list of dictionaries containing the scraped data. Each dictionary has the URL as the key and a list containing the title and the concatenated text of all paragraphs as the value. If an error occurs during the request for a URL, the value will be None.
@@ -113,59 +361,441 @@ def parallel_scraping(urls, max_workers=5, timeout=5):
         # Output: [{'http://example.com': ['Example Domain', 'This domain is for use in illustrative examples ...']}, ...]
 
     Notes:
-        This function uses a thread pool to execute the scraping tasks concurrently. The `tqdm` library is used to display a progress bar.
+        This function uses a thread pool to execute the scraping tasks concurrently. URLs are dispatched by a HostScheduler, interleaving hosts and capping the requests in flight per host. The `tqdm` library is used to display a progress bar.
 
     """
-    #Create the list to store the results and a session
+    #Create the list to store the results and get the shared session
     results = []
-    session = create_session()
-    
-    #Create a ThreadPoolExecutor to manage the pool of worker threads
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    session = session or get_session(max_per_host)
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    unfinished = unfinished if unfinished is not None else []
+    n_unfinished = len(unfinished)
+
+    #Create a ThreadPoolExecutor to manage the pool of worker threads, showing progress with tqdm
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        with tqdm(total=len(urls), desc="Scraping progress") as progress:
 
-        #Submit scraping tasks to the executor and map futures to URLs
-        future_to_url = {executor.submit(scrape_page, url, session, timeout): url for url in urls}
+            #Process the futures as they complete
+            for url, future in run_by_host(executor, urls, max_workers, max_per_host, scrape_page, session, timeout, extractor, deadline=deadline, unfinished=unfinished):
+                progress.update(1)
+                try:
+                    #Retrieve the result of the future (scraped data)
+                    data = future.result()
 
-        #Process the futures as they complete, showing progress with tqdm
-        for future in tqdm(as_completed(future_to_url), total=len(urls), desc="Scraping progress"):
+                    #Add to the results lists
+                    results.append(data)
+                except Exception as e:
 
+                    #If an exception occurs, print the exception details
+                    logging.info(f"An exception ocurred: {e}")
+    finally:
+        #Do not wait for the requests abandoned at the deadline
+        executor.shutdown(wait=len(unfinished) == n_unfinished, cancel_futures=True)
+
+    #Print completion message and return the resulting list
+    if len(unfinished) > n_unfinished:
+        print(f"Time budget exhausted, {len(unfinished) - n_unfinished} URLs not scraped.")
+    print("Scraped completed!")
+    return results
+
+
+# Coroutine to scrape a single page with aiohttp
+async def async_scrape_page(url, session, semaphore, timeout=5, extractor="bs4"):
+    """
+    Asynchronous version of scrape_page. Downloads the page holding a slot of the global semaphore, and parses it in
+    the default thread pool so the event loop keeps serving the rest of connections.
+
+    Args:
+        url (str): The URL of the web page to scrape.
+        session (aiohttp.ClientSession): The aiohttp session used for the HTTP request.
+        semaphore (asyncio.Semaphore): The semaphore limiting the number of requests in flight.
+        timeout (int, optional): The timeout value for the HTTP request in seconds. Default is 5.
+        extractor (str, optional): The name of the extractor used to parse the page, 'bs4' or 'lxml'. Default is 'bs4'.
+
+    Returns:
+        dict: A dictionary with the URL as the key and a list containing the title and the concatenated text of all paragraphs as the value. If an error occurs during the request, the value will be None.
+    """
+    import aiohttp
+
+    async with semaphore:
+        #Same retry strategy as create_session: one retry for server errors
+        for attempt in range(2):
             try:
-                #Retrieve the result of the future (scraped data)
-                data = future.result(timeout=10) # Timeout in casr some pages takes a lot to fetch or process by BeautifulSoup to avoid bottleneck
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    if response.status in (500, 502, 503, 504) and attempt == 0:
+                        await asyncio.sleep(1)
+                        continue
+                    response.raise_for_status()
+                    content = await response.read()
+                    break
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return {url: None}
 
-                #Add to the results lists
-                results.append(data)
+    return {url: await asyncio.get_running_loop().run_in_executor(None, parse_page, content, extractor)}
 
-            except TimeoutError:
-                #Do not log, just print and go to the next iteration
-                print(f"Scraping took longer than {10} seconds and was terminated.")
-            except Exception as e:
 
-                #If an exception occurs, print the exception details
+async def _async_scraping(urls, max_workers, timeout, max_per_host, extractor, deadline=None, unfinished=None):
+    import aiohttp
+
+    semaphore = asyncio.Semaphore(max_workers)
+    connector = aiohttp.TCPConnector(limit=max_workers, limit_per_host=max_per_host)
+    scheduler = HostScheduler(urls, max_per_host)
+    results = []
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        task_to_url = {}
+        with tqdm(total=len(urls), desc="Scraping progress") as progress:
+            while scheduler.has_pending() or task_to_url:
+
+                #Out of time, cancel the tasks in flight and give up on the URLs left
+                if deadline is not None and time.monotonic() >= deadline:
+                    for task, url in task_to_url.items():
+                        task.cancel()
+                        unfinished.append(url)
+                    unfinished.extend(scheduler.drain())
+                    break
+
+                #Create tasks while there are hosts below their concurrency cap, the semaphore bounds the global concurrency
+                url = scheduler.next_url()
+                while url is not None:
+                    task_to_url[asyncio.ensure_future(async_scrape_page(url, session, semaphore, timeout, extractor))] = url
+                    url = scheduler.next_url()
+
+                timeout_left = None if deadline is None else max(deadline - time.monotonic(), 0)
+                done, _ = await asyncio.wait(task_to_url, timeout=timeout_left, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    scheduler.release(task_to_url.pop(task))
+                    progress.update(1)
+                    try:
+                        results.append(task.result())
+                    except Exception as e:
+                        logging.info(f"An exception ocurred: {e}")
+
+    return results
+
+
+# Function to handle concurrent scraping with asyncio
+def async_parallel_scraping(urls, max_workers=200, timeout=5, max_per_host=4, extractor="bs4", time_budget=None, unfinished=None):
+    """
+    Handles the concurrent scraping of multiple web pages using asyncio and aiohttp. It has the same contract as
+    parallel_scraping, but since no thread is blocked waiting for the network, it can keep hundreds of requests in flight.
+
+    Args:
+        urls (list of str): A list of URLs to be scraped.
+        max_workers (int, optional): The maximum number of requests in flight at the same time. Default is 200.
+        timeout (int, optional): The timeout value for each HTTP request in seconds. Default is 5.
+        max_per_host (int, optional): The maximum number of requests in flight to the same host. Default is 4.
+        extractor (str, optional): The name of the extractor used to parse the pages, 'bs4' or 'lxml'. Default is 'bs4'.
+        time_budget (float, optional): The maximum time, in seconds, for the whole call, as in parallel_scraping. Default is no limit.
+        unfinished (list, optional): If given, the URLs not scraped before the time budget ran out are appended to it.
+
+    Returns:
+        list of dict: A list of dictionaries containing the scraped data, in the same format as parallel_scraping.
+    """
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    unfinished = unfinished if unfinished is not None else []
+    n_unfinished = len(unfinished)
+    results = asyncio.run(_async_scraping(urls, max_workers, timeout, max_per_host, extractor, deadline, unfinished))
+
+    if len(unfinished) > n_unfinished:
+        print(f"Time budget exhausted, {len(unfinished) - n_unfinished} URLs not scraped.")
+
+    #Print completion message and return the resulting list
+    print("Scraped completed!")
+    return results
+
+
+# Function run by the parse pool, it also measures the time spent parsing
+def _timed_parse(content, extractor):
+    start = time.perf_counter()
+    result = parse_page(content, extractor)
+    return result, time.perf_counter() - start
+
+# Function to create the pool of the parse stage
+def _create_parse_pool(parse_workers):
+    """
+    Creates a process pool for the parse stage. Where processes cannot be used (AWS Lambda has no /dev/shm for the
+    multiprocessing semaphores), it falls back to a thread pool of the same size.
+    """
+    try:
+        return ProcessPoolExecutor(max_workers=parse_workers)
+    except (OSError, NotImplementedError):
+        return ThreadPoolExecutor(max_workers=parse_workers)
+
+#Parse pool shared by every call (and by the invocations of the same Lambda container)
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def start_parse_pool(parse_workers=None):
+    """
+    Returns the shared parse pool, creating it the first time with parse_workers workers (default is the number of
+    cores). A process pool only forks its workers on the first task, so a no-op task is run to fork them right away:
+    call it before starting any thread, forking a process while other threads hold locks (e.g. the import lock taken
+    by the lazy imports of the extractors) can deadlock the child.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = _create_parse_pool(parse_workers or os.cpu_count() or 1)
+            _parse_pool.submit(int).result()
+        return _parse_pool
+
+# Function to handle the two stages (download and parse) scraping
+def pipelined_scraping(urls, max_workers=50, timeout=5, max_per_host=4, extractor="bs4", parse_workers=None, queue_size=None, time_budget=None, unfinished=None):
+    """
+    Handles the scraping of multiple web pages as a two stages pipeline. A network stage of max_workers threads only
+    downloads the raw pages (dispatched by host like parallel_scraping), and a CPU stage of parse_workers processes
+    turns them into title and text. The stages are connected by a bounded queue: when parsing falls behind, the
+    download threads block on the queue instead of piling up pages in memory.
+
+    Args:
+        urls (list of str): A list of URLs to be scraped.
+        max_workers (int, optional): The number of download threads. Default is 50.
+        timeout (int, optional): The timeout value for each HTTP request in seconds. Default is 5.
+        max_per_host (int, optional): The maximum number of requests in flight to the same host. Default is 4.
+        extractor (str, optional): The name of the extractor used to parse the pages, 'bs4' or 'lxml'. Default is 'bs4'.
+        parse_workers (int, optional): The number of pages parsed at the same time. Default is the number of cores. The
+            pages are parsed on the shared pool of start_parse_pool, created with this size by the first call.
+        queue_size (int, optional): The maximum number of downloaded pages waiting to be parsed. Default is 4 per parse worker.
+        time_budget (float, optional): The maximum time, in seconds, for the whole call, as in parallel_scraping. The pages
+            downloaded but not parsed when it runs out are also returned as unfinished. Default is no limit.
+        unfinished (list, optional): If given, the URLs not scraped before the time budget ran out are appended to it.
+
+    Returns:
+        list of dict: A list of dictionaries containing the scraped data, in the same format as parallel_scraping.
+
+    Notes:
+        The utilization of each stage (busy time over the available worker time) is reported when it finishes.
+    """
+    parse_workers = parse_workers or os.cpu_count() or 1
+
+    #The parse pool is started before the download threads
+    pool = start_parse_pool(parse_workers)
+    raw_pages = queue.Queue(maxsize=queue_size or 4 * parse_workers)
+    session = get_session(max_per_host)
+    results = []
+    busy = {"fetch": 0.0, "parse": 0.0}
+    busy_lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    unfinished = unfinished if unfinished is not None else []
+    n_unfinished = len(unfinished)
+
+    def out_of_time():
+        return deadline is not None and time.monotonic() >= deadline
+
+    def remaining():
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    def fetch_into_queue(url):
+        fetch_start = time.perf_counter()
+        content = fetch_page(url, session, timeout)
+        with busy_lock:
+            busy["fetch"] += time.perf_counter() - fetch_start
+        #Blocks while the queue is full, applying backpressure to the network stage, but not after the deadline (the
+        # parse stage stops reading the queue)
+        try:
+            raw_pages.put((url, content), timeout=remaining())
+        except queue.Full:
+            pass
+
+    def network_stage():
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            #The unfinished URLs are the ones the parse stage did not handle, computed at the end
+            for url, future in run_by_host(executor, urls, max_workers, max_per_host, fetch_into_queue, deadline=deadline):
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.info(f"An exception ocurred: {e}")
+        finally:
+            #Do not wait for the downloads abandoned at the deadline
+            executor.shutdown(wait=not out_of_time(), cancel_futures=True)
+            raw_pages.put(None)
+
+    network_thread = threading.Thread(target=network_stage, daemon=True)
+    network_thread.start()
+
+    #URLs handled by the parse stage (scraped, not downloaded or not parsed), every other one is unfinished
+    handled = set()
+
+    #CPU stage, keeps at most two pages per parse worker in flight
+    progress = tqdm(total=len(urls), desc="Scraping progress")
+    future_to_url = {}
+
+    def collect(futures):
+        for future in futures:
+            url = future_to_url.pop(future)
+            handled.add(url)
+            progress.update(1)
+            try:
+                data, parse_time = future.result()
+                busy["parse"] += parse_time
+                results.append({url: data})
+            except Exception as e:
                 logging.info(f"An exception ocurred: {e}")
-                
+
+    try:
+        item = raw_pages.get()
+        while item is not None:
+            url, content = item
+            #After the deadline the queue is only drained until the network stage finishes, the pages are unfinished
+            if content is None and not out_of_time():
+                handled.add(url)
+                results.append({url: None})
+                progress.update(1)
+            elif not out_of_time():
+                #Wait for a free parse worker, until the deadline
+                if len(future_to_url) >= 2 * parse_workers:
+                    collect(wait(future_to_url, timeout=remaining(), return_when=FIRST_COMPLETED).done)
+                if len(future_to_url) < 2 * parse_workers:
+                    future_to_url[pool.submit(_timed_parse, content, extractor)] = url
+            item = raw_pages.get()
+
+        #Wait for the pages being parsed, until the deadline
+        collect(wait(future_to_url, timeout=remaining()).done)
+    finally:
+        #Do not wait for the parses still running at the deadline, and drop the ones not started (the pool is shared,
+        # so it is not shut down)
+        for future in future_to_url:
+            future.cancel()
+        progress.close()
+
+    network_thread.join()
+    if out_of_time():
+        unfinished.extend(url for url in dict.fromkeys(urls) if url not in handled)
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Pipeline utilization: fetch {100 * busy['fetch'] / (elapsed * max_workers):.1f}% of {max_workers} threads, "
+        f"parse {100 * busy['parse'] / (elapsed * parse_workers):.1f}% of {parse_workers} workers, {elapsed:.1f}s"
+    )
+    if len(unfinished) > n_unfinished:
+        print(f"Time budget exhausted, {len(unfinished) - n_unfinished} URLs not scraped.")
+
     #Print completion message and return the resulting list
     print("Scraped completed!")
     return results
 
 
+#Scraping engines that can be selected by configuration
+SCRAPING_BACKENDS = {
+    "threads": parallel_scraping,
+    "asyncio": async_parallel_scraping,
+    "pipeline": pipelined_scraping
+}
+
+#Default number of workers of each engine when the event does not set "max_workers"
+BACKEND_MAX_WORKERS = {
+    "threads": 10,
+    "asyncio": 200,
+    "pipeline": 50
+}
+
+
+#Formats of the response, requested with the optional "response_format" event field. 'json' is the original one, a
+# JSON string with the list of records (that Lambda encodes as JSON again). 'columnar-gzip-v1' is a dict with the
+# records as gzip compressed JSON columns, base64 encoded in "data", or stored in S3 and referenced by "s3" when the
+# response would not fit in the 6 MB limit of the synchronous invocations
+RESPONSE_FORMAT_JSON = "json"
+RESPONSE_FORMAT_COLUMNAR = "columnar-gzip-v1"
+RESPONSE_FORMATS = (RESPONSE_FORMAT_JSON, RESPONSE_FORMAT_COLUMNAR)
+
+#Maximum size of the base64 data returned inline, leaving room for the rest of the response
+MAX_INLINE_RESPONSE_BYTES = 5 * 1024 * 1024
+
+def encode_columnar(records):
+    """
+    Encodes the records as gzip compressed JSON with one list per column ({"url": [...], "title": [...], "body": [...]}),
+    so the keys are not repeated in every record and the text is not escaped twice.
+    """
+    columns = {column: [record[column] for record in records] for column in ("url", "title", "body")}
+    return gzip.compress(json.dumps(columns, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), compresslevel=3)
+
+def build_response(records, response_format=RESPONSE_FORMAT_JSON, result_bucket=None, result_prefix="scraper_results/", max_inline_bytes=MAX_INLINE_RESPONSE_BYTES, unfinished=None):
+    """
+    Builds the response of the function in the requested format.
+
+    Args:
+        records (list of dict): The scraped records, with url, title and body.
+        response_format (str, optional): 'json' (default) or 'columnar-gzip-v1'.
+        result_bucket (str, optional): S3 bucket where the columnar results larger than max_inline_bytes are stored. If
+            not given, they are always returned inline.
+        result_prefix (str, optional): Prefix of the keys of the results stored in S3. Default is 'scraper_results/'.
+        max_inline_bytes (int, optional): Maximum size of the base64 data returned inline. Default is 5 MiB.
+        unfinished (list of str, optional): The URLs not scraped before the time budget ran out.
+
+    Returns:
+        str or dict: For 'json', the JSON string of the records, or a dict with the "format", the "records" and the
+        "unfinished" URLs if some URLs were left unfinished. Otherwise a dict with the "format", the "count" of records,
+        the "unfinished" URLs and either the "data" or the "s3" location ({"bucket", "key"}) of the compressed columns.
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    if response_format == RESPONSE_FORMAT_JSON:
+        #The original JSON string is kept when every URL was scraped, so the collectors that only know it still work
+        if unfinished:
+            return {"format": response_format, "records": records, "unfinished": list(unfinished)}
+        return json.dumps(records)
+    if response_format != RESPONSE_FORMAT_COLUMNAR:
+        raise ValueError(f"Unsupported response format '{response_format}', supported formats: {RESPONSE_FORMATS}")
+
+    data = encode_columnar(records)
+    response = {"format": response_format, "count": len(records), "unfinished": list(unfinished or [])}
+
+    #base64 grows the data by 4/3
+    if result_bucket and 4 * ((len(data) + 2) // 3) > max_inline_bytes:
+        #boto3 is only imported for the oversized results (it is part of the Lambda runtime)
+        import boto3
+        key = f"{result_prefix}{uuid.uuid4().hex}.json.gz"
+        boto3.client("s3").put_object(Bucket=result_bucket, Key=key, Body=data)
+        response["s3"] = {"bucket": result_bucket, "key": key}
+    else:
+        response["data"] = base64.b64encode(data).decode("ascii")
+    return response
+
+
 #Main function
 def lambda_handler(event, context):
 
     #Get the list of urls
     urls = event["urls"]
 
-    #The number of max parallel workers, 10 by default
-    max_workers = event.get("max_workers", 10)
-
     #The defined timeout, 5 by default
     timeout = event.get("timeout", 5)
 
-    #Execute and get the results
-    results = parallel_scraping(urls, max_workers=max_workers, timeout=timeout)
-
-    #Create a dataframe excluding the non-null elements
-    results_df = pd.DataFrame([{"url": k, "title": v[0], "body": v[1]} for d in results for k, v in d.items() if v is not None])
-
-    #Return the results in json format
-    return results_df.to_json(orient="records")
+    #The maximum number of requests in flight to the same host, 4 by default
+    max_per_host = event.get("max_per_host", 4)
+
+    #The HTML extractor, 'bs4' (BeautifulSoup) by default or 'lxml'
+    extractor = event.get("extractor", "bs4")
+
+    #The scraping engine, 'threads' (parallel_scraping) by default, 'asyncio' (async_parallel_scraping) or 'pipeline' (pipelined_scraping)
+    backend = event.get("backend", "threads")
+
+    #The number of max parallel workers: 10 by default with 'threads', and the default of the engine with the others
+    # (200 requests in flight with 'asyncio', 50 download threads with 'pipeline')
+    max_workers = event.get("max_workers") or BACKEND_MAX_WORKERS.get(backend, 10)
+
+    #The time budget of the scraping, in seconds: the "time_budget" of the event if given, and never more than the time
+    # left before the Lambda timeout minus a margin to build the response ("response_margin", 10 seconds by default)
+    time_budget = event.get("time_budget")
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        time_left = max(context.get_remaining_time_in_millis() / 1000 - event.get("response_margin", 10), 0)
+        time_budget = time_left if time_budget is None else min(time_budget, time_left)
+
+    #Execute and get the results, the URLs not scraped before the deadline are kept in unfinished
+    unfinished = []
+    results = SCRAPING_BACKENDS[backend](urls, max_workers=max_workers, timeout=timeout, max_per_host=max_per_host, extractor=extractor, time_budget=time_budget, unfinished=unfinished)
+
+    #Build the records excluding the non-null elements, and return them in the requested format ('json' by default, a
+    # list of records)
+    records = [{"url": k, "title": v[0], "body": v[1]} for d in results for k, v in d.items() if v is not None]
+    return build_response(
+        records,
+        response_format=event.get("response_format", RESPONSE_FORMAT_JSON),
+        result_bucket=event.get("result_bucket"),
+        result_prefix=event.get("result_prefix", "scraper_results/"),
+        unfinished=unfinished
+    )
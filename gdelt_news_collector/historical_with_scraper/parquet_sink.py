@@ -0,0 +1,218 @@
+## The parquet_sink script defines the writer of the parquet files saved into S3. Instead of serializing the whole
+# DataFrame into a buffer and uploading it with a single put_object (which keeps the DataFrame, its Arrow copy and the
+# whole file in memory at the same time), the DataFrames are converted and written row group by row group, and the
+# encoded bytes are uploaded with an S3 multipart upload as soon as a part is full. The extra memory used is bounded by
+# one row group and one part, whatever the size of the file.
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from s3_multipart import S3MultipartWriter
+
+#Columns whose first row group has at most this fraction of distinct values are stored with dictionary encoding (the
+# rest are stored plain)
+DICTIONARY_MAX_DISTINCT_RATIO = 0.5
+
+def low_cardinality_columns(table, max_distinct_ratio=DICTIONARY_MAX_DISTINCT_RATIO):
+    """
+    Returns the columns of the table with few distinct values (e.g. the date of the files, or the titles repeated by
+    the pages of a site), which take less space with dictionary encoding.
+
+    Parameters
+    ----------
+    table : pa.Table
+        The rows of the first row group.
+    max_distinct_ratio : float, optional
+        Maximum number of distinct values of a column, as a fraction of the rows (default is 0.5).
+
+    Returns
+    -------
+    list of str
+        The names of the low cardinality columns.
+    """
+    return [
+        name for name, column in zip(table.column_names, table.columns)
+        if pc.count_distinct(column).as_py() <= max_distinct_ratio * table.num_rows
+    ]
+
+def string_null_columns(schema):
+    """
+    Returns the schema with the columns of null type (inferred when a column is entirely None) as string columns. The
+    schema of the file is taken from the first rows written, and no value of the later rows can be cast to null.
+
+    Parameters
+    ----------
+    schema : pa.Schema
+        The schema inferred from the first rows.
+
+    Returns
+    -------
+    pa.Schema
+        The schema of the file.
+    """
+    return pa.schema(
+        [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema],
+        metadata=schema.metadata
+    )
+
+class ParquetSink:
+    """
+    A class used to write a parquet file into S3 from a stream of DataFrames, one row group at a time.
+
+    Attributes
+    ----------
+    compression : str
+        The compression codec of the columns, e.g. 'zstd' or 'snappy'.
+    row_group_bytes : int
+        Target in-memory size of the rows of each row group, in bytes.
+    dictionary_columns : tuple of str or None
+        Columns stored with dictionary encoding, None until the first row group is written if they are detected.
+    rows_written : int
+        Number of rows written to the file.
+
+    Methods
+    -------
+    write(df)
+        Adds the rows of the DataFrame to the file, writing every row group that gets full.
+    close()
+        Writes the last row group and the footer, and completes the upload.
+    abort()
+        Discards the file.
+    """
+    def __init__(self, s3_client, bucket_name, file_name, compression="zstd", row_group_bytes=32 * 1024 * 1024, dictionary_columns=None, part_size=8 * 1024 * 1024):
+        """
+        Parameters
+        ----------
+        s3_client : boto3.client
+            The S3 client used to upload the file.
+        bucket_name : str
+            The name of the S3 bucket.
+        file_name : str
+            The key of the parquet file.
+        compression : str, optional
+            The compression codec of the columns, e.g. 'zstd' (default), 'snappy' or 'none'.
+        row_group_bytes : int, optional
+            Target in-memory size of the rows of each row group, in bytes (default is 32 MiB).
+        dictionary_columns : tuple of str, optional
+            Columns stored with dictionary encoding (default is the low cardinality columns of the first row group).
+        part_size : int, optional
+            Size of the parts of the multipart upload, in bytes (default is 8 MiB).
+        """
+        self.compression = compression
+        self.row_group_bytes = row_group_bytes
+        self.dictionary_columns = tuple(dictionary_columns) if dictionary_columns is not None else None
+        self.rows_written = 0
+        self._file = S3MultipartWriter(s3_client, bucket_name, file_name, part_size)
+        self._writer = None
+        self._schema = None
+        self._pending = []
+        self._pending_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        #The file is only completed if everything was written, otherwise the upload is discarded
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, df):
+        """
+        Adds the rows of the DataFrame to the file. The rows are converted to Arrow in slices of about one row group, and
+        every row group that gets full is encoded and uploaded.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The rows to write. Every DataFrame written to the file must have the same columns.
+        """
+        if df.empty:
+            return
+
+        #Estimate the rows of a row group from the size of the rows of this DataFrame
+        row_bytes = max(int(df.memory_usage(deep=True, index=False).sum()) // len(df), 1)
+        slice_rows = max(self.row_group_bytes // row_bytes, 1)
+
+        for start in range(0, len(df), slice_rows):
+            table = pa.Table.from_pandas(df.iloc[start:start + slice_rows], schema=self._schema, preserve_index=False)
+            if self._schema is None:
+                self._schema = string_null_columns(table.schema)
+                table = table.cast(self._schema)
+            self._pending.append(table)
+            self._pending_bytes += min(slice_rows, len(df) - start) * row_bytes
+            if self._pending_bytes >= self.row_group_bytes:
+                self._write_row_group()
+
+    def _write_row_group(self):
+        if not self._pending:
+            return
+        table = pa.concat_tables(self._pending)
+        if self._writer is None:
+            if self.dictionary_columns is None:
+                self.dictionary_columns = tuple(low_cardinality_columns(table))
+            self._writer = pq.ParquetWriter(
+                self._file,
+                self._schema,
+                compression=self.compression,
+                use_dictionary=[column for column in self.dictionary_columns if column in self._schema.names]
+            )
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        self.rows_written += table.num_rows
+        self._pending = []
+        self._pending_bytes = 0
+
+    def close(self):
+        """
+        Writes the last row group and the footer of the file, and completes the upload. The file is written into S3
+        once it returns.
+
+        Raises
+        ------
+        ValueError
+            If no row has been written.
+        """
+        try:
+            self._write_row_group()
+            if self._writer is None:
+                raise ValueError("No rows were written to the parquet file.")
+            self._writer.close()
+            self._file.close()
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        """
+        Discards the file, cancelling its upload.
+        """
+        self._pending = []
+        self._file.abort()
+
+def write_parquet(s3_client, bucket_name, file_name, dataframes, **sink_options):
+    """
+    Writes a stream of DataFrames into a single parquet file in S3.
+
+    Parameters
+    ----------
+    s3_client : boto3.client
+        The S3 client used to upload the file.
+    bucket_name : str
+        The name of the S3 bucket.
+    file_name : str
+        The key of the parquet file.
+    dataframes : iterable of pd.DataFrame
+        The DataFrames to write, consumed one by one.
+    **sink_options
+        Options of the ParquetSink (compression, row_group_bytes, dictionary_columns, part_size).
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    with ParquetSink(s3_client, bucket_name, file_name, **sink_options) as sink:
+        for df in dataframes:
+            sink.write(df)
+    return sink.rows_written
@@ -0,0 +1,238 @@
+## The run_journal script defines a persistent journal of the state of each 15 minutes slot of a historical run. The
+# collectors record every step of the slots (pending, scraped, cleaned, uploaded or failed, with the reason of the
+# failure), so a run that dies can be restarted with the same date range and the slots already uploaded are skipped.
+# The URLs that could not be scraped in a slot uploaded without them are recorded too. The journal is stored in SQLite,
+# shared by the worker threads of the collector.
+
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+#States of a slot
+SLOT_PENDING = "pending"
+SLOT_SCRAPED = "scraped"
+SLOT_CLEANED = "cleaned"
+SLOT_UPLOADED = "uploaded"
+SLOT_FAILED = "failed"
+SLOT_STATES = (SLOT_PENDING, SLOT_SCRAPED, SLOT_CLEANED, SLOT_UPLOADED, SLOT_FAILED)
+
+def slot_key(slot):
+    """
+    Returns the key of a slot in the journal, its timestamp in the 'YYYYMMDDHHMMSS' format of the GDELT files.
+
+    Parameters
+    ----------
+    slot : datetime or str
+        The datetime of the slot, or its timestamp as 'YYYYMMDDHHMMSS' or 'YYYY-MM-DD HH:MM:SS'.
+
+    Returns
+    -------
+    str
+        The key of the slot.
+    """
+    if isinstance(slot, str):
+        slot = datetime.strptime(slot, "%Y-%m-%d %H:%M:%S") if "-" in slot else datetime.strptime(slot, "%Y%m%d%H%M%S")
+    return slot.strftime("%Y%m%d%H%M%S")
+
+class RunJournal:
+    """
+    A class used to keep the state of the slots of a historical run across restarts.
+
+    Attributes
+    ----------
+    db_path : str
+        Path of the SQLite database where the states are stored.
+
+    Methods
+    -------
+    mark(slots, state, reason=None)
+        Records the new state of the slots.
+    completed(slots)
+        Returns the keys of the slots that have already been uploaded.
+    failures()
+        Returns the slots whose last state is failed, with the reason.
+    record_missing(slot, urls)
+        Records the URLs that could not be scraped in a slot.
+    missing(slots=None)
+        Returns the URLs that could not be scraped, by slot.
+    stats()
+        Returns the number of slots in each state.
+    """
+    def __init__(self, db_path):
+        """
+        Parameters
+        ----------
+        db_path : str
+            Path of the SQLite database where the states are stored. It is created if it does not exist.
+        """
+        self.db_path = db_path
+
+        #The connection is shared by the worker threads, so every access goes through the lock. With WAL and normal
+        # synchronization a commit does not wait for a sync of the disk, a crash can only lose the last transitions
+        # (the slots are then processed again, as without journal)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS slots ("
+            "slot TEXT PRIMARY KEY, state TEXT NOT NULL, reason TEXT, attempts INTEGER NOT NULL DEFAULT 0, updated_at REAL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS missing_urls ("
+            "slot TEXT NOT NULL, url TEXT NOT NULL, recorded_at REAL, PRIMARY KEY (slot, url)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def mark(self, slots, state, reason=None):
+        """
+        Records the new state of the slots, in a single transaction. Marking a slot as pending counts a new attempt.
+
+        Parameters
+        ----------
+        slots : datetime, str or iterable of them
+            The slots whose state changes.
+        state : str
+            The new state, one of SLOT_STATES.
+        reason : str, optional
+            The reason of the failure, or a note on the transition (default is None).
+
+        Raises
+        ------
+        ValueError
+            If the state is not supported.
+        """
+        if state not in SLOT_STATES:
+            raise ValueError(f"Unsupported slot state: {state}. Valid states are: {', '.join(SLOT_STATES)}")
+        if isinstance(slots, (str, datetime)):
+            slots = [slots]
+        attempt = int(state == SLOT_PENDING)
+        now = time.time()
+        rows = [(slot_key(slot), state, reason, attempt, now) for slot in slots]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO slots (slot, state, reason, attempts, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(slot) DO UPDATE SET state = excluded.state, reason = excluded.reason, "
+                "attempts = attempts + excluded.attempts, updated_at = excluded.updated_at",
+                rows
+            )
+            self._conn.commit()
+
+    def completed(self, slots):
+        """
+        Returns the keys of the slots that have already been uploaded.
+
+        Parameters
+        ----------
+        slots : iterable of datetime or str
+            The slots to check.
+
+        Returns
+        -------
+        set of str
+            The keys (see slot_key) of the uploaded slots.
+        """
+        keys = [slot_key(slot) for slot in slots]
+        done = set()
+        with self._lock:
+            #Checked in chunks, below the limit of parameters of a SQLite query
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                done.update(key for (key,) in self._conn.execute(
+                    f"SELECT slot FROM slots WHERE state = ? AND slot IN ({', '.join('?' * len(chunk))})",
+                    (SLOT_UPLOADED, *chunk)
+                ))
+        return done
+
+    def failures(self):
+        """
+        Returns the slots whose last state is failed.
+
+        Returns
+        -------
+        list of tuple
+            The (slot key, reason, attempts) of the failed slots, in chronological order.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT slot, reason, attempts FROM slots WHERE state = ? ORDER BY slot", (SLOT_FAILED,)
+            ).fetchall()
+
+    def record_missing(self, slot, urls):
+        """
+        Records the URLs that could not be scraped in a slot, replacing the ones recorded by a previous attempt.
+
+        Parameters
+        ----------
+        slot : datetime or str
+            The slot of the URLs.
+        urls : iterable of str
+            The URLs that could not be scraped.
+        """
+        key = slot_key(slot)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM missing_urls WHERE slot = ?", (key,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO missing_urls (slot, url, recorded_at) VALUES (?, ?, ?)",
+                [(key, url, now) for url in urls]
+            )
+            self._conn.commit()
+
+    def missing(self, slots=None):
+        """
+        Returns the URLs that could not be scraped.
+
+        Parameters
+        ----------
+        slots : iterable of datetime or str, optional
+            The slots to check (default is every slot).
+
+        Returns
+        -------
+        dict
+            The list of missing URLs of each slot key with missing URLs.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT slot, url FROM missing_urls ORDER BY slot, url").fetchall()
+        keys = None if slots is None else {slot_key(slot) for slot in slots}
+        missing = {}
+        for key, url in rows:
+            if keys is None or key in keys:
+                missing.setdefault(key, []).append(url)
+        return missing
+
+    def stats(self):
+        """
+        Returns the number of slots in each state.
+
+        Returns
+        -------
+        dict
+            The number of slots of every state in SLOT_STATES.
+        """
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT state, COUNT(*) FROM slots GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in SLOT_STATES}
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+def journal_from_env():
+    """
+    Creates a RunJournal stored in the RUN_JOURNAL_PATH environment variable (default 'run_journal.sqlite3').
+
+    Returns
+    -------
+    RunJournal
+        The journal of the run.
+    """
+    return RunJournal(os.getenv('RUN_JOURNAL_PATH', 'run_journal.sqlite3'))
@@ -0,0 +1,113 @@
+## The s3_multipart script defines the write-only file object used to upload the files of the collectors (upload_sink)
+# and of the cleaners (parquet_sink) to S3 while they are written: the bytes are buffered and uploaded in parts, so the
+# whole file is never kept in memory nor written to disk. Every package is deployed on its own, so the script is copied
+# in each of them, keep the copies identical.
+
+#S3 requires at least 5 MiB for every part of a multipart upload but the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+class S3MultipartWriter:
+    """
+    A write-only file object that uploads what is written to it to an S3 object, with a multipart upload once more than
+    one part has been written, or with a single put_object if the whole object fits in a part.
+
+    Attributes
+    ----------
+    bucket_name : str
+        The name of the S3 bucket.
+    key : str
+        The key of the object.
+    part_size : int
+        Size of the uploaded parts, in bytes.
+
+    Methods
+    -------
+    write(data)
+        Buffers the bytes, uploading a part every time part_size bytes are buffered.
+    close()
+        Uploads the remaining bytes and completes the upload, so the object is written once it returns.
+    abort()
+        Cancels the upload, the parts already uploaded are discarded.
+    """
+    def __init__(self, s3_client, bucket_name, key, part_size=8 * 1024 * 1024, extra_args=None):
+        """
+        Parameters
+        ----------
+        s3_client : boto3.client
+            The S3 client used to upload the object.
+        bucket_name : str
+            The name of the S3 bucket.
+        key : str
+            The key of the object.
+        part_size : int, optional
+            Size of the uploaded parts, in bytes (default is 8 MiB, at least 5 MiB).
+        extra_args : dict, optional
+            Extra arguments of the upload, e.g. {"ContentType": "text/csv"}.
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.extra_args = extra_args or {}
+        self.closed = False
+        self._buffer = bytearray()
+        self._position = 0
+        self._upload_id = None
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _upload_part(self, body):
+        if self._upload_id is None:
+            self._upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, **self.extra_args
+            )['UploadId']
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id, PartNumber=part_number, Body=body
+        )
+        self._parts.append({"ETag": response['ETag'], "PartNumber": part_number})
+
+    def close(self):
+        if self.closed:
+            return
+        if self._upload_id is None:
+            #The whole object fits in a part
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=self.key, Body=bytes(self._buffer), **self.extra_args)
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id, MultipartUpload={"Parts": self._parts}
+            )
+        self._buffer = bytearray()
+        self.closed = True
+
+    def abort(self):
+        if self.closed:
+            return
+        if self._upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id)
+        self._buffer = bytearray()
+        self.closed = True
@@ -0,0 +1,96 @@
+## The gdelt_reader script defines a streaming reader for the GDELT export files. Only the SOURCEURL column is needed
+# by the collectors, so instead of loading the 61 columns of the file into a DataFrame, the zip member is read line by
+# line and only the requested column is extracted.
+
+import csv
+import io
+import zipfile
+from contextlib import contextmanager
+
+#Index of the SOURCEURL column in the GDELT 2.0 export files
+SOURCE_URL_COL_IDX = 60
+
+@contextmanager
+def _open_lines(path):
+    """
+    Opens the export file (zipped or not) and yields a binary file object to iterate its lines. Both the zip member
+    and the zip file are closed on exit.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zip_file:
+            #GDELT export zips contain a single CSV member
+            with zip_file.open(zip_file.namelist()[0]) as member:
+                yield member
+    else:
+        with open(path, "rb") as raw_file:
+            yield raw_file
+
+def iter_column(path, col_idx=SOURCE_URL_COL_IDX):
+    """
+    Streams the values of a single column of a tab separated GDELT export file.
+
+    The expected number of fields is taken from the first line, and the lines that do not have that number of fields
+    are skipped, the same way pd.read_csv(..., on_bad_lines='skip') skips them. Lines containing quotes or escape
+    characters are parsed with the csv module (quotechar '"' and escapechar '\\'), the rest are split directly.
+
+    Parameters
+    ----------
+    path : str
+        The path of the export file, either the .zip file downloaded from GDELT or the extracted CSV.
+    col_idx : int, optional
+        The index of the column to extract (default is the SOURCEURL column).
+
+    Yields
+    ------
+    str
+        The value of the column for each valid line, empty values are skipped.
+    """
+    n_fields = None
+    with _open_lines(path) as raw_file:
+        for raw_line in io.TextIOWrapper(raw_file, encoding="utf-8", errors="replace", newline=""):
+            line = raw_line.rstrip("\r\n")
+            if not line:
+                continue
+
+            if '"' in line or "\\" in line:
+                #Slow path, let the csv module handle quoting and escaping. A quoted field spanning several lines
+                # ends up with the wrong number of fields and is skipped as a bad line
+                fields = next(csv.reader([line], delimiter="\t", quotechar='"', escapechar="\\"), [])
+                line_fields = len(fields)
+                value = fields[col_idx] if col_idx < line_fields else None
+            else:
+                #Fast path, only count the separators and slice the requested column
+                line_fields = line.count("\t") + 1
+                if col_idx >= line_fields:
+                    value = None
+                elif col_idx == line_fields - 1:
+                    value = line[line.rfind("\t") + 1:]
+                else:
+                    value = line.split("\t", col_idx + 1)[col_idx]
+
+            if n_fields is None:
+                n_fields = line_fields
+
+            #Skip bad lines
+            if line_fields != n_fields or not value:
+                continue
+
+            yield value
+
+def read_source_urls(path, col_idx=SOURCE_URL_COL_IDX):
+    """
+    Returns the unique URLs of a GDELT export file, in order of first appearance.
+
+    Parameters
+    ----------
+    path : str
+        The path of the export file, either the .zip file downloaded from GDELT or the extracted CSV.
+    col_idx : int, optional
+        The index of the URL column (default is the SOURCEURL column).
+
+    Returns
+    -------
+    list of str
+        The unique URLs of the file.
+    """
+    return list(dict.fromkeys(iter_column(path, col_idx)))
@@ -0,0 +1,315 @@
+## The lambda_dispatcher script defines how the URLs of a slot are sent to the scraper Lambda function. Instead of a
+# single synchronous invocation with every URL, the URLs are split into shards that are invoked concurrently and their
+# results are joined back in order. The number of invocations in flight is adapted to the throttling of Lambda with
+# additive increase / multiplicative decrease (AIMD), shared by all the threads of the collector, and only the shards
+# that fail are retried (and the URLs a shard left unfinished at the deadline of the function).
+
+import os
+import time
+import heapq
+import random
+import logging
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from lambda_payload import build_event, decode_response, COLUMNS
+
+logger = logging.getLogger(__name__)
+
+class ThrottledError(Exception):
+    """
+    Raised by an invoker when Lambda rejects the invocation because of its concurrency limit.
+    """
+
+class AimdLimiter:
+    """
+    A class used to limit the number of invocations in flight, adapting the limit to the throttling: it grows by
+    'increase' every 'limit' successful invocations, and it is multiplied by 'decrease' when an invocation is throttled.
+    The invocations started before the last decrease do not decrease it again, since the invocations in flight when the
+    limit is hit are usually throttled together.
+
+    Attributes
+    ----------
+    limit : float
+        The current limit of invocations in flight.
+    in_flight : int
+        Number of invocations in flight.
+    throttles : int
+        Number of throttled invocations.
+
+    Methods
+    -------
+    try_acquire()
+        Takes a slot if the limit allows it, returning the time it was taken.
+    release(acquired, throttled=False)
+        Returns a slot, updating the limit with the outcome of the invocation.
+    wait(timeout)
+        Waits until a slot is released.
+    """
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1.0, decrease=0.5):
+        """
+        Parameters
+        ----------
+        initial : int, optional
+            The initial limit (default is 4).
+        minimum : int, optional
+            The minimum limit (default is 1).
+        maximum : int, optional
+            The maximum limit (default is 64).
+        increase : float, optional
+            Growth of the limit every 'limit' successful invocations (default is 1).
+        decrease : float, optional
+            Factor applied to the limit when an invocation is throttled (default is 0.5).
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.throttles = 0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return time.monotonic()
+            return None
+
+    def release(self, acquired, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                if acquired > self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = time.monotonic()
+            else:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self._condition.notify_all()
+
+    def wait(self, timeout):
+        with self._condition:
+            self._condition.wait(timeout)
+
+def split_shards(urls, shard_size):
+    """
+    Splits the URLs into the minimum number of shards of at most shard_size URLs, all of them of about the same size
+    (so there is no small last shard).
+    """
+    if not urls:
+        return []
+    n_shards = -(-len(urls) // shard_size)
+    base, extra = divmod(len(urls), n_shards)
+    shards, start = [], 0
+    for i in range(n_shards):
+        end = start + base + (1 if i < extra else 0)
+        shards.append(urls[start:end])
+        start = end
+    return shards
+
+class LambdaDispatcher:
+    """
+    A class used to scrape a list of URLs with concurrent invocations of shards of URLs.
+
+    Attributes
+    ----------
+    invoke : callable
+        Function receiving a list of URLs and returning their scraped records as a DataFrame and the list of URLs left
+        unfinished. It raises ThrottledError when the invocation is throttled, and any other exception when it fails.
+    shard_size : int
+        Maximum number of URLs of each invocation.
+    limiter : AimdLimiter
+        The limit of invocations in flight, shared by every dispatch.
+    max_attempts : int
+        Maximum number of failed invocations of a shard before giving up on it.
+    max_throttles : int
+        Maximum number of throttled invocations of a shard before giving up on it.
+
+    Methods
+    -------
+    dispatch(urls)
+        Scrapes the URLs and returns the results and the URLs of the shards that could not be scraped.
+    stats()
+        Returns a summary of the invocations.
+    """
+    def __init__(self, invoke, shard_size=100, limiter=None, max_attempts=4, max_throttles=20, backoff=1.0):
+        """
+        Parameters
+        ----------
+        invoke : callable
+            Function receiving a list of URLs and returning their scraped records and the URLs left unfinished.
+        shard_size : int, optional
+            Maximum number of URLs of each invocation (default is 100).
+        limiter : AimdLimiter, optional
+            The limit of invocations in flight (default is a new AimdLimiter).
+        max_attempts : int, optional
+            Maximum number of failed invocations of a shard (default is 4).
+        max_throttles : int, optional
+            Maximum number of throttled invocations of a shard (default is 20).
+        backoff : float, optional
+            Base delay, in seconds, before retrying a shard. It doubles with every failure of the shard (default is 1).
+        """
+        self.invoke = invoke
+        self.shard_size = shard_size
+        self.limiter = limiter or AimdLimiter()
+        self.max_attempts = max_attempts
+        self.max_throttles = max_throttles
+        self.backoff = backoff
+        self.invocations = 0
+        self.failures = 0
+        self._stats_lock = threading.Lock()
+
+    def _retry_delay(self, failures, throttles):
+        #Full jitter, so the retries of the shards throttled together are spread
+        return random.uniform(0, self.backoff * 2 ** min(failures + throttles // 4, 6))
+
+    def dispatch(self, urls):
+        """
+        Scrapes the URLs, invoking their shards concurrently within the limit of invocations in flight. A shard that
+        fails or is throttled is retried after a delay, the rest of shards are not affected. The URLs that a shard left
+        unfinished (the function ran out of time) are invoked again as a new shard.
+
+        Parameters
+        ----------
+        urls : list of str
+            The URLs to scrape.
+
+        Returns
+        -------
+        pd.DataFrame
+            The scraped records of the shards that succeeded, in the order of the shards (the unfinished URLs at the end).
+        list of str
+            The URLs of the shards that failed max_attempts times (or were throttled max_throttles times).
+        """
+        shards = split_shards(list(urls), self.shard_size)
+
+        #Shards waiting to be invoked: (time when they can be invoked, index, failures, throttles)
+        ready = [(0.0, index, 0, 0) for index in range(len(shards))]
+        results = {}
+        failed = []
+
+        with ThreadPoolExecutor(max_workers=max(self.limiter.maximum, 1)) as executor:
+            in_flight = {}
+            while ready or in_flight:
+                #Invoke every shard whose delay has passed, while the limiter allows it
+                now = time.monotonic()
+                while ready and ready[0][0] <= now:
+                    acquired = self.limiter.try_acquire()
+                    if acquired is None:
+                        break
+                    _, index, failures, throttles = heapq.heappop(ready)
+                    in_flight[executor.submit(self.invoke, shards[index])] = (index, failures, throttles, acquired)
+                    with self._stats_lock:
+                        self.invocations += 1
+
+                #Wait for an invocation to finish, for the next shard delay, or for a slot released by another dispatch
+                delay = ready[0][0] - now if ready else None
+                timeout = None if delay is None else (min(delay, 0.1) if delay > 0 else 0.1)
+                if in_flight:
+                    done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    done = set()
+                    self.limiter.wait(timeout)
+
+                for future in done:
+                    index, failures, throttles, acquired = in_flight.pop(future)
+                    try:
+                        results[index], unfinished = future.result()
+                        self.limiter.release(acquired)
+                        if not unfinished:
+                            continue
+                        #Invoke the unfinished URLs as a new shard, it only counts as a failure if nothing was finished
+                        logger.info(f"Shard of {len(shards[index])} URLs left {len(unfinished)} unfinished.")
+                        failures = failures + 1 if len(unfinished) >= len(shards[index]) else 0
+                        throttles = 0
+                        shards.append(list(unfinished))
+                        index = len(shards) - 1
+                    except ThrottledError:
+                        self.limiter.release(acquired, throttled=True)
+                        throttles += 1
+                    except Exception as e:
+                        self.limiter.release(acquired)
+                        failures += 1
+                        with self._stats_lock:
+                            self.failures += 1
+                        logger.warning(f"Shard of {len(shards[index])} URLs failed (attempt {failures}): {e}")
+
+                    if failures >= self.max_attempts or throttles >= self.max_throttles:
+                        failed.extend(shards[index])
+                    else:
+                        heapq.heappush(ready, (time.monotonic() + self._retry_delay(failures, throttles), index, failures, throttles))
+
+        frames = [results[index] for index in sorted(results)]
+        return (pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)), failed
+
+    def stats(self):
+        """
+        Returns a summary of the invocations: number of invocations, failures, throttles and current limit.
+        """
+        return (
+            f"{self.invocations} invocations, {self.failures} failed, {self.limiter.throttles} throttled, "
+            f"concurrency limit {self.limiter.limit:.1f}"
+        )
+
+def lambda_invoker(lambda_client, function_name, s3_client=None, **event_options):
+    """
+    Returns the invoke function of a LambdaDispatcher for the scraper function.
+
+    Parameters
+    ----------
+    lambda_client : boto3.client
+        The Lambda client.
+    function_name : str
+        The name of the scraper function.
+    s3_client : boto3.client, optional
+        The S3 client used to read the results stored in S3.
+    **event_options
+        The rest of fields of the event (backend, extractor, ...).
+
+    Returns
+    -------
+    callable
+        Function receiving a list of URLs and returning their scraped records as a DataFrame and the unfinished URLs.
+    """
+    def invoke(urls):
+        try:
+            response = lambda_client.invoke(
+                FunctionName=function_name,
+                InvocationType='RequestResponse',
+                Payload=build_event(urls, **event_options)
+            )
+        except lambda_client.exceptions.TooManyRequestsException as e:
+            raise ThrottledError(str(e))
+        if response.get('FunctionError'):
+            raise RuntimeError(f"The scraper function failed: {response['Payload'].read()[:500]}")
+        return decode_response(response['Payload'], s3_client)
+    return invoke
+
+def dispatcher_from_env(invoke):
+    """
+    Creates a LambdaDispatcher configured with the LAMBDA_SHARD_SIZE (default 100), LAMBDA_INITIAL_CONCURRENCY
+    (default 4), LAMBDA_MAX_CONCURRENCY (default 64) and LAMBDA_MAX_ATTEMPTS (default 4) environment variables.
+
+    Parameters
+    ----------
+    invoke : callable
+        Function receiving a list of URLs and returning their scraped records and the URLs left unfinished.
+
+    Returns
+    -------
+    LambdaDispatcher
+        The configured dispatcher.
+    """
+    limiter = AimdLimiter(
+        initial=int(os.getenv('LAMBDA_INITIAL_CONCURRENCY', 4)),
+        maximum=int(os.getenv('LAMBDA_MAX_CONCURRENCY', 64))
+    )
+    return LambdaDispatcher(
+        invoke,
+        shard_size=int(os.getenv('LAMBDA_SHARD_SIZE', 100)),
+        limiter=limiter,
+        max_attempts=int(os.getenv('LAMBDA_MAX_ATTEMPTS', 4))
+    )
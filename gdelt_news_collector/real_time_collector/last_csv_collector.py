@@ -1,11 +1,14 @@
-import pandas as pd
-import requests
 import os
-from datetime import datetime
 import boto3
-import json
+import zipfile
 import logging
 from dotenv import load_dotenv
+from gdelt_cache import cache_from_env
+from gdelt_reader import read_source_urls
+from slot_discovery import SlotDiscovery
+from url_index import index_from_env
+from upload_sink import save_csv, sink_from_env
+from lambda_dispatcher import dispatcher_from_env, lambda_invoker
 
 #Load environment variables from .env file
 load_dotenv()
@@ -20,8 +23,36 @@ lambda_client = boto3.client(
     region_name=os.getenv('AWS_REGION')
 )
 
-col_names = ["ID", "Hash", "urls_csv"]
-url = "http://data.gdeltproject.org/gdeltv2/masterfilelist.txt"
+#Local cache of the GDELT export files
+gdelt_cache = cache_from_env()
+
+#Keeps track of the last processed slot, so only the new files published by GDELT are requested
+slot_discovery = SlotDiscovery(
+    cursor_path=os.getenv('SLOT_CURSOR_PATH', 'slot_cursor.json'),
+    max_slots=int(os.getenv('MAX_SLOTS_PER_RUN', 8)),
+    max_attempts=int(os.getenv('MAX_SLOT_ATTEMPTS', 3))
+)
+
+#Index of the article urls already scraped, GDELT reports the same article in many consecutive files
+seen_urls = index_from_env()
+
+#Options of the scraper function: the engine, the HTML extractor and, if set, the number of workers of the engine
+# (otherwise the function uses the default of the engine)
+scraper_options = {
+    "backend": os.getenv('SCRAPER_BACKEND', 'threads'),
+    "extractor": os.getenv('SCRAPER_EXTRACTOR', 'bs4')
+}
+if os.getenv('SCRAPER_MAX_WORKERS'):
+    scraper_options["max_workers"] = int(os.getenv('SCRAPER_MAX_WORKERS'))
+
+#Sends the urls of each slot to the lambda function in concurrent shards, adapting the concurrency to its throttling
+lambda_dispatcher = dispatcher_from_env(lambda_invoker(
+    lambda_client,
+    os.getenv('LAMBDA_SCRAPER_FUNCTION_NAME'),
+    s3_client,
+    **scraper_options
+))
+
 url_col_idx = 60
 
 #Configure the logger
@@ -33,98 +64,118 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def main():
+def process_slot(url_last_csv, date, bucket_names):
     """
-    Main function to fetch the latest GDELT CSV, process it, and upload the results to an S3 bucket.
-    
-    Environment Variables:
-    - AWS_REGION: AWS region
-    - S3_COLLECTOR_BUCKET_NAME: Name of the S3 bucket
-    - LAMBDA_SCRAPER_FUNCTION_NAME: Name of the AWS Lambda function for scraping URLs
+    Scrapes the URLs of a GDELT export file and uploads the results to the S3 buckets.
+
+    Parameters:
+    url_last_csv (str): The URL of the GDELT export file.
+    date (datetime): The 15 minutes slot of the export file.
+    bucket_names (list of str): The S3 buckets where the results are uploaded.
 
     Returns:
     None
     """
+    # Get the new URL list (without duplicates)
+    try:
+        url_list = read_source_urls(gdelt_cache.fetch(url_last_csv, date), col_idx=url_col_idx)
+    except zipfile.BadZipFile:
+        # Do not keep a file that cannot be parsed in the cache, it is downloaded again when the slot is retried
+        gdelt_cache.discard(date)
+        raise
 
-    # Get the list of bucket names from environment variable
-    bucket_names = os.getenv('S3_COLLECTOR_BUCKET_NAMES').split(',')
-
-    # Make the request to download the file
-    response = requests.get(url)
-
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Get the text content
-
-        logger.info("Request fetched successfully")
-
-        try:
-            text_content = response.text
+    # Skip the urls already scraped from previous files
+    url_list = seen_urls.filter_unseen(url_list)
+    if not url_list:
+        logger.info("All the URLs were already scraped.")
+        return
 
-            # Filename for temp file
-            filename = f"urls_{datetime.now().strftime('%Y_%m_%d__%H_%M_%S')}.csv"
-            
-            # Save the text content to a local file
-            with open(filename, 'w') as file:
-                file.write(text_content)
+    logger.info("URLs list fetched, calling lambda scraper.")
 
-            # Get the URL of the current time new published DF
-            url_last_csv = pd.read_csv(filename, sep=" ", header=None, names=col_names).iloc[-3]["urls_csv"]
+    # Scrape the urls in concurrent shards of the lambda function (the throttled and failed shards are retried)
+    df_for_s3, failed_urls = lambda_dispatcher.dispatch(url_list)
 
-            # Extract date from url_last_csv
-            date_str = url_last_csv.split('/')[-1].split('.')[0]
-            date = datetime.strptime(date_str, "%Y%m%d%H%M%S")
+    # The slot is not saved (nor the cursor moved) if nothing could be scraped, it is retried on the next run. Otherwise
+    # the scraped part is saved and the missing urls are not marked as seen, so they are scraped again if they appear
+    # in a later slot
+    if failed_urls and df_for_s3.empty:
+        raise RuntimeError(f"None of the {len(url_list)} urls could be scraped for slot {date}.")
+    if failed_urls:
+        logger.warning(f"{len(failed_urls)} of {len(url_list)} urls could not be scraped for slot {date}, saving the rest.")
 
-            # Delete the aux csv file
-            os.remove(filename)
+    logger.info("Lambda calls successful")
 
-            # Get the new URL list (without duplicates)
-            url_list = pd.read_csv(url_last_csv, delimiter='\t', header=None)[url_col_idx].unique().tolist()
+    # Drop the rows with NaN values
+    df_for_s3 = df_for_s3.dropna()
 
-            logger.info("URLs list fetched, calling lambda scraper.")
+    # Save the response from the lambda function into a csv in S3
+    result_filename = f"news_{date.strftime('%Y_%m_%d__%H_%M_%S')}.csv"
 
-            # Call created lambda function with the list of urls "url_list"
-            response = lambda_client.invoke(
-                FunctionName=os.getenv('LAMBDA_SCRAPER_FUNCTION_NAME'),
-                InvocationType='RequestResponse',
-                Payload=json.dumps({"urls": url_list})
-            )  
+    logger.info("Uploading to S3...")
 
-            logger.info("Lambda call successful")
+    # Upload to all specified S3 buckets, serializing the csv straight into the upload (no local file is written)
+    for bucket_name in bucket_names:
+        save_csv(sink_from_env(s3_client, bucket_name), result_filename, df_for_s3)
+        logger.info(f"Uploaded to S3 bucket: {bucket_name}")
 
-            # Get the response payload
-            response_payload = json.load(response['Payload'])
+    logger.info("Uploaded to S3")
 
-            # Convert the response payload from string to a list of dictionaries
-            response_list = json.loads(response_payload)
-            # Create the DF to store into S3
-            df_for_s3 = pd.DataFrame(response_list)
+    # Register the scraped urls, so they are not scraped again in the following files
+    seen_urls.mark_seen(df_for_s3['url'])
 
-            # Drop the rows with NaN values
-            df_for_s3 = df_for_s3.dropna()
+def main():
+    """
+    Main function to fetch the GDELT CSVs published since the last run, process them, and upload the results to an S3 bucket.
+    
+    Environment Variables:
+    - AWS_REGION: AWS region
+    - S3_COLLECTOR_BUCKET_NAME: Name of the S3 bucket
+    - LAMBDA_SCRAPER_FUNCTION_NAME: Name of the AWS Lambda function for scraping URLs
+    - SCRAPER_BACKEND, SCRAPER_EXTRACTOR, SCRAPER_MAX_WORKERS: Engine, HTML extractor and number of workers of the scraper
+      function (by default, the number of workers of the engine)
+    - SLOT_CURSOR_PATH: Path of the file where the last processed slot is persisted
+    - MAX_SLOTS_PER_RUN: Maximum number of missed slots to process in a single run
+    - MAX_SLOT_ATTEMPTS: Maximum number of runs in which a failed slot is processed before giving up on it (default 3)
+    - UPLOAD_GZIP: Whether the uploaded CSVs are gzip compressed (default false)
+    - UPLOAD_SINK_DIR: If set, the CSVs are written into this local directory instead of S3
+    - LAMBDA_RESPONSE_FORMAT: Format of the response of the scraper, 'columnar-gzip-v1' (default) or 'json'
+    - LAMBDA_RESULT_BUCKET: If set, the scraper stores the results too large for the response in this bucket
+    - LAMBDA_SHARD_SIZE, LAMBDA_INITIAL_CONCURRENCY, LAMBDA_MAX_CONCURRENCY, LAMBDA_MAX_ATTEMPTS: Configuration of the
+      shards of urls sent to the scraper and of the concurrency of the invocations
 
-            # Save the response from the lambda function into a csv in S3
-            result_filename = f"news_{date.strftime('%Y_%m_%d__%H_%M_%S')}.csv"
-            df_for_s3.to_csv(result_filename, index=False)
+    Returns:
+    None
+    """
 
-            logger.info("Uploading to S3...")
+    # Get the list of bucket names from environment variable
+    bucket_names = os.getenv('S3_COLLECTOR_BUCKET_NAMES').split(',')
 
-            # Upload to all specified S3 buckets
-            for bucket_name in bucket_names:
-                s3_client.upload_file(result_filename, bucket_name, result_filename)
-                logger.info(f"Uploaded to S3 bucket: {bucket_name}")
+    try:
+        # Get the slots published since the last processed one (only lastupdate.txt is requested when none was missed)
+        pending_slots = slot_discovery.pending_slots()
+    except Exception as e:
+        logger.error(f"Failed to retrieve the last published files: {e}")
+        exit(0)
 
-            logger.info("Uploaded to S3")
+    # The slots that failed in the previous runs are retried after the new ones
+    retry_slots = slot_discovery.failed_slots()
+    if not pending_slots and not retry_slots:
+        logger.info("No new slots published since the last run.")
+        return
 
-            # Delete the local result file
-            os.remove(result_filename)
+    for date, url_last_csv in pending_slots + retry_slots:
+        try:
+            process_slot(url_last_csv, date, bucket_names)
 
+            # Move the cursor only once the slot has been uploaded
+            slot_discovery.commit(date)
         except Exception as e:
-            logger.error(f"An exception occurred: {e}")
-            exit(0)
-    else:
-        logger.error(f"Failed to retrieve the file. Status code: {response.status_code}")
-        exit(0)
+            # The slot is recorded as failed (to be retried in the next runs) and does not block the following slots
+            logger.error(f"An exception occurred processing slot {date}: {e}")
+            slot_discovery.fail(date, url_last_csv)
+
+    logger.info(f"Seen urls index: {seen_urls.stats()}")
+    logger.info(f"Lambda dispatcher: {lambda_dispatcher.stats()}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
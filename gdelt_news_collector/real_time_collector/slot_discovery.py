@@ -0,0 +1,275 @@
+## The slot_discovery script defines how the real time collector finds the new GDELT export files to process. Instead of
+# downloading the whole masterfilelist.txt on every run, it reads the small lastupdate.txt file and keeps a persisted
+# cursor with the last processed slot. Only when some slots were missed, the new tail of the masterfilelist is fetched
+# with an HTTP Range request, falling back to a full resync if the cursor does not match the remote file anymore. The
+# slots that fail are recorded in the cursor and returned again in the next runs, so they never block the new slots.
+
+import os
+import json
+import itertools
+import tempfile
+import logging
+from datetime import datetime, timedelta
+import requests
+
+logger = logging.getLogger(__name__)
+
+LAST_UPDATE_URL = "http://data.gdeltproject.org/gdeltv2/lastupdate.txt"
+MASTER_FILE_LIST_URL = "http://data.gdeltproject.org/gdeltv2/masterfilelist.txt"
+EXPORT_SUFFIX = ".export.CSV.zip"
+SLOT_INTERVAL = timedelta(minutes=15)
+
+def parse_export_line(line):
+    """
+    Parses a line of the lastupdate.txt or masterfilelist.txt files ("<size> <hash> <url>").
+
+    Parameters
+    ----------
+    line : str
+        The line to parse.
+
+    Returns
+    -------
+    tuple of (datetime, str) or None
+        The slot datetime and the URL of the file if the line points to an export file, otherwise None.
+    """
+    parts = line.strip().split(" ")
+    if len(parts) != 3 or not parts[2].endswith(EXPORT_SUFFIX):
+        return None
+    url = parts[2]
+    try:
+        slot = datetime.strptime(url.split('/')[-1].split('.')[0], "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    return slot, url
+
+class SlotDiscovery:
+    """
+    A class used to discover the GDELT export files published since the last run of the real time collector.
+
+    Attributes
+    ----------
+    cursor_path : str
+        Path of the JSON file where the cursor is persisted.
+    max_slots : int
+        Maximum number of pending slots returned by a single run (the most recent ones are kept).
+    max_attempts : int
+        Maximum number of times a slot is processed before giving up on it.
+    cursor : dict
+        The last processed slot ("last_slot"), the slots that failed with their URL and number of attempts ("failed")
+        and, once the masterfilelist has been read, the byte offset up to which it was read ("offset") and the last
+        line before that offset ("anchor").
+
+    Methods
+    -------
+    pending_slots()
+        Returns the (slot datetime, export URL) pairs published after the last processed slot.
+    failed_slots()
+        Returns the (slot datetime, export URL) pairs of the slots that failed and can be retried.
+    commit(slot)
+        Persists the slot as the last processed one.
+    fail(slot, url)
+        Records a slot that could not be processed and moves the cursor past it.
+    """
+    def __init__(self, cursor_path, max_slots=8, session=None, timeout=30, max_attempts=3):
+        """
+        Parameters
+        ----------
+        cursor_path : str
+            Path of the JSON file where the cursor is persisted.
+        max_slots : int, optional
+            Maximum number of pending slots returned by a single run (default is 8).
+        session : requests.Session, optional
+            The session used for the HTTP requests (a new one is created by default).
+        timeout : int, optional
+            Timeout, in seconds, of the HTTP requests (default is 30).
+        max_attempts : int, optional
+            Maximum number of times a slot is processed before giving up on it (default is 3).
+        """
+        self.cursor_path = cursor_path
+        self.max_slots = max_slots
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.cursor = self._load_cursor()
+
+    def _load_cursor(self):
+        try:
+            with open(self.cursor_path) as cursor_file:
+                cursor = json.load(cursor_file)
+            cursor["last_slot"] = datetime.strptime(cursor["last_slot"], "%Y%m%d%H%M%S")
+            return cursor
+        except FileNotFoundError:
+            return {}
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Invalid slot cursor at {self.cursor_path}, ignoring it: {e}")
+            return {}
+
+    def _save_cursor(self):
+        data = dict(self.cursor)
+        data["last_slot"] = data["last_slot"].strftime("%Y%m%d%H%M%S")
+
+        #Write to a temporary file and move it into place, so a crash never leaves a half written cursor
+        cursor_dir = os.path.dirname(os.path.abspath(self.cursor_path))
+        fd, tmp_path = tempfile.mkstemp(dir=cursor_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(data, tmp_file)
+        os.replace(tmp_path, self.cursor_path)
+
+    def _latest_slot(self):
+        response = self.session.get(LAST_UPDATE_URL, timeout=self.timeout)
+        response.raise_for_status()
+        for line in response.text.splitlines():
+            parsed = parse_export_line(line)
+            if parsed:
+                return parsed
+        raise ValueError("No export file found in lastupdate.txt")
+
+    def _read_tail(self):
+        """
+        Reads the masterfilelist from the cursor offset with a Range request. Returns None if the cursor does not
+        match the remote file, so a full resync is needed.
+        """
+        offset = self.cursor.get("offset")
+        anchor = self.cursor.get("anchor")
+        if offset is None or not anchor:
+            return None
+
+        #Request the file starting at the last line read, to check the cursor still points to the same place
+        anchor_bytes = (anchor + "\n").encode()
+        start = offset - len(anchor_bytes)
+        response = self.session.get(MASTER_FILE_LIST_URL, headers={"Range": f"bytes={start}-", "Accept-Encoding": "identity"}, stream=True, timeout=self.timeout)
+
+        #A server that ignores the Range header answers with the whole file, which is read as in a full resync instead
+        # of downloading it again
+        if response.status_code == 200:
+            logger.info("The Range request was ignored, reading the whole masterfilelist.")
+            return 0, response.iter_content(chunk_size=1024 * 1024)
+        if response.status_code != 206:
+            response.close()
+            logger.info("Slot cursor does not match the masterfilelist, doing a full resync.")
+            return None
+
+        #Only the first bytes are read to check the anchor, the rest of the body is streamed by the caller
+        chunks = response.iter_content(chunk_size=1024 * 1024)
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= len(anchor_bytes):
+                break
+        if not head.startswith(anchor_bytes):
+            response.close()
+            logger.info("Slot cursor does not match the masterfilelist, doing a full resync.")
+            return None
+        return start, itertools.chain([head], chunks)
+
+    def _read_full(self):
+        """
+        Streams the whole masterfilelist, only used when there is no valid cursor offset.
+        """
+        response = self.session.get(MASTER_FILE_LIST_URL, headers={"Accept-Encoding": "identity"}, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        return 0, response.iter_content(chunk_size=1024 * 1024)
+
+    def _slots_from_masterfilelist(self, last_slot):
+        start, chunks = self._read_tail() or self._read_full()
+
+        slots = []
+        consumed = start
+        pending = b""
+        for chunk in chunks:
+            #Only complete lines are consumed, a partial last line is read again in the next run
+            *lines, pending = (pending + chunk).split(b"\n")
+            for raw_line in lines:
+                consumed += len(raw_line) + 1
+                line = raw_line.decode("utf-8", errors="replace")
+                self.cursor["offset"] = consumed
+                self.cursor["anchor"] = line
+
+                parsed = parse_export_line(line)
+                if parsed and parsed[0] > last_slot:
+                    slots.append(parsed)
+        return slots
+
+    def pending_slots(self):
+        """
+        Returns the export files published after the last processed slot, oldest first.
+
+        When there is no cursor (first run), only the latest slot is returned. When the latest slot directly follows
+        the last processed one, only lastupdate.txt is read. Otherwise the new tail of the masterfilelist is read.
+
+        Returns
+        -------
+        list of tuple of (datetime, str)
+            The slot datetime and export file URL of each pending slot.
+        """
+        latest = self._latest_slot()
+        last_slot = self.cursor.get("last_slot")
+
+        if last_slot is None:
+            return [latest]
+        if latest[0] <= last_slot:
+            return []
+        if latest[0] - last_slot == SLOT_INTERVAL:
+            return [latest]
+
+        #Some slots have been missed since the last run, look for them in the masterfilelist
+        slots = self._slots_from_masterfilelist(last_slot)
+        if latest not in slots:
+            slots.append(latest)
+        slots.sort()
+        if len(slots) > self.max_slots:
+            logger.warning(f"{len(slots)} slots pending, only the last {self.max_slots} will be processed.")
+            slots = slots[-self.max_slots:]
+        return slots
+
+    def failed_slots(self):
+        """
+        Returns the slots that failed in the previous runs and have not reached max_attempts yet, oldest first.
+
+        Returns
+        -------
+        list of tuple of (datetime, str)
+            The slot datetime and export file URL of each failed slot.
+        """
+        return sorted(
+            (datetime.strptime(key, "%Y%m%d%H%M%S"), failure["url"]) for key, failure in self.cursor.get("failed", {}).items()
+        )
+
+    def commit(self, slot):
+        """
+        Persists the slot as the last processed one.
+
+        Parameters
+        ----------
+        slot : datetime
+            The slot that has been processed.
+        """
+        if self.cursor.get("last_slot") is None or slot > self.cursor["last_slot"]:
+            self.cursor["last_slot"] = slot
+        self.cursor.get("failed", {}).pop(slot.strftime("%Y%m%d%H%M%S"), None)
+        self._save_cursor()
+
+    def fail(self, slot, url):
+        """
+        Records a slot that could not be processed and moves the cursor past it, so the next slots are processed. The
+        slot is returned by failed_slots until it is committed or it fails max_attempts times.
+
+        Parameters
+        ----------
+        slot : datetime
+            The slot that failed.
+        url : str
+            The URL of the export file of the slot.
+        """
+        key = slot.strftime("%Y%m%d%H%M%S")
+        failed = self.cursor.setdefault("failed", {})
+        attempts = failed.get(key, {}).get("attempts", 0) + 1
+        if attempts >= self.max_attempts:
+            logger.error(f"Slot {slot} failed {attempts} times, giving up on it.")
+            failed.pop(key, None)
+        else:
+            failed[key] = {"url": url, "attempts": attempts}
+        if self.cursor.get("last_slot") is None or slot > self.cursor["last_slot"]:
+            self.cursor["last_slot"] = slot
+        self._save_cursor()
@@ -0,0 +1,192 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from slot_discovery import SlotDiscovery, LAST_UPDATE_URL, MASTER_FILE_LIST_URL
+
+START = datetime(2024, 1, 1, 0, 0)
+
+def slot(i):
+    return START + timedelta(minutes=15 * i)
+
+def export_url(i):
+    return f"http://data.gdeltproject.org/gdeltv2/{slot(i).strftime('%Y%m%d%H%M%S')}.export.CSV.zip"
+
+def master_lines(n):
+    #Every slot has its export, mentions and gkg files in the masterfilelist
+    lines = []
+    for i in range(n):
+        stamp = slot(i).strftime('%Y%m%d%H%M%S')
+        lines.append(f"100 hash{i} {export_url(i)}")
+        lines.append(f"50 hash{i} http://data.gdeltproject.org/gdeltv2/{stamp}.mentions.CSV.zip")
+        lines.append(f"80 hash{i} http://data.gdeltproject.org/gdeltv2/{stamp}.gkg.csv.zip")
+    return "".join(line + "\n" for line in lines).encode()
+
+class FakeResponse:
+    def __init__(self, status_code, body, chunk_size=64):
+        self.status_code = status_code
+        self.body = body
+        self.chunk_size = chunk_size
+        self.content_read = False
+        self.bytes_streamed = 0
+        self.closed = False
+
+    @property
+    def content(self):
+        self.content_read = True
+        return self.body
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def iter_content(self, chunk_size=None):
+        #The fake streams in small chunks, so the anchor check spans several of them
+        for i in range(0, len(self.body), self.chunk_size):
+            self.bytes_streamed += len(self.body[i:i + self.chunk_size])
+            yield self.body[i:i + self.chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def close(self):
+        self.closed = True
+
+class FakeGdelt:
+    """
+    A requests.Session standing in for the GDELT server, with the given masterfilelist and latest slot. It honours the
+    Range header unless ignore_range is set, and records every request.
+    """
+    def __init__(self, n_slots, ignore_range=False):
+        self.master = master_lines(n_slots)
+        self.latest = n_slots - 1
+        self.ignore_range = ignore_range
+        self.requests = []
+        self.responses = []
+
+    def publish(self, n_slots):
+        self.master = master_lines(n_slots)
+        self.latest = n_slots - 1
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        headers = headers or {}
+        self.requests.append((url, headers.get("Range"), stream))
+        if url == LAST_UPDATE_URL:
+            response = FakeResponse(200, f"100 hash {export_url(self.latest)}\n".encode())
+        elif "Range" in headers and not self.ignore_range:
+            start = int(headers["Range"][len("bytes="):-1])
+            response = FakeResponse(206, self.master[start:]) if start < len(self.master) else FakeResponse(416, b"")
+        else:
+            response = FakeResponse(200, self.master)
+        self.responses.append(response)
+        return response
+
+    def master_requests(self):
+        return [(range_, stream) for url, range_, stream in self.requests if url == MASTER_FILE_LIST_URL]
+
+@pytest.fixture
+def cursor_path(tmp_path):
+    return str(tmp_path / "slot_cursor.json")
+
+def test_first_run_only_reads_lastupdate(cursor_path):
+    gdelt = FakeGdelt(10)
+    discovery = SlotDiscovery(cursor_path, session=gdelt)
+
+    assert discovery.pending_slots() == [(slot(9), export_url(9))]
+    assert gdelt.master_requests() == []
+
+def test_cursor_resume(cursor_path):
+    gdelt = FakeGdelt(10)
+    SlotDiscovery(cursor_path, session=gdelt).commit(slot(9))
+
+    #A new collector process resumes from the persisted cursor
+    gdelt.publish(11)
+    discovery = SlotDiscovery(cursor_path, session=gdelt)
+    assert discovery.pending_slots() == [(slot(10), export_url(10))]
+    assert discovery.pending_slots() == [(slot(10), export_url(10))]
+    discovery.commit(slot(10))
+
+    assert SlotDiscovery(cursor_path, session=gdelt).pending_slots() == []
+    assert gdelt.master_requests() == []
+    with open(cursor_path) as cursor_file:
+        assert json.load(cursor_file)["last_slot"] == slot(10).strftime("%Y%m%d%H%M%S")
+
+def test_missed_slots_read_the_tail(cursor_path):
+    gdelt = FakeGdelt(10)
+    discovery = SlotDiscovery(cursor_path, session=gdelt)
+    discovery.commit(slot(5))
+
+    #No offset yet, the whole masterfilelist is streamed once
+    assert discovery.pending_slots() == [(slot(i), export_url(i)) for i in range(6, 10)]
+    assert gdelt.master_requests() == [(None, True)]
+    discovery.commit(slot(9))
+
+    #Then only the tail after the offset is requested, starting at the anchor line
+    gdelt.publish(14)
+    assert discovery.pending_slots() == [(slot(i), export_url(i)) for i in range(10, 14)]
+    anchor = master_lines(10).split(b"\n")[-2]
+    assert gdelt.master_requests()[1:] == [(f"bytes={len(master_lines(10)) - len(anchor) - 1}-", True)]
+
+def test_anchor_mismatch_resyncs(cursor_path):
+    gdelt = FakeGdelt(10)
+    discovery = SlotDiscovery(cursor_path, session=gdelt)
+    discovery.commit(slot(5))
+    discovery.pending_slots()
+    discovery.commit(slot(9))
+
+    #The remote file changed before the offset (e.g. it was rewritten), the tail does not start with the anchor
+    gdelt.publish(14)
+    gdelt.master = b"0 rewritten http://example.com/x\n" + gdelt.master
+    assert discovery.pending_slots() == [(slot(i), export_url(i)) for i in range(10, 14)]
+
+    tail_response = gdelt.responses[-2]
+    assert tail_response.status_code == 206 and tail_response.closed and not tail_response.content_read
+    assert gdelt.master_requests()[-1] == (None, True)
+
+def test_ignored_range_is_read_once(cursor_path):
+    gdelt = FakeGdelt(10)
+    discovery = SlotDiscovery(cursor_path, session=gdelt)
+    discovery.commit(slot(5))
+    discovery.pending_slots()
+    discovery.commit(slot(9))
+
+    #The server answers the Range request with the whole file: it is streamed and used, not downloaded again
+    gdelt.ignore_range = True
+    gdelt.publish(14)
+    requests_before = len(gdelt.master_requests())
+    assert discovery.pending_slots() == [(slot(i), export_url(i)) for i in range(10, 14)]
+
+    response = gdelt.responses[-1]
+    assert len(gdelt.master_requests()) == requests_before + 1
+    assert response.status_code == 200 and not response.content_read
+
+def test_max_slots_keeps_the_latest(cursor_path):
+    gdelt = FakeGdelt(20)
+    discovery = SlotDiscovery(cursor_path, max_slots=3, session=gdelt)
+    discovery.commit(slot(5))
+
+    assert discovery.pending_slots() == [(slot(i), export_url(i)) for i in range(17, 20)]
+
+def test_failed_slots_are_retried(cursor_path):
+    gdelt = FakeGdelt(10)
+    discovery = SlotDiscovery(cursor_path, session=gdelt, max_attempts=2)
+    discovery.commit(slot(7))
+
+    #The failed slot moves the cursor, so the next slot is processed, and it is kept to be retried
+    discovery.fail(slot(8), export_url(8))
+    discovery.commit(slot(9))
+    discovery = SlotDiscovery(cursor_path, session=gdelt, max_attempts=2)
+    assert discovery.pending_slots() == []
+    assert discovery.failed_slots() == [(slot(8), export_url(8))]
+
+    #A retry that succeeds removes it
+    discovery.commit(slot(8))
+    assert discovery.failed_slots() == []
+
+    #And a slot that fails max_attempts times is given up
+    discovery.fail(slot(8), export_url(8))
+    discovery.fail(slot(8), export_url(8))
+    assert discovery.failed_slots() == []
+    assert discovery.cursor["last_slot"] == slot(9)
@@ -0,0 +1,271 @@
+## The url_index script defines a persistent index of the article URLs that have already been scraped. GDELT reports the
+# same article in many consecutive 15 minutes exports, so the collectors check the index before sending the URLs to the
+# scraper. The index is stored in SQLite and fronted by an in-memory Bloom filter, so most lookups of new URLs never
+# reach the database. The filter is rebuilt from the database when the index is opened, so the URLs older than the
+# retention period are removed first, keeping the size of the database and the startup time bounded.
+
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+def canonicalize_url(url):
+    """
+    Returns the canonical form of a URL used as key of the index: lowercase scheme and host, without 'utm_*' query
+    parameters, without fragment and without trailing slash in the path.
+
+    Parameters
+    ----------
+    url : str
+        The URL to canonicalize.
+
+    Returns
+    -------
+    str
+        The canonical URL.
+    """
+    parts = urlsplit(url.strip())
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not k.lower().startswith("utm_")])
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
+
+class BloomFilter:
+    """
+    A simple Bloom filter over strings, sized for an expected number of items and false positive rate.
+    """
+    def __init__(self, expected_items, false_positive_rate=0.01):
+        self.n_bits = max(8, int(-expected_items * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / expected_items * math.log(2)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+class SeenUrlIndex:
+    """
+    A class used to keep track of the article URLs already scraped, across slots and across runs.
+
+    Attributes
+    ----------
+    db_path : str
+        Path of the SQLite database where the canonical URLs are stored.
+    retention_days : float or None
+        Number of days a URL is kept in the index, None to keep them forever.
+    lookups : int
+        Number of URLs looked up since the index was opened.
+    hits : int
+        Number of looked up URLs that had already been scraped.
+
+    Methods
+    -------
+    filter_unseen(urls, claim=False)
+        Returns the URLs that have not been scraped yet, without duplicates, optionally claiming them.
+    mark_seen(urls)
+        Adds the URLs to the index.
+    release(urls)
+        Drops the claims of URLs that were not scraped in the end.
+    prune()
+        Removes the URLs older than the retention period.
+    stats()
+        Returns the size of the index, the lookup cost and the hit rate.
+    """
+    def __init__(self, db_path, expected_items=1000000, false_positive_rate=0.01, retention_days=None):
+        """
+        Parameters
+        ----------
+        db_path : str
+            Path of the SQLite database where the canonical URLs are stored. It is created if it does not exist.
+        expected_items : int, optional
+            Number of URLs the Bloom filter is sized for (default is 1000000). It grows if the index is bigger.
+        false_positive_rate : float, optional
+            Target false positive rate of the Bloom filter (default is 0.01).
+        retention_days : float, optional
+            Number of days a URL is kept in the index since it was first seen (default is None, forever). The older
+            URLs are removed when the index is opened.
+        """
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self.lookups = 0
+        self.hits = 0
+        self.pruned = 0
+        self._lookup_seconds = 0.0
+
+        #Canonical URLs claimed by the slots in flight, not yet in the index
+        self._claimed = set()
+
+        #The connection is shared by the worker threads, so every access goes through the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seen_urls (url TEXT PRIMARY KEY, first_seen REAL) WITHOUT ROWID")
+
+        #Indexes created before the retention have no first_seen column, their URLs are considered first seen now
+        if "first_seen" not in [column[1] for column in self._conn.execute("PRAGMA table_info(seen_urls)")]:
+            self._conn.execute("ALTER TABLE seen_urls ADD COLUMN first_seen REAL")
+            self._conn.execute("UPDATE seen_urls SET first_seen = ?", (time.time(),))
+        self._conn.execute("CREATE INDEX IF NOT EXISTS seen_urls_first_seen ON seen_urls (first_seen)")
+        self._conn.commit()
+
+        self.prune()
+
+        #Load the existing URLs into the Bloom filter
+        start = time.perf_counter()
+        size = self._conn.execute("SELECT COUNT(*) FROM seen_urls").fetchone()[0]
+        self._bloom = BloomFilter(max(expected_items, 2 * size), false_positive_rate)
+        for (url,) in self._conn.execute("SELECT url FROM seen_urls"):
+            self._bloom.add(url)
+        self.load_seconds = time.perf_counter() - start
+        logger.info(f"Seen urls index: {size} urls loaded in {self.load_seconds:.2f}s ({self.pruned} expired urls removed).")
+
+    def prune(self):
+        """
+        Removes the URLs first seen before the retention period. The Bloom filter is not rebuilt, the removed URLs
+        are only checked against the database (and not found) until the index is opened again.
+
+        Returns
+        -------
+        int
+            The number of URLs removed.
+        """
+        if self.retention_days is None:
+            return 0
+        cutoff = time.time() - self.retention_days * 24 * 3600
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM seen_urls WHERE first_seen < ?", (cutoff,)).rowcount
+            self._conn.commit()
+            self.pruned += removed
+        return removed
+
+    def filter_unseen(self, urls, claim=False):
+        """
+        Returns the URLs that have not been scraped yet, removing the ones that share the same canonical form.
+
+        Parameters
+        ----------
+        urls : list of str
+            The URLs to check.
+        claim : bool, optional
+            If True, the URLs claimed by a previous call are skipped too, and the returned URLs are claimed until they
+            are marked as seen or released. Used when the URLs of the following slots are checked before the current
+            ones are saved (default is False).
+
+        Returns
+        -------
+        list of str
+            The URLs (in their original form) that are not in the index, in the same order.
+        """
+        start = time.perf_counter()
+        unseen = []
+        batch_keys = set()
+        with self._lock:
+            for url in urls:
+                key = canonicalize_url(url)
+                if key in batch_keys:
+                    continue
+                batch_keys.add(key)
+
+                #Only a positive answer of the Bloom filter needs to be confirmed in the database
+                seen = (claim and key in self._claimed) or (key in self._bloom and self._conn.execute(
+                    "SELECT 1 FROM seen_urls WHERE url = ?", (key,)
+                ).fetchone() is not None)
+
+                self.lookups += 1
+                if seen:
+                    self.hits += 1
+                else:
+                    unseen.append(url)
+                    if claim:
+                        self._claimed.add(key)
+            self._lookup_seconds += time.perf_counter() - start
+        return unseen
+
+    def mark_seen(self, urls):
+        """
+        Adds the URLs to the index, dropping their claims.
+
+        Parameters
+        ----------
+        urls : iterable of str
+            The URLs that have been scraped.
+        """
+        keys = [canonicalize_url(url) for url in urls]
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO seen_urls (url, first_seen) VALUES (?, ?)", [(key, now) for key in keys])
+            self._conn.commit()
+            for key in keys:
+                self._bloom.add(key)
+            self._claimed.difference_update(keys)
+
+    def release(self, urls):
+        """
+        Drops the claims of the URLs, so they can be scraped again from another slot (e.g. their slot failed).
+
+        Parameters
+        ----------
+        urls : iterable of str
+            The claimed URLs that were not saved.
+        """
+        keys = [canonicalize_url(url) for url in urls]
+        with self._lock:
+            self._claimed.difference_update(keys)
+
+    def stats(self):
+        """
+        Returns the size of the index, the average lookup cost and the hit rate since it was opened.
+
+        Returns
+        -------
+        dict
+            The 'size', 'lookups', 'hits', 'hit_rate', 'avg_lookup_us' (microseconds), 'pruned' (URLs removed by the
+            retention), 'load_seconds' (time to rebuild the Bloom filter when the index was opened) and 'claimed' (URLs
+            of the slots in flight) of the index.
+        """
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM seen_urls").fetchone()[0]
+            return {
+                "size": size,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "avg_lookup_us": 1e6 * self._lookup_seconds / self.lookups if self.lookups else 0.0,
+                "pruned": self.pruned,
+                "load_seconds": round(self.load_seconds, 3),
+                "claimed": len(self._claimed)
+            }
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+def index_from_env():
+    """
+    Creates a SeenUrlIndex configured with the SEEN_URL_INDEX_PATH (default 'seen_urls.sqlite3') and
+    SEEN_URL_RETENTION_DAYS (default 30, 0 to keep the URLs forever) environment variables.
+
+    Returns
+    -------
+    SeenUrlIndex
+        The index of the scraped URLs.
+    """
+    retention_days = float(os.getenv('SEEN_URL_RETENTION_DAYS', 30))
+    return SeenUrlIndex(os.getenv('SEEN_URL_INDEX_PATH', 'seen_urls.sqlite3'), retention_days=retention_days or None)
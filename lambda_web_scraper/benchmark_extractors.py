@@ -0,0 +1,71 @@
+## Compares the HTML extractors defined in lambda_scraper.py over a corpus of saved pages. It checks that every extractor
+# returns the same output as the reference BeautifulSoup extractor (extract_bs4) and reports the pages per second that
+# each extractor parses on a single core.
+#
+# Usage: python benchmark_extractors.py <corpus_dir> [repetitions]
+#   <corpus_dir>: Directory with the raw HTML of the pages, one file per page (e.g. saved with curl from GDELT urls).
+#   [repetitions]: Number of times the corpus is parsed by each extractor (default 3).
+
+import os
+import sys
+import time
+from lambda_scraper import EXTRACTORS, extract_bs4
+
+def load_corpus(corpus_dir):
+    """
+    Loads the raw content of every file in the directory.
+    """
+    corpus = {}
+    for name in sorted(os.listdir(corpus_dir)):
+        path = os.path.join(corpus_dir, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as page_file:
+                corpus[name] = page_file.read()
+    return corpus
+
+def check_equivalence(corpus):
+    """
+    Returns, for each extractor, the names of the pages whose output differs from extract_bs4.
+    """
+    reference = {name: extract_bs4(content) for name, content in corpus.items()}
+    return {
+        extractor_name: [name for name, content in corpus.items() if extractor(content) != reference[name]]
+        for extractor_name, extractor in EXTRACTORS.items()
+    }
+
+def benchmark(corpus, repetitions=3):
+    """
+    Returns the pages per second parsed by each extractor on a single core.
+    """
+    pages_per_second = {}
+    for extractor_name, extractor in EXTRACTORS.items():
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            for content in corpus.values():
+                extractor(content)
+        pages_per_second[extractor_name] = repetitions * len(corpus) / (time.perf_counter() - start)
+    return pages_per_second
+
+if __name__ == "__main__":
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python benchmark_extractors.py <corpus_dir> [repetitions]")
+        sys.exit(1)
+
+    corpus = load_corpus(sys.argv[1])
+    repetitions = int(sys.argv[2]) if len(sys.argv) == 3 else 3
+    if not corpus:
+        print("The corpus directory is empty.")
+        sys.exit(1)
+
+    print(f"Corpus: {len(corpus)} pages, {sum(len(c) for c in corpus.values()) / 1024 ** 2:.1f} MB")
+
+    #Equivalence against the reference extractor
+    for extractor_name, different in check_equivalence(corpus).items():
+        print(f"{extractor_name}: {len(corpus) - len(different)}/{len(corpus)} pages identical to bs4")
+        for name in different:
+            print(f"    differs: {name}")
+
+    #Throughput
+    for extractor_name, rate in benchmark(corpus, repetitions).items():
+        print(f"{extractor_name}: {rate:.1f} pages/s per core")
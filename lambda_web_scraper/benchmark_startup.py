@@ -0,0 +1,64 @@
+## Measures the startup cost of the modules of the project: the time to import each module in a fresh interpreter (as a
+# Lambda cold start or a new container would do), and the heaviest modules it imports, from python -X importtime.
+#
+# Usage: python benchmark_startup.py [module_path ...] [--repetitions N] [--top N]
+#   [module_path]: Paths of the python files to measure (default is lambda_scraper.py next to this script). Each module is
+#                  imported from its own directory, e.g. ../data_cleaner/cleaner.py
+#   --repetitions: Number of fresh interpreters started for each module, the median is reported (default 5).
+#   --top: Number of heaviest imports listed for each module (default 5).
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+def import_times(module_path):
+    """
+    Imports the module in a fresh interpreter with -X importtime and returns its total import time and the cumulative
+    time of each of its direct imports, in microseconds.
+    """
+    directory, file_name = os.path.split(os.path.abspath(module_path))
+    module = os.path.splitext(file_name)[0]
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=directory, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module_path} failed:\n{completed.stderr[-2000:]}")
+
+    #Lines have the format "import time: <self us> | <cumulative us> | <indentation><module>"
+    pending = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+
+        #Modules are listed after the modules they import, so the direct imports of a module are the depth 1 lines
+        # since the previous depth 0 line (the interpreter startup imports are also listed at depth 0)
+        if depth == 0:
+            if name.strip() == module:
+                return int(cumulative), pending
+            pending = {}
+        elif depth == 1:
+            pending[name.strip()] = int(cumulative)
+    return 0, pending
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Reports the import time of each module.")
+    parser.add_argument("module_paths", nargs="*", default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambda_scraper.py")])
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    for module_path in args.module_paths:
+        runs = [import_times(module_path) for _ in range(args.repetitions)]
+        total = statistics.median(run[0] for run in runs)
+        print(f"{module_path}: {total / 1000:.1f} ms (median of {args.repetitions} imports)")
+
+        #Heaviest direct imports of the median run
+        _, children = sorted(runs, key=lambda run: run[0])[len(runs) // 2]
+        for name, cumulative in sorted(children.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {name}: {cumulative / 1000:.1f} ms")
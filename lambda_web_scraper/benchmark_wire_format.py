@@ -0,0 +1,81 @@
+## Compares the response formats of the scraper function: the size of the payload returned by Lambda (the response is
+# encoded as JSON by Lambda) and the time to encode it in the function and to decode it into a DataFrame in the
+# collectors, for 'json' (a JSON string with the list of records) and 'columnar-gzip-v1'. It also checks that both
+# formats decode to the same DataFrame.
+#
+# Usage: python benchmark_wire_format.py [corpus_dir] [repetitions]
+#   [corpus_dir]: Directory with article bodies, one '.txt' file per article (default is a generated sample of 500
+#                 articles of about 4000 characters).
+#   [repetitions]: Number of times each format is encoded and decoded, the best time is reported (default 5).
+
+import os
+import sys
+import json
+import time
+import random
+from lambda_scraper import build_response, RESPONSE_FORMATS
+
+#The decoder of the collectors
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gdelt_news_collector", "real_time_collector"))
+from lambda_payload import decode_response
+
+def load_records(corpus_dir):
+    """
+    Builds a record for every '.txt' file of the directory, with the file content as body.
+    """
+    records = []
+    for file_name in sorted(os.listdir(corpus_dir)):
+        if file_name.endswith(".txt"):
+            with open(os.path.join(corpus_dir, file_name), encoding="utf-8", errors="replace") as f:
+                body = f.read()
+            records.append({"url": f"https://example.com/{file_name}", "title": file_name, "body": body})
+    return records
+
+def generate_records(n_articles=500, article_length=4000, seed=0):
+    """
+    Generates records with article-like bodies: words of a limited vocabulary, punctuation, quotes and some non ASCII
+    characters (escaped by json.dumps).
+    """
+    rng = random.Random(seed)
+    vocabulary = [rng.choice(["the", "of", "said", "government", "minister", "people", "año", "“quoted”", "2024", "percent"]) + str(i % 7) * (i % 3) for i in range(400)]
+    records = []
+    for i in range(n_articles):
+        words = []
+        while sum(len(word) + 1 for word in words) < article_length:
+            words.append(rng.choice(vocabulary) + rng.choice(["", "", "", ".", ",", "\n"]))
+        records.append({"url": f"https://news{i % 50}.example.com/article/{i}", "title": f"Title of the article {i}", "body": " ".join(words)})
+    return records
+
+def measure(records, response_format, repetitions):
+    """
+    Returns the size of the Lambda payload and the best encode and decode times of the format.
+    """
+    encode_times, decode_times = [], []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        payload = json.dumps(build_response(records, response_format, max_inline_bytes=float("inf"))).encode("utf-8")
+        encode_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        df, _ = decode_response(payload)
+        decode_times.append(time.perf_counter() - start)
+    return len(payload), min(encode_times), min(decode_times), df
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 3:
+        print("Usage: python benchmark_wire_format.py [corpus_dir] [repetitions]")
+        sys.exit(1)
+
+    records = load_records(sys.argv[1]) if len(sys.argv) >= 2 else generate_records()
+    repetitions = int(sys.argv[2]) if len(sys.argv) == 3 else 5
+    raw_bytes = sum(len(record["body"].encode("utf-8")) for record in records)
+    print(f"{len(records)} records, {raw_bytes / 1024 ** 2:.2f} MB of bodies")
+
+    decoded = {}
+    for response_format in RESPONSE_FORMATS:
+        size, encode_time, decode_time, decoded[response_format] = measure(records, response_format, repetitions)
+        print(f"{response_format}: payload {size / 1024 ** 2:.2f} MB, encode {1000 * encode_time:.1f} ms, decode {1000 * decode_time:.1f} ms")
+
+    frames = list(decoded.values())
+    print("Same records:", all(frame.equals(frames[0]) for frame in frames[1:]))
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+#The modules of the package are run as scripts from its directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+class PageServer:
+    """
+    A local HTTP server with canned article pages, standing in for the news sites:
+    - /page/<n>: an article with the title 'Page <n>' (after 'delay' seconds, 0.02 by default).
+    - /slow/<n>: the same article after 'slow_delay' seconds (5 by default).
+    - /big/<n>: an article with 'big_paragraphs' paragraphs (2000 by default), slow to parse.
+    - any other path: 404.
+    It records the maximum number of requests served at the same time.
+    """
+    def __init__(self, delay=0.02, slow_delay=5.0, big_paragraphs=2000):
+        self.delay = delay
+        self.slow_delay = slow_delay
+        self.big_paragraphs = big_paragraphs
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+
+    @staticmethod
+    def page(name, n_paragraphs=3):
+        paragraphs = "".join(f"<p>Paragraph {i} of {name}.</p>" for i in range(n_paragraphs))
+        return f"<html><head><title>{name}</title></head><body>{paragraphs}</body></html>".encode("utf-8")
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    kind, _, name = self.path.strip("/").partition("/")
+                    if kind not in ("page", "slow", "big"):
+                        self.send_error(404)
+                        return
+                    time.sleep(server.slow_delay if kind == "slow" else server.delay)
+                    body = server.page(f"Page {name}", server.big_paragraphs if kind == "big" else 3)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    #The client gave up on the request
+                    pass
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def urls(self, kind, n, start=0):
+        return [f"{self.base_url}/{kind}/{i}" for i in range(start, start + n)]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+@pytest.fixture
+def page_server():
+    server = PageServer()
+    server.start()
+    yield server
+    server.stop()
@@ -0,0 +1,25 @@
+import os
+import pytest
+from lambda_scraper import EXTRACTORS, extract_bs4
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+
+def load_page(name):
+    with open(os.path.join(PAGES_DIR, name), "rb") as page_file:
+        return page_file.read()
+
+@pytest.mark.parametrize("extractor", [name for name in EXTRACTORS if name != "bs4"])
+@pytest.mark.parametrize("page", sorted(os.listdir(PAGES_DIR)))
+def test_same_output_as_bs4(extractor, page):
+    content = load_page(page)
+    assert EXTRACTORS[extractor](content) == extract_bs4(content)
+
+def test_block_inside_paragraph():
+    #The text after the block element is part of the paragraph, as in html.parser
+    assert EXTRACTORS["lxml"](b"<p>a<div>b</div>c</p>") == [None, "abc"]
+
+def test_article_page():
+    title, body = EXTRACTORS["lxml"](load_page("article_windows1252.html"))
+    assert title == "Ministro anuncia el presupuesto | Diario"
+    assert "«reducir el déficit»" in body
+    assert "trackPage" not in body and "dataLayer" not in body
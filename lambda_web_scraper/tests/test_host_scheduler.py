@@ -0,0 +1,119 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import lambda_scraper
+from lambda_scraper import HostScheduler, run_by_host, create_session, get_session
+
+def test_round_robin_between_hosts():
+    urls = ["http://a.com/1", "http://a.com/2", "http://a.com/3", "http://b.com/1", "http://b.com/2", "http://c.com/1"]
+    scheduler = HostScheduler(urls, max_per_host=10)
+
+    handed_out = []
+    while scheduler.has_pending():
+        handed_out.append(scheduler.next_url())
+
+    assert handed_out == ["http://a.com/1", "http://b.com/1", "http://c.com/1", "http://a.com/2", "http://b.com/2", "http://a.com/3"]
+
+def test_cap_per_host():
+    scheduler = HostScheduler(["http://a.com/1", "http://A.com/2", "http://a.com/3", "http://b.com/1"], max_per_host=2)
+
+    assert [scheduler.next_url() for _ in range(3)] == ["http://a.com/1", "http://b.com/1", "http://A.com/2"]
+    #a.com has 2 requests in flight, b.com has no URLs left
+    assert scheduler.next_url() is None
+
+    scheduler.release("http://a.com/1")
+    assert scheduler.next_url() == "http://a.com/3"
+    assert not scheduler.has_pending()
+
+def test_drain():
+    scheduler = HostScheduler(["http://a.com/1", "http://a.com/2", "http://b.com/1"], max_per_host=1)
+    scheduler.next_url()
+
+    assert sorted(scheduler.drain()) == ["http://a.com/2", "http://b.com/1"]
+    assert not scheduler.has_pending()
+    assert scheduler.next_url() is None
+
+class FakeTask:
+    """
+    A task with a latency per host. The requests to the hosts in 'blocked' wait until release() is called (or until
+    5 seconds pass). It records the maximum number of tasks in flight per host.
+    """
+    def __init__(self, latency, blocked=()):
+        self.latency = latency
+        self.blocked = set(blocked)
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self.released = threading.Event()
+        self._lock = threading.Lock()
+
+    def release(self):
+        self.released.set()
+
+    def __call__(self, url):
+        host = HostScheduler.host(url)
+        with self._lock:
+            self.in_flight[host] = self.in_flight.get(host, 0) + 1
+            self.max_in_flight[host] = max(self.max_in_flight.get(host, 0), self.in_flight[host])
+        try:
+            if host in self.blocked:
+                self.released.wait(5)
+            time.sleep(self.latency.get(host, 0))
+            return url
+        finally:
+            with self._lock:
+                self.in_flight[host] -= 1
+
+def host_urls(host, n):
+    return [f"http://{host}/{i}" for i in range(n)]
+
+def test_slow_host_does_not_starve_the_others():
+    urls = host_urls("slow.com", 6) + host_urls("a.com", 10) + host_urls("b.com", 10)
+    task = FakeTask({"a.com": 0.001, "b.com": 0.002}, blocked={"slow.com"})
+
+    completed = []
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for url, future in run_by_host(executor, urls, 4, 2, task):
+            completed.append(future.result())
+            #Every URL of the fast hosts completes while the slow host still holds its 2 workers
+            if len(completed) == 20:
+                assert sorted(completed) == sorted(host_urls("a.com", 10) + host_urls("b.com", 10))
+                task.release()
+
+    assert sorted(completed) == sorted(urls)
+    assert max(task.max_in_flight.values()) <= 2
+    assert task.max_in_flight["slow.com"] == 2
+
+def test_deadline_returns_unfinished():
+    urls = host_urls("slow.com", 5) + host_urls("a.com", 5)
+    task = FakeTask({}, blocked={"slow.com"})
+    unfinished = []
+
+    completed = []
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        deadline = time.monotonic() + 0.3
+        for url, future in run_by_host(executor, urls, 3, 2, task, deadline=deadline, unfinished=unfinished):
+            completed.append(future.result())
+        task.release()
+
+    assert sorted(completed) == host_urls("a.com", 5)
+    #The 2 requests in flight to the slow host and the 3 never requested
+    assert sorted(unfinished) == host_urls("slow.com", 5)
+
+def test_session_pool_sizing(monkeypatch):
+    session = create_session(max_per_host=3, max_hosts=7)
+    adapter = session.get_adapter("https://example.com")
+
+    assert adapter._pool_connections == 7
+    assert adapter._pool_maxsize == 3
+    assert session.get_adapter("http://example.com") is adapter
+
+    #The shared session is reused while the cap per host does not change
+    monkeypatch.setattr(lambda_scraper, "_session", None)
+    shared = get_session(max_per_host=3)
+    assert get_session(max_per_host=3) is shared
+    resized = get_session(max_per_host=5)
+    assert resized is not shared
+    assert resized.get_adapter("https://example.com")._pool_maxsize == 5
@@ -0,0 +1,26 @@
+import json
+import gzip
+import base64
+
+from lambda_scraper import build_response, RESPONSE_FORMAT_JSON, RESPONSE_FORMAT_COLUMNAR
+
+RECORDS = [
+    {"url": "https://a.com/1", "title": "First", "body": "First body."},
+    {"url": "https://b.com/2", "title": "Second", "body": "Second body."},
+]
+
+def test_json_without_unfinished_urls_is_the_plain_string():
+    assert json.loads(build_response(RECORDS, RESPONSE_FORMAT_JSON)) == RECORDS
+
+def test_json_reports_the_unfinished_urls():
+    response = build_response(RECORDS, RESPONSE_FORMAT_JSON, unfinished=["https://c.com/3"])
+
+    assert response == {"format": RESPONSE_FORMAT_JSON, "records": RECORDS, "unfinished": ["https://c.com/3"]}
+
+def test_columnar_reports_the_unfinished_urls():
+    response = build_response(RECORDS, RESPONSE_FORMAT_COLUMNAR, unfinished=["https://c.com/3"])
+    columns = json.loads(gzip.decompress(base64.b64decode(response["data"])))
+
+    assert response["count"] == 2
+    assert response["unfinished"] == ["https://c.com/3"]
+    assert columns["url"] == ["https://a.com/1", "https://b.com/2"]
@@ -0,0 +1,91 @@
+import time
+import pytest
+import lambda_scraper
+from lambda_scraper import SCRAPING_BACKENDS
+
+def scraped_urls(results):
+    return [url for result in results for url, data in result.items() if data is not None]
+
+@pytest.mark.parametrize("backend", list(SCRAPING_BACKENDS))
+def test_time_budget(page_server, backend):
+    urls = page_server.urls("page", 20) + page_server.urls("slow", 4)
+    unfinished = []
+
+    start = time.monotonic()
+    results = SCRAPING_BACKENDS[backend](urls, max_workers=4, timeout=10, max_per_host=8, time_budget=1.0, unfinished=unfinished)
+    elapsed = time.monotonic() - start
+
+    scraped = scraped_urls(results)
+    assert elapsed < 2.0
+    assert sorted(scraped) == sorted(page_server.urls("page", 20))
+    assert sorted(unfinished) == sorted(page_server.urls("slow", 4))
+
+def test_pipeline_time_budget_with_slow_parses(page_server):
+    #Pages slow to parse, with a single parse worker and a queue of one page: at the deadline pages are waiting in
+    # the queue, blocked on the put and being parsed
+    page_server.big_paragraphs = 5000
+    urls = page_server.urls("big", 30) + page_server.urls("slow", 2)
+    unfinished = []
+
+    start = time.monotonic()
+    results = lambda_scraper.pipelined_scraping(
+        urls, max_workers=8, max_per_host=8, parse_workers=1, queue_size=1, time_budget=1.0, unfinished=unfinished
+    )
+    elapsed = time.monotonic() - start
+
+    scraped = scraped_urls(results)
+    assert elapsed < 2.0
+    assert len(unfinished) == len(set(unfinished))
+    assert not set(scraped) & set(unfinished)
+    assert sorted(scraped + unfinished) == sorted(urls)
+
+def records(results):
+    return sorted((url, data) for result in results for url, data in result.items() if data is not None)
+
+def test_asyncio_and_threads_return_the_same_records(page_server):
+    urls = page_server.urls("page", 30) + page_server.urls("missing", 3)
+
+    threads = SCRAPING_BACKENDS["threads"](urls, max_workers=8, timeout=5, max_per_host=4)
+    asyncio = SCRAPING_BACKENDS["asyncio"](urls, max_workers=8, timeout=5, max_per_host=4)
+
+    assert len(records(threads)) == 30
+    assert records(asyncio) == records(threads)
+
+@pytest.mark.parametrize("backend", list(SCRAPING_BACKENDS))
+def test_max_per_host(page_server, backend):
+    #Every URL is on the same host, so at most max_per_host requests can be served at the same time
+    page_server.delay = 0.05
+    urls = page_server.urls("page", 40)
+
+    results = SCRAPING_BACKENDS[backend](urls, max_workers=16, timeout=5, max_per_host=3)
+
+    assert len(scraped_urls(results)) == 40
+    assert 1 < page_server.max_in_flight <= 3
+
+def test_pipeline_reuses_the_parse_pool(page_server):
+    urls = page_server.urls("page", 10)
+
+    first = lambda_scraper.pipelined_scraping(urls, max_workers=4, parse_workers=2)
+    pool = lambda_scraper.start_parse_pool()
+    second = lambda_scraper.pipelined_scraping(urls, max_workers=4, parse_workers=2)
+
+    assert lambda_scraper.start_parse_pool() is pool
+    assert records(first) == records(second)
+    assert len(records(first)) == 10
+
+@pytest.mark.parametrize("event_workers, backend, expected", [
+    (None, "threads", 10), (None, "asyncio", 200), (None, "pipeline", 50), (30, "asyncio", 30),
+])
+def test_handler_max_workers(monkeypatch, event_workers, backend, expected):
+    calls = []
+    def fake_backend(urls, max_workers, **options):
+        calls.append(max_workers)
+        return []
+    monkeypatch.setitem(SCRAPING_BACKENDS, backend, fake_backend)
+
+    event = {"urls": ["https://example.com/a"], "backend": backend}
+    if event_workers is not None:
+        event["max_workers"] = event_workers
+    lambda_scraper.lambda_handler(event, None)
+
+    assert calls == [expected]